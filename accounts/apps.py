@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "accounts"
+
+    def ready(self):
+        # save()・delete()でキャッシュを消すシグナルを、キャッシュを使わないプロセスでも登録する
+        from . import caches  # noqa: F401
@@ -0,0 +1,21 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .caches import users
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    リクエストごとのセッションのユーザーを、DBではなくキャッシュ(accounts/caches.py)から読む
+
+    パスワードの変更・ログイン(last_login)はsave()するので、キャッシュも作り直される。
+    他のプロセス(changepassword、run_tasksでのユーザーの削除など)での変更は、settings.CACHESを共有しているので、
+    このプロセスにも最長settings.OBJECT_CACHE["LOCAL_TIMEOUT"]秒で反映される
+    """
+
+    def get_user(self, user_id):
+        user = users.get(self.get_user_id(user_id))
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    def get_user_id(self, user_id):
+        # セッションには主キーが文字列で保存されている
+        return users.model._meta.pk.to_python(user_id)
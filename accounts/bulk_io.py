@@ -0,0 +1,167 @@
+"""
+フォロー・いいねのグラフをNDJSON/CSVで入出力するための共通処理を定義します
+
+どちらも一定の件数(chunk)ずつ読み書きするので、件数が数百万でもメモリ使用量は一定です
+"""
+
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from .models import User
+
+FORMATS = ("ndjson", "csv")
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def write_rows(stream, rows, fieldnames, fmt):
+    """
+    rows(値のtuple)をstreamに書き出し、書き出した件数を返す
+    """
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(fieldnames)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(dict(zip(fieldnames, row)), ensure_ascii=False))
+            stream.write("\n")
+            count += 1
+    return count
+
+
+def parse_ndjson(stream):
+    """
+    (行番号, 値)を返す。空行は読み飛ばし、JSONとして読めない行はエラーにする
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise CommandError(f"{line_number}行目の形式が不正です: {line.strip()!r}") from exc
+
+
+def read_rows(stream, fieldnames, fmt, clean=None):
+    """
+    streamから1行ずつdictとして読み出す。JSONとして読めない行、必要なフィールドが欠けている行と、
+    clean(row)がValueErrorを出す行はエラーにする
+    """
+    if fmt == "csv":
+        rows = enumerate(csv.DictReader(stream), start=1)
+    else:
+        rows = parse_ndjson(stream)
+    for line_number, row in rows:
+        if not isinstance(row, dict) or any(row.get(field) in (None, "") for field in fieldnames):
+            raise CommandError(f"{line_number}行目の形式が不正です: {row!r}")
+        if clean is not None:
+            try:
+                row = clean(row)
+            except ValueError as exc:
+                raise CommandError(f"{line_number}行目の形式が不正です: {row!r}") from exc
+        yield row
+
+
+def resolve_usernames(usernames):
+    """
+    ユーザー名の集合を1クエリで{username: id}に変換する
+    """
+    return dict(User.objects.filter(username__in=set(usernames)).values_list("username", "id"))
+
+
+class Throughput:
+    def __init__(self):
+        self.started_at = time.monotonic()
+
+    def report(self, count, label):
+        elapsed = time.monotonic() - self.started_at
+        rate = count / elapsed if elapsed > 0 else 0
+        return f"{label}: {count}件 ({elapsed:.1f}秒, {rate:.0f}件/秒)"
+
+
+class BaseExportCommand(BaseCommand):
+    """
+    get_rows()が返す値のtupleをNDJSON/CSVで書き出すコマンドの基底クラス
+    """
+
+    fieldnames = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="-", help="出力先のファイル(省略時は標準出力)")
+        parser.add_argument("--format", choices=FORMATS, default="ndjson")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def get_rows(self, chunk_size):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        throughput = Throughput()
+        rows = self.get_rows(options["chunk_size"])
+        if options["output"] == "-":
+            count = write_rows(sys.stdout, rows, self.fieldnames, options["format"])
+        else:
+            with open(options["output"], "w", newline="", encoding="utf-8") as stream:
+                count = write_rows(stream, rows, self.fieldnames, options["format"])
+        # 標準出力はデータに使うので、進捗は標準エラーに出す
+        self.stderr.write(throughput.report(count, "exported"))
+
+
+class BaseImportCommand(BaseCommand):
+    """
+    NDJSON/CSVをchunkごとに読み込み、import_chunk()でbulk_createするコマンドの基底クラス
+    """
+
+    fieldnames = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument("--input", default="-", help="入力元のファイル(省略時は標準入力)")
+        parser.add_argument("--format", choices=FORMATS, default="ndjson")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def clean_row(self, row):
+        """
+        読み込んだ行の値を変換して返す。不正な値はValueErrorにする
+        """
+        return row
+
+    def import_chunk(self, rows):
+        """
+        rowsを保存し、保存を試みた件数を返す(ユニーク制約で無視された行も含む)
+        """
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        if options["input"] == "-":
+            self.import_stream(sys.stdin, options)
+        else:
+            with open(options["input"], newline="", encoding="utf-8") as stream:
+                self.import_stream(stream, options)
+
+    def import_stream(self, stream, options):
+        throughput = Throughput()
+        processed = imported = 0
+        rows = read_rows(stream, self.fieldnames, options["format"], self.clean_row)
+        for chunk in chunked(rows, options["chunk_size"]):
+            # 1chunkごとにcommitしてトランザクションを短く保つ
+            with transaction.atomic():
+                imported += self.import_chunk(chunk)
+            processed += len(chunk)
+            self.stdout.write(throughput.report(processed, "processed"))
+        # ignore_conflictsで無視された既存の行もimportedに含まれる
+        self.stdout.write(throughput.report(imported, "imported"))
+        self.stdout.write(f"skipped (存在しないユーザー・ツイートなど): {processed - imported}件")
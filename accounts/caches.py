@@ -0,0 +1,41 @@
+"""
+ユーザーのキャッシュ(mysite/objcache.py)と、プロフィールに表示するフォロー数のキャッシュを定義します
+"""
+
+from django.conf import settings
+
+from mysite import caching, page_cache
+from mysite.objcache import ObjectCache
+
+from .models import Follow, User
+
+users = ObjectCache(User)
+
+
+def follow_counts_key(username):
+    return f"accounts:follow_counts:{username}"
+
+
+def follow_counts(user):
+    """
+    (userがフォローしている数, フォローされている数)。人気のユーザーでもCOUNTはキャッシュがないときの1回だけ
+    """
+
+    def compute():
+        return (Follow.objects.filter(follower=user).count(), Follow.objects.filter(followed=user).count())
+
+    return caching.get_or_set(
+        follow_counts_key(user.username), compute, settings.FOLLOW_COUNTS_TIMEOUT, family="follow_counts"
+    )
+
+
+def invalidate_follow_counts(*usernames):
+    """
+    usernamesのフォロー数と、プロフィールのページのキャッシュを消す
+
+    フォローを追加・削除する処理(ビュー、import_follows、ユーザーの削除)は、commitした後に必ず呼ぶ
+    """
+    for username in usernames:
+        caching.delete(follow_counts_key(username))
+    # どちらのユーザーのページもフォロー数が変わる
+    page_cache.purge(*(page_cache.user_tag(username) for username in usernames))
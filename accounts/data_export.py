@@ -0,0 +1,54 @@
+"""
+ユーザー本人のデータ(ツイート・いいね・フォロー)をNDJSONで書き出す処理を定義します
+
+各テーブルはiterator(chunk_size=...)で少しずつ読むので、件数が多いアカウントでもメモリ使用量は一定です
+"""
+
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from tweets import archive, sharding
+from tweets.models import Like, Tweet
+
+from .models import Follow
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def iter_user_records(user, chunk_size=DEFAULT_CHUNK_SIZE):
+    yield {"type": "user", "username": user.username, "email": user.email, "date_joined": user.date_joined}
+
+    tweets = Tweet.objects.filter(author=user).order_by("pk").values("id", "content", "created_at")
+    tweets = sharding.on_shard(tweets, sharding.db_for_user(user.pk))
+    for tweet in tweets.iterator(chunk_size=chunk_size):
+        yield {"type": "tweet", **tweet}
+
+    # いいねは各ツイートのシャードに分散している
+    likes = Like.objects.filter(user=user).order_by("pk").values_list("tweet_id", flat=True)
+    for db in sharding.databases():
+        for tweet_id in likes.using(db).iterator(chunk_size=chunk_size):
+            yield {"type": "like", "tweet_id": tweet_id}
+
+    # アーカイブ(tweets/archive.py)に移したツイート・いいねも含める
+    store = archive.get_store()
+    if store is not None:
+        for kind, record in store.iter_user_records(user.pk):
+            if kind == "tweet":
+                tweet_id, content, created_at = record
+                yield {"type": "tweet", "id": tweet_id, "content": content, "created_at": created_at}
+            else:
+                yield {"type": "like", "tweet_id": record}
+
+    following = Follow.objects.filter(follower=user).order_by("pk").values_list("followed__username", "created_at")
+    for username, created_at in following.iterator(chunk_size=chunk_size):
+        yield {"type": "following", "username": username, "created_at": created_at}
+
+    followers = Follow.objects.filter(followed=user).order_by("pk").values_list("follower__username", "created_at")
+    for username, created_at in followers.iterator(chunk_size=chunk_size):
+        yield {"type": "follower", "username": username, "created_at": created_at}
+
+
+def iter_ndjson(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
@@ -0,0 +1,96 @@
+"""
+大量のツイート・いいね・フォローを持つユーザーを削除する処理を定義します
+
+user.delete()はCASCADE先の行を全てメモリに読み込んでから削除するため、
+関連する行を外部キーの参照元から順に一定件数ずつ削除し、最後にユーザー本体を削除します
+"""
+
+from django.db import transaction
+from django.db.models import F
+
+from tweets import archive, sharding, trending
+from tweets.models import Like, Tweet
+
+from .caches import invalidate_follow_counts
+from .models import Follow, User
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def decrement_like_counts(likes):
+    # 同じツイートに2回いいねすることはできないので、1バッチの中で各ツイートのいいね数は1ずつ減る
+    Tweet.objects.using(likes.db).filter(pk__in=likes.values("tweet_id")).update(like_count=F("like_count") - 1)
+
+
+def remove_likes(likes):
+    decrement_like_counts(likes)
+    # トレンドのスコアからも差し引けるよう記録する
+    trending.record_removed(likes)
+
+
+def invalidate_follow_counts_of(field):
+    """
+    フォローの削除の前に呼び、相手(Followのfield側のユーザー)のフォロー数をcommitした後に無効にする関数を返す
+    """
+
+    def before_delete(follows):
+        usernames = list(User.objects.filter(pk__in=follows.values(field)).values_list("username", flat=True))
+        transaction.on_commit(lambda: invalidate_follow_counts(*usernames), using=follows.db)
+
+    return before_delete
+
+
+def deletion_steps(user):
+    """
+    (ラベル, 削除対象のqueryset, 各バッチの削除前に呼ぶ関数)を削除してよい順に返す
+
+    ツイートを消す前に、そのツイートへのいいねを消しておく
+    """
+    return [
+        ("likes_on_tweets", Like.objects.filter(tweet__author=user), None),
+        ("likes", Like.objects.filter(user=user), remove_likes),
+        ("following", Follow.objects.filter(follower=user), invalidate_follow_counts_of("followed")),
+        ("followers", Follow.objects.filter(followed=user), invalidate_follow_counts_of("follower")),
+        ("tweets", Tweet.objects.filter(author=user), None),
+    ]
+
+
+def delete_in_batches(queryset, batch_size, before_delete=None):
+    """
+    querysetの行をbatch_size件ずつ削除し、バッチごとに削除件数をyieldする
+
+    読み込むのは主キーだけで、1バッチごとにcommitするのでトランザクションも短い。
+    before_delete(バッチのqueryset)は、同じトランザクションの中で削除の直前に呼ばれる(集計値の調整など)
+    """
+    model = queryset.model
+    while pks := list(queryset.values_list("pk", flat=True)[:batch_size]):
+        batch = model.objects.using(queryset.db).filter(pk__in=pks)
+        with transaction.atomic(using=queryset.db):
+            if before_delete is not None:
+                before_delete(batch)
+            deleted, _ = batch.delete()
+        yield deleted
+
+
+def delete_user(user, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    userと関連する行を全て削除する。progress(label, 削除済み件数)はバッチごとに呼ばれる
+    """
+    for label, queryset, before_delete in deletion_steps(user):
+        total = 0
+        # シャーディング時、ツイート・いいねは全てのシャードから削除する
+        databases = sharding.databases() if queryset.model._meta.app_label == "tweets" else [None]
+        for db in databases:
+            for deleted in delete_in_batches(queryset.using(db), batch_size, before_delete):
+                total += deleted
+                if progress is not None:
+                    progress(label, total)
+    # アーカイブ(tweets/archive.py)のツイート・いいねも削除する
+    store = archive.get_store()
+    if store is not None:
+        deleted = store.delete_user(user.pk)
+        if progress is not None:
+            progress("archive", deleted)
+    # 残りの関連(セッション・管理画面のログなど)はわずかなので、通常のカスケードで削除する
+    user.delete()
+    invalidate_follow_counts(user.username)
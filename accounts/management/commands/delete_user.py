@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.deletion import DEFAULT_BATCH_SIZE, delete_user
+from accounts.models import User
+from taskqueue.registry import enqueue
+
+
+class Command(BaseCommand):
+    help = "ユーザーと関連するツイート・いいね・フォローを一定件数ずつ削除します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--background", action="store_true", help="削除をタスクキューに追加し、すぐに終了する")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist as exc:
+            raise CommandError(f"ユーザー {options['username']} は存在しません。") from exc
+
+        if options["background"]:
+            enqueue("accounts.delete_user", user.pk)
+            self.stdout.write(f"ユーザー {options['username']} の削除をタスクキューに追加しました。")
+            return
+
+        def progress(label, total):
+            self.stdout.write(f"{label}: {total}件削除")
+
+        delete_user(user, batch_size=options["batch_size"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"ユーザー {options['username']} を削除しました。"))
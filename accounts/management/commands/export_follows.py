@@ -0,0 +1,15 @@
+from accounts.bulk_io import BaseExportCommand
+from accounts.models import Follow
+
+
+class Command(BaseExportCommand):
+    help = "フォロー関係を(follower, followed)のユーザー名でNDJSON/CSVに書き出します"
+
+    fieldnames = ("follower", "followed")
+
+    def get_rows(self, chunk_size):
+        return (
+            Follow.objects.order_by("pk")
+            .values_list("follower__username", "followed__username")
+            .iterator(chunk_size=chunk_size)
+        )
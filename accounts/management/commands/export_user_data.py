@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.data_export import DEFAULT_CHUNK_SIZE, iter_ndjson, iter_user_records
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "指定したユーザーのツイート・いいね・フォローをNDJSONで書き出します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--output", default="-", help="出力先のファイル(省略時は標準出力)")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist as exc:
+            raise CommandError(f"ユーザー {options['username']} は存在しません。") from exc
+
+        lines = iter_ndjson(iter_user_records(user, options["chunk_size"]))
+        if options["output"] == "-":
+            sys.stdout.writelines(lines)
+        else:
+            with open(options["output"], "w", encoding="utf-8") as stream:
+                stream.writelines(lines)
@@ -0,0 +1,24 @@
+from django.db import transaction
+
+from accounts.bulk_io import BaseImportCommand, resolve_usernames
+from accounts.caches import invalidate_follow_counts
+from accounts.models import Follow
+
+
+class Command(BaseImportCommand):
+    help = "export_followsで書き出したフォロー関係を取り込みます。既存のフォローと存在しないユーザーは無視します"
+
+    fieldnames = ("follower", "followed")
+
+    def import_chunk(self, rows):
+        user_ids = resolve_usernames([row["follower"] for row in rows] + [row["followed"] for row in rows])
+        follows = [
+            Follow(follower_id=user_ids[row["follower"]], followed_id=user_ids[row["followed"]])
+            for row in rows
+            if row["follower"] in user_ids and row["followed"] in user_ids and row["follower"] != row["followed"]
+        ]
+        # 既にフォロー済みの行はunique_followに当たるが、ignore_conflictsで無視する
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        usernames = {row[field] for row in rows for field in self.fieldnames if row[field] in user_ids}
+        transaction.on_commit(lambda: invalidate_follow_counts(*usernames))
+        return len(follows)
@@ -0,0 +1,33 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "ローカル開発用に、プライマリのSQLiteファイルを各レプリカのファイルへコピーします"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="指定すると、その秒数ごとにコピーを繰り返す")
+
+    def handle(self, *args, **options):
+        while True:
+            self.sync()
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
+
+    def sync(self):
+        source = sqlite3.connect(settings.DATABASES["default"]["NAME"])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+                try:
+                    # backup APIは書き込み中でも一貫したスナップショットをコピーする
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f"{alias}: synced")
+        finally:
+            source.close()
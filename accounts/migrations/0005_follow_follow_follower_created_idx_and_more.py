@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_alter_follow_unique_together_follow_unique_follow"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["follower", "created_at"], name="follow_follower_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(fields=["followed", "created_at"], name="follow_followed_created_idx"),
+        ),
+    ]
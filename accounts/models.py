@@ -1,10 +1,17 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from mysite import urlbuilder
+
 
 class User(AbstractUser):
     email = models.EmailField()
 
+    @property
+    def profile_url(self):
+        # 一覧画面で1件ごとに使うので、{% url %}ではなくmysite/urlbuilder.pyで組み立てる
+        return urlbuilder.build("accounts:user_profile", self.username)
+
 
 class Follow(models.Model):
     # followしているユーザー
@@ -15,3 +22,8 @@ class Follow(models.Model):
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["follower", "followed"], name="unique_follow")]
+        # フォロー・フォロワー一覧を(created_at, id)順にページ分割するためのindex
+        indexes = [
+            models.Index(fields=["follower", "created_at"], name="follow_follower_created_idx"),
+            models.Index(fields=["followed", "created_at"], name="follow_followed_created_idx"),
+        ]
@@ -0,0 +1,16 @@
+"""
+accountsアプリのバックグラウンドタスク(taskqueue)を定義します
+"""
+
+from taskqueue.registry import task
+
+from .deletion import delete_user
+from .models import User
+
+
+@task("accounts.delete_user")
+def delete_user_task(user_id):
+    # 再実行された場合、ユーザーは前回の実行で削除済みのことがある
+    user = User.objects.filter(pk=user_id).first()
+    if user is not None:
+        delete_user(user)
@@ -1,10 +1,23 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
 from django.conf import settings
 from django.contrib.auth import SESSION_KEY, get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from tweets.models import Tweet
+from notifications.models import Notification
+from taskqueue.models import Task
+from taskqueue.worker import run_pending
+from tweets.models import Like, Tweet
 
+from .deletion import delete_user
 from .models import Follow
 
 User = get_user_model()
@@ -313,6 +326,9 @@ class TestUserProfileView(TestCase):
         self.user1 = User.objects.create_user(username="testuser1", email="test1@test.com", password="testpassword1")
         self.user2 = User.objects.create_user(username="testuser2", email="test2@test.com", password="testpassword2")
         Follow.objects.create(follower=self.user1, followed=self.user2)
+        # フォロー数はキャッシュするので、前のテストの値を残さない
+        cache.clear()
+        self.addCleanup(cache.clear)
 
         self.client.login(username="testuser1", password="testpassword1")
         # urlpatternがusernameを含むので
@@ -340,6 +356,38 @@ class TestUserProfileView(TestCase):
         # context内のフォロワー数 = DB内のフォロワー数?
         self.assertEqual(context_follower_num, db_follower_num)
 
+    def test_follow_counts_are_invalidated_on_follow(self):
+        user3 = User.objects.create_user(username="testuser3", email="test3@test.com", password="testpassword3")
+        self.client.get(self.url)
+
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user2.username}))
+        self.assertEqual(self.client.get(self.url).context["following_num"], 0)
+
+        self.client.post(reverse("accounts:follow", kwargs={"username": user3.username}))
+        self.assertEqual(self.client.get(self.url).context["following_num"], 1)
+
+    def test_follow_counts_are_invalidated_on_import(self):
+        user3 = User.objects.create_user(username="testuser3", email="test3@test.com", password="testpassword3")
+        self.client.get(self.url)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "follows.ndjson")
+            with open(path, "w") as stream:
+                stream.write('{"follower": "testuser1", "followed": "testuser3"}\n')
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command("import_follows", input=path, stdout=StringIO())
+
+        self.assertEqual(self.client.get(self.url).context["following_num"], 2)
+        self.assertTrue(Follow.objects.filter(follower=self.user1, followed=user3).exists())
+
+    def test_follow_counts_are_invalidated_on_delete_user(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_user(self.user2)
+
+        self.assertEqual(self.client.get(self.url).context["following_num"], 0)
+
 
 class TestFollowView(TestCase):
 
@@ -363,6 +411,23 @@ class TestFollowView(TestCase):
 
         self.assertEqual(Follow.objects.all().count(), 1)
 
+    def test_success_post_aggregates_notifications_in_background(self):
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+
+        self.assertEqual(list(Task.objects.values_list("name", flat=True)), ["notifications.aggregate"])
+        run_pending()
+        self.assertEqual(Notification.objects.get(recipient=self.user2).last_actor, self.user1)
+
+    def test_success_post_with_followed_user(self):
+
+        Follow.objects.create(follower=self.user1, followed=self.user2)
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Follow.objects.all().count(), 1)  # 2回フォローしても増えない
+
     def test_failure_post_with_not_exist_user(self):
 
         # 存在しないユーザーネームをURLパラメータに指定する
@@ -403,6 +468,13 @@ class TestUnfollowView(TestCase):
         )
         self.assertEqual(Follow.objects.all().count(), 0)
 
+    def test_failure_post_with_not_followed_user(self):
+
+        Follow.objects.all().delete()
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user2.username}))
+
+        self.assertEqual(response.status_code, 404)
+
     def test_failure_post_with_not_exist_user(self):
 
         nonexistent_username_url = reverse("accounts:unfollow", kwargs={"username": "nonexistentusername"})
@@ -438,6 +510,34 @@ class TestFollowingListView(TestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    def test_success_get_with_follow_state(self):
+
+        # user2もuser1をフォローしている(相互フォロー)
+        Follow.objects.create(follower=self.user2, followed=self.user1)
+
+        response = self.client.get(self.url)
+        follow = response.context["follow_list"][0]
+
+        self.assertTrue(follow.viewer_follows)
+        self.assertTrue(follow.follows_viewer)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(self.url)
+            return len(context.captured_queries)
+
+        # ログインユーザーはキャッシュから読むようになるので、1度表示してから数える
+        self.client.get(self.url)
+        query_count_with_one_row = count_queries()
+        # 1ページ分(20件)になるまでフォローを追加し、各ユーザーとは相互フォローにする
+        users = User.objects.bulk_create([User(username=f"followed{i}") for i in range(19)])
+        Follow.objects.bulk_create([Follow(follower=self.user1, followed=user) for user in users])
+        Follow.objects.bulk_create([Follow(follower=user, followed=self.user1) for user in users])
+
+        self.assertEqual(count_queries(), query_count_with_one_row)
+
 
 class TestFollowerListView(TestCase):
     # 想定: user1がフォローしていたuser2をアンフォローする
@@ -455,3 +555,168 @@ class TestFollowerListView(TestCase):
         response = self.client.get(self.url)
 
         self.assertEqual(response.status_code, 200)
+
+    def test_success_get_paginated(self):
+
+        # user1をフォローしているユーザーを1ページに収まらない数だけ追加
+        followers = User.objects.bulk_create([User(username=f"follower{i}") for i in range(25)])
+        Follow.objects.bulk_create([Follow(follower=follower, followed=self.user1) for follower in followers])
+
+        response = self.client.get(self.url)
+        first_page = list(response.context["follow_list"])
+        next_cursor = response.context["next_cursor"]
+
+        response = self.client.get(self.url, {"cursor": next_cursor})
+        second_page = list(response.context["follow_list"])
+
+        self.assertEqual(len(first_page), 20)
+        self.assertEqual(len(second_page), 5)
+        self.assertIsNone(response.context["next_cursor"])
+        # 2ページを合わせるとフォロワー全員が重複なく含まれるか
+        self.assertEqual(
+            {follow.pk for follow in first_page + second_page},
+            set(Follow.objects.filter(followed=self.user1).values_list("pk", flat=True)),
+        )
+
+    def test_success_get_with_invalid_cursor(self):
+
+        # 形式が違うもの、datetime・主キーの範囲外のものは無視して1ページ目を返す
+        Follow.objects.create(follower=self.user2, followed=self.user1)
+        for cursor in ["abc", "1_2_3", "99999999999999999999_1", "-99999999999999999_1", "0_99999999999999999999"]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {"cursor": cursor})
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context["follow_list"]), 1)
+
+    def test_failure_get_with_not_exist_user(self):
+
+        url = reverse("accounts:follower_list", kwargs={"username": "nonexistentusername"})
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 404)
+
+
+class TestFollowImportExportCommands(TestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", email="test1@test.com", password="testpassword1")
+        self.user2 = User.objects.create_user(username="testuser2", email="test2@test.com", password="testpassword2")
+        Follow.objects.create(follower=self.user1, followed=self.user2)
+        Follow.objects.create(follower=self.user2, followed=self.user1)
+
+    def export_and_import(self, fmt):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"follows.{fmt}")
+            call_command("export_follows", output=path, format=fmt, stderr=StringIO())
+            Follow.objects.filter(follower=self.user1).delete()
+            call_command("import_follows", input=path, format=fmt, chunk_size=1, stdout=StringIO())
+
+    def test_success_round_trip_ndjson(self):
+
+        self.export_and_import("ndjson")
+
+        self.assertTrue(Follow.objects.filter(follower=self.user1, followed=self.user2).exists())
+        # 既存のフォローは重複して作成されない
+        self.assertEqual(Follow.objects.count(), 2)
+
+    def test_success_round_trip_csv(self):
+
+        self.export_and_import("csv")
+
+        self.assertTrue(Follow.objects.filter(follower=self.user1, followed=self.user2).exists())
+        self.assertEqual(Follow.objects.count(), 2)
+
+    def test_success_import_skips_unknown_users(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "follows.ndjson")
+            with open(path, "w") as stream:
+                stream.write('{"follower": "testuser1", "followed": "nonexistentusername"}\n')
+            call_command("import_follows", input=path, stdout=StringIO())
+
+        self.assertEqual(Follow.objects.count(), 2)
+
+    def test_failure_import_with_malformed_json(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "follows.ndjson")
+            with open(path, "w") as stream:
+                stream.write('{"follower": "testuser1", "followed": "testuser2"}\n\n{"follower": "testuser1",\n')
+            with self.assertRaisesMessage(CommandError, "3行目の形式が不正です"):
+                call_command("import_follows", input=path, stdout=StringIO())
+
+
+class TestDataExportView(TestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", email="test1@test.com", password="testpassword1")
+        self.user2 = User.objects.create_user(username="testuser2", email="test2@test.com", password="testpassword2")
+        tweet = Tweet.objects.create(content="This is a test tweet", author=self.user1)
+        Like.objects.create(tweet=tweet, user=self.user1)
+        Follow.objects.create(follower=self.user1, followed=self.user2)
+        Follow.objects.create(follower=self.user2, followed=self.user1)
+        self.client.login(username="testuser1", password="testpassword1")
+        self.url = reverse("accounts:export")
+
+    def test_success_get(self):
+
+        response = self.client.get(self.url)
+        records = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([record["type"] for record in records], ["user", "tweet", "like", "following", "follower"])
+        self.assertEqual(records[0]["username"], "testuser1")
+        self.assertEqual(records[3]["username"], "testuser2")
+
+    def test_failure_get_without_login(self):
+
+        self.client.logout()
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_profile_of_user_named_export_is_not_shadowed(self):
+        User.objects.create_user(username="export", password="testpassword")
+
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "export"}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["profile_user"].username, "export")
+
+
+class TestDeleteUser(TestCase):
+
+    def setUp(self):
+        # 想定: user1を削除し、user2のデータは残る
+        self.user1 = User.objects.create_user(username="testuser1", email="test1@test.com", password="testpassword1")
+        self.user2 = User.objects.create_user(username="testuser2", email="test2@test.com", password="testpassword2")
+        tweets = Tweet.objects.bulk_create([Tweet(content=f"tweet {i}", author=self.user1) for i in range(5)])
+        self.user2_tweet = Tweet.objects.create(content="This is a test tweet", author=self.user2)
+        Like.objects.bulk_create([Like(tweet=tweet, user=self.user2) for tweet in tweets])
+        Like.objects.create(tweet=self.user2_tweet, user=self.user1)
+        Like.objects.create(tweet=self.user2_tweet, user=self.user2)
+        Follow.objects.create(follower=self.user1, followed=self.user2)
+        Follow.objects.create(follower=self.user2, followed=self.user1)
+
+    def test_success_delete_in_batches(self):
+
+        progress = []
+        delete_user(self.user1, batch_size=2, progress=lambda label, total: progress.append((label, total)))
+
+        self.assertFalse(User.objects.filter(pk=self.user1.pk).exists())
+        self.assertFalse(Tweet.objects.filter(author=self.user1).exists())
+        self.assertFalse(Follow.objects.exists())
+        # user2のツイートとuser2自身のいいねは残る
+        self.assertEqual(list(Like.objects.values_list("tweet", "user")), [(self.user2_tweet.pk, self.user2.pk)])
+        # 5件のいいねを2件ずつ削除したので、進捗は3回報告される
+        self.assertEqual(
+            [total for label, total in progress if label == "likes_on_tweets"],
+            [2, 4, 5],
+        )
+
+    def test_success_command(self):
+
+        call_command("delete_user", "testuser1", stdout=StringIO())
+
+        self.assertFalse(User.objects.filter(pk=self.user1.pk).exists())
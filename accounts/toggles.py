@@ -0,0 +1,45 @@
+"""
+フォロー・アンフォローを、相手のユーザーを先に読み込まずに行う処理を定義します
+
+相手はユーザー名のまま、INSERT ... SELECT / DELETE ... WHERE followed_id = (SELECT ...)の中で解決する
+"""
+
+from django.db import connections, router
+
+from .models import Follow, User
+
+
+def insert_follow(follower_id, username, created_at):
+    """
+    usernameのユーザーをフォローし、フォローしたらTrue、既にフォロー済みならFalseを返す。
+    ユーザーが存在しなければUser.DoesNotExist
+    """
+    db = router.db_for_write(Follow)
+    connection = connections[db]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(Follow._meta.db_table)} (follower_id, followed_id, created_at) "
+            f"SELECT %s, id, %s FROM {quote(User._meta.db_table)} WHERE username = %s "
+            "ON CONFLICT DO NOTHING RETURNING id",
+            [follower_id, connection.ops.adapt_datetimefield_value(created_at), username],
+        )
+        inserted = cursor.fetchone() is not None
+    if not inserted and not User.objects.using(db).filter(username=username).exists():
+        raise User.DoesNotExist
+    return inserted
+
+
+def delete_follow(follower_id, username):
+    """
+    usernameのユーザーのフォローを解除し、解除したらTrue、フォローしていない(ユーザーが存在しない場合も含む)ならFalseを返す
+    """
+    connection = connections[router.db_for_write(Follow)]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(Follow._meta.db_table)} WHERE follower_id = %s "
+            f"AND followed_id = (SELECT id FROM {quote(User._meta.db_table)} WHERE username = %s) RETURNING id",
+            [follower_id, username],
+        )
+        return cursor.fetchone() is not None
@@ -9,6 +9,8 @@ urlpatterns = [
     path("signup/", views.SignupView.as_view(), name="signup"),
     path("login/", auth_views.LoginView.as_view(template_name="accounts/login.html"), name="login"),
     path("logout/", auth_views.LogoutView.as_view(), name="logout"),
+    # "<str:username>/"と重ならないよう2階層にする(1階層だと"export"という名前のユーザーのプロフィールを隠す)
+    path("settings/export/", views.DataExportView.as_view(), name="export"),
     path("<str:username>/", views.UserProfileView.as_view(), name="user_profile"),
     path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
     path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
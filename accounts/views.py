@@ -1,15 +1,26 @@
 from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404, HttpResponseBadRequest
-from django.shortcuts import get_object_or_404
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
-from django.views.generic import CreateView, DeleteView, DetailView, ListView
-
+from django.utils import timezone
+from django.views.generic import CreateView, DetailView, ListView, View
+
+from mysite.conditional import ConditionalGetMixin
+from mysite.idempotency import IdempotentMixin
+from mysite.pagination import KeysetPaginationMixin, paginate_by_id, parse_id
+from mysite.ratelimit import RateLimitMixin
+from taskqueue.registry import enqueue
+from tweets import archive, sharding
 from tweets.models import Like, Tweet
 
+from .caches import follow_counts, invalidate_follow_counts
+from .data_export import iter_ndjson, iter_user_records
 from .forms import SignupForm
 from .models import Follow, User
+from .toggles import delete_follow, insert_follow
 
 
 class SignupView(CreateView):
@@ -30,7 +41,21 @@ class SignupView(CreateView):
         return response
 
 
-class UserProfileView(LoginRequiredMixin, DetailView):
+class DataExportView(LoginRequiredMixin, View):
+    """
+    ログインしているユーザー自身のデータをNDJSONでダウンロードさせるビュー
+    """
+
+    def get(self, request, *args, **kwargs):
+        # レスポンスを返しながらDBを少しずつ読むので、workerを長時間占有しない
+        response = StreamingHttpResponse(
+            iter_ndjson(iter_user_records(request.user)), content_type="application/x-ndjson; charset=utf-8"
+        )
+        response["Content-Disposition"] = f'attachment; filename="{request.user.username}.ndjson"'
+        return response
+
+
+class UserProfileView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     """
     特定のユーザーに関連するツイート、フォロー状態を表示するビュー
     """
@@ -39,116 +64,170 @@ class UserProfileView(LoginRequiredMixin, DetailView):
     template_name = "accounts/user_profile.html"
     context_object_name = "profile_user"
     pk_url_kwarg = "username"
+    page_size = 20
 
     def get_object(self, queryset=None):
-        # urlパラメータから対象となるユーザーモデルを取得
-        username = self.kwargs.get(self.pk_url_kwarg)
-        return get_object_or_404(User, username=username)
+        # urlパラメータから対象となるユーザーモデルを取得。ETagの計算と描画で2回読まないよう保持する
+        if not hasattr(self, "profile_user"):
+            username = self.kwargs.get(self.pk_url_kwarg)
+            self.profile_user = get_object_or_404(User, username=username)
+        return self.profile_user
+
+    def tweet_page(self, profile_user, tweets):
+        """
+        プロフィールユーザのツイート(tweets)の1ページ分と、次のページのmax_idを返す
+        """
+        tweets = sharding.on_shard(tweets.filter(author=profile_user), sharding.db_for_user(profile_user.pk))
+        page, next_max_id = paginate_by_id(self.request, tweets, self.page_size)
+        store = archive.get_store()
+        if next_max_id is None and store is not None:
+            # 新しいツイートを表示し終えたら、続きをアーカイブから読み込む
+            max_id = page[-1].pk if page else parse_id(self.request.GET.get("max_id"))
+            page += store.tweets_by_author(profile_user.pk, max_id, limit=self.page_size - len(page) + 1)
+            if len(page) > self.page_size:
+                page = page[: self.page_size]
+                next_max_id = page[-1].pk
+        return page, next_max_id
+
+    def follow_state(self, profile_user):
+        """
+        (閲覧者がフォロー済みか, プロフィールユーザがフォローしている数, フォローされている数)
+        """
+        following_num, follower_num = follow_counts(profile_user)
+        return (
+            Follow.objects.filter(follower=self.request.user, followed=profile_user).exists(),
+            following_num,
+            follower_num,
+        )
+
+    def etag_parts(self):
+        profile_user = self.get_object()
+        # アーカイブのツイートはTweetで返るので、どちらにもあるpk・like_countだけを使う
+        page, next_max_id = self.tweet_page(profile_user, Tweet.objects.values_list("pk", "like_count", named=True))
+        liked = sharding.scatter(
+            Like.objects.filter(user=self.request.user, tweet_id__in=[tweet.pk for tweet in page]).values_list(
+                "tweet_id", flat=True
+            )
+        )
+        return (
+            profile_user.username,
+            [(tweet.pk, tweet.like_count) for tweet in page],
+            next_max_id,
+            self.follow_state(profile_user),
+            sorted(liked),
+        )
 
     # contextを上書きする
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         profile_user = self.object
         # プロフィールユーザ特有のツイートをcontextに渡す
-        context["specific_user_tweets"] = (
-            Tweet.objects.filter(author=profile_user).select_related("author").prefetch_related("liked_tweet")
+        page, next_max_id = self.tweet_page(profile_user, Tweet.objects.select_related("author"))
+        context["specific_user_tweets"], context["next_max_id"] = page, next_max_id
+        # フォロー済みであるか、プロフィールユーザがフォローしている・されている数
+        context["follow"], context["following_num"], context["follower_num"] = self.follow_state(profile_user)
+        context["like_list"] = sharding.scatter(
+            Like.objects.filter(user=self.request.user).values_list("tweet_id", flat=True)
         )
-        # フォロー済みであるか調べるためにcontextに渡す
-        context["follow"] = Follow.objects.filter(follower=self.request.user, followed=profile_user).exists()
-        # プロフィールユーザがフォローしている・されている数
-        context["following_num"] = Follow.objects.filter(follower=profile_user).count()
-        context["follower_num"] = Follow.objects.filter(followed=profile_user).count()
-        context["like_list"] = Like.objects.filter(user=self.request.user).values_list("tweet__pk", flat=True)
         return context
 
 
-class FollowView(LoginRequiredMixin, CreateView):
-    model = Follow
-    fields = []
+class FollowView(LoginRequiredMixin, IdempotentMixin, RateLimitMixin, View):
     success_url = reverse_lazy(settings.LOGIN_REDIRECT_URL)
-    pk_url_kwarg = "username"
+    ratelimit_scope = "follow"
 
-    # 不正なリクエストを最初にdispatchで受け取り、適切なエラーを出力する
-    def dispatch(self, request, *args, **kwargs):
+    def post(self, request, *args, **kwargs):
+        username = kwargs["username"]
+        if request.user.username == username:
+            return HttpResponseBadRequest("自分自身をフォローすることは不可能です。")
 
-        username = self.kwargs.get(self.pk_url_kwarg)
-        # エラーメッセージ1
+        # 相手のユーザーを読み込まず、INSERTの中でユーザー名から解決する。フォロー済みでもそのまま戻る
         try:
-            user_to_follow = User.objects.get(username=username)
+            insert_follow(request.user.pk, username, timezone.now())
         except User.DoesNotExist as exc:
             raise Http404("存在しないユーザーをフォローすることはできません。") from exc
-        # エラーメッセージ2
-        if request.user.username == user_to_follow.username:
-            return HttpResponseBadRequest("自分自身をフォローすることは不可能です。")
+        invalidate_follow_counts(request.user.username, username)
+        # フォローの通知は、commitの後にワーカーがまとめる(実行待ちがあれば追加しない)
+        enqueue("notifications.aggregate", unique=True)
+        return redirect(self.success_url)
 
-        return super().dispatch(request, *args, **kwargs)
 
-    def form_valid(self, form):
+class UnFollowView(LoginRequiredMixin, IdempotentMixin, RateLimitMixin, View):
+    success_url = reverse_lazy(settings.LOGIN_REDIRECT_URL)
+    ratelimit_scope = "follow"
 
-        # URLからプロフィールのユーザーネームを取得
-        followed_username = self.kwargs["username"]
-        # followerインスタンス = ログインしているユーザー
-        form.instance.follower = self.request.user
-        # followedインスタンス = フォローされたユーザー
-        form.instance.followed = User.objects.get(username=followed_username)
+    def post(self, request, *args, **kwargs):
+        username = kwargs["username"]
+        if request.user.username == username:
+            return HttpResponseBadRequest("自分自身をアンフォローすることは不可能です。")
 
-        return super().form_valid(form)
+        if not delete_follow(request.user.pk, username):
+            raise Http404("フォローしていないユーザーをアンフォローすることはできません。")
+        invalidate_follow_counts(request.user.username, username)
+        return redirect(self.success_url)
 
 
-class UnFollowView(LoginRequiredMixin, DeleteView):
-    model = Follow
-    success_url = reverse_lazy(settings.LOGIN_REDIRECT_URL)
-    pk_url_kwarg = "username"
-
-    def dispatch(self, request, *args, **kwargs):
-        username = self.kwargs.get(self.pk_url_kwarg)
-
-        try:
-            user_to_unfollow = User.objects.get(username=username)
-        except User.DoesNotExist as exc:
-            raise Http404("存在しないユーザーをアンフォローすることはできません。") from exc
+def annotate_follow_state(queryset, viewer, user_field):
+    """
+    一覧の各ユーザーについて「閲覧者がフォローしているか」「閲覧者をフォローしているか」を付与する
 
-        if request.user.id == user_to_unfollow.id:
-            return HttpResponseBadRequest("自分自身をアンフォローすることは不可能です。")
+    行ごとにexists()を発行せず、unique_followのindexを使う相関サブクエリで1クエリにまとめる
+    """
+    return queryset.annotate(
+        viewer_follows=Exists(Follow.objects.filter(follower=viewer, followed=OuterRef(user_field))),
+        follows_viewer=Exists(Follow.objects.filter(follower=OuterRef(user_field), followed=viewer)),
+    )
 
-        return super().dispatch(request, *args, **kwargs)
 
-    def get_object(self, queryset=None):
+class FollowListMixin(ConditionalGetMixin):
+    """
+    フォロー・フォロワー一覧のETag。user_fieldは一覧に表示するユーザーのFollowのフィールド名
+    """
 
-        # フォローしているユーザーをリクエストから指定する
-        follower = self.request.user
-        # フォローされているユーザーをurlパラメータから指定する
-        username = self.kwargs.get(self.pk_url_kwarg)
-        followed = User.objects.get(username=username)
+    user_field = None
 
-        return get_object_or_404(Follow, follower=follower, followed=followed)
+    def etag_parts(self):
+        fields = ("pk", "created_at", f"{self.user_field}__username", "viewer_follows", "follows_viewer")
+        rows, next_cursor = self.paginate_keyset(self.get_queryset().values_list(*fields, named=True))
+        return tuple(rows), next_cursor
 
 
-class FollowingListView(LoginRequiredMixin, ListView):
+class FollowingListView(LoginRequiredMixin, FollowListMixin, KeysetPaginationMixin, ListView):
     model = Follow
     template_name = "accounts/following_list.html"
-    ordering = ["-created_at"]
     pk_url_kwarg = "username"
+    user_field = "followed"
 
     def get_queryset(self):
         """
         プロフィールユーザがフォローしているユーザをDBから取得する
         """
         username = self.kwargs.get(self.pk_url_kwarg)
-        profile_user = User.objects.get(username=username)
-        return Follow.objects.filter(follower=profile_user).select_related("followed")
+        profile_user = get_object_or_404(User, username=username)
+        # テンプレートで表示するのはユーザー名だけなので、必要なカラムに絞る
+        queryset = (
+            Follow.objects.filter(follower=profile_user)
+            .select_related("followed")
+            .only("created_at", "followed__username")
+        )
+        return annotate_follow_state(queryset, self.request.user, "followed")
 
 
-class FollowerListView(LoginRequiredMixin, ListView):
+class FollowerListView(LoginRequiredMixin, FollowListMixin, KeysetPaginationMixin, ListView):
     model = Follow
     template_name = "accounts/follower_list.html"
-    ordering = ["-created_at"]
     pk_url_kwarg = "username"
+    user_field = "follower"
 
     def get_queryset(self):
         """
         プロフィールユーザをフォローしているユーザをDBから取得する
         """
         username = self.kwargs.get(self.pk_url_kwarg)
-        profile_user = User.objects.get(username=username)
-        return Follow.objects.filter(followed=profile_user).select_related("follower")
+        profile_user = get_object_or_404(User, username=username)
+        queryset = (
+            Follow.objects.filter(followed=profile_user)
+            .select_related("follower")
+            .only("created_at", "follower__username")
+        )
+        return annotate_follow_state(queryset, self.request.user, "follower")
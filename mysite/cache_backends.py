@@ -0,0 +1,71 @@
+"""
+Djangoのキャッシュのバックエンドを定義します
+"""
+
+import base64
+import pickle
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache.backends import db
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import DatabaseError, connections, router, transaction
+from django.utils.timezone import now as tz_now
+
+# SQLiteの1つの文に渡せる値の数を超えないよう、この件数ずつ書き込む
+SET_MANY_BATCH_SIZE = 500
+
+
+class DatabaseCache(db.DatabaseCache):
+    """
+    set_many()を1つのトランザクションで書き込むDatabaseCache
+
+    Djangoのset_many()はキーごとにset()を呼び、その度に件数を数え(SELECT COUNT(*))、commitする。
+    ObjectCache.get_many()(mysite/objcache.py)は読んだ行をまとめてset_many()するので、
+    件数を数えるのもcommitも1回にする
+    """
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            expires = datetime.max
+        else:
+            expires = datetime.fromtimestamp(timeout, tz=timezone.utc if settings.USE_TZ else None)
+        alias = router.db_for_write(self.cache_model_class)
+        connection = connections[alias]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        expires = connection.ops.adapt_datetimefield_value(expires.replace(microsecond=0))
+        rows = [
+            (
+                self.make_and_validate_key(key, version=version),
+                base64.b64encode(pickle.dumps(value, self.pickle_protocol)).decode("latin1"),
+                expires,
+            )
+            for key, value in data.items()
+        ]
+
+        try:
+            with transaction.atomic(using=alias), connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                num = cursor.fetchone()[0]
+                if num > self._max_entries:
+                    self._cull(alias, cursor, tz_now().replace(microsecond=0), num)
+                for start in range(0, len(rows), SET_MANY_BATCH_SIZE):
+                    batch = rows[start : start + SET_MANY_BATCH_SIZE]
+                    placeholders = ", ".join(["%s"] * len(batch))
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE {quote_name('cache_key')} IN ({placeholders})",
+                        [key for key, _, _ in batch],
+                    )
+                    cursor.executemany(
+                        f"INSERT INTO {table} ({quote_name('cache_key')}, {quote_name('value')}, "
+                        f"{quote_name('expires')}) VALUES (%s, %s, %s)",
+                        batch,
+                    )
+        except DatabaseError:
+            # set()と同じく、書き込めなかったことは例外にせず、書き込めなかったキーを返す
+            return list(data)
+        return []
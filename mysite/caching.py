@@ -0,0 +1,164 @@
+"""
+作り直すのに時間のかかる値(フォロー数、最近いいねしたユーザーなど)をキャッシュする処理を定義します
+
+    counts = caching.get_or_set(key, compute, timeout, family="follow_counts")
+
+- single-flight: キャッシュがないとき、作り直すのは1つのリクエストだけ。他のリクエストはその結果を待つ
+- 確率的な早期の作り直し(XFetch): 期限が近づくほど、作り直しにかかった時間が長いほど、期限前に作り直す確率が上がる
+- stale-while-revalidate: 期限からsettings.CACHING["STALE_SECONDS"]秒までは、1つのリクエストが作り直す間、
+  他のリクエストには古い値を返す
+- delete(key)は値を消さずにkeyのバージョンを上げる(mysite/objcache.pyと同じ)。無効にする前に読み始めた作り直しは
+  古いバージョンのキーに書くので、無効にした後の値を古い値で上書きしない
+
+ヒット率・作り直した回数は、familyごとにプロセス内で数える(metrics.snapshot())
+"""
+
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class Metrics:
+    """
+    familyごとのhits(新しい値)、stale_hits(古い値を返した)、misses、recomputes、waitsの回数。
+    mysite/objcache.pyはプロセス内のキャッシュにあった回数をlocal_hitsに数える
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def incr(self, family, name, amount=1):
+        with self._lock:
+            self._counts.setdefault(family, Counter())[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            counts = {family: dict(counter) for family, counter in self._counts.items()}
+        for counter in counts.values():
+            hits = counter.get("local_hits", 0) + counter.get("hits", 0) + counter.get("stale_hits", 0)
+            lookups = hits + counter.get("misses", 0)
+            counter["hit_ratio"] = round(hits / lookups, 4) if lookups else None
+        return counts
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+metrics = Metrics()
+
+
+def lock_key(key):
+    return f"{key}:lock"
+
+
+def version_key(key):
+    return f"{key}:version"
+
+
+def current_key(key):
+    """
+    keyの今のバージョンの値を保存するキー
+    """
+    return f"{key}:{cache.get(version_key(key), 0)}"
+
+
+def acquire(key):
+    """
+    keyを作り直す権利を取り、release()に渡すトークンを返す。取れなければNone(他のリクエストが作り直している)
+    """
+    token = uuid.uuid4().hex
+    return token if cache.add(lock_key(key), token, settings.CACHING["LOCK_TIMEOUT"]) else None
+
+
+def release(key, token):
+    # 作り直している間にロックの期限が切れ、他のリクエストが取り直していれば、そのロックは消さない
+    if cache.get(lock_key(key)) == token:
+        cache.delete(lock_key(key))
+
+
+def wait_for(load, family):
+    """
+    他のリクエストが作り直している値を、load()がNone以外を返すまで最長settings.CACHING["WAIT_SECONDS"]秒待つ
+    """
+    metrics.incr(family, "waits")
+    deadline = time.monotonic() + settings.CACHING["WAIT_SECONDS"]
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = load()
+        if value is not None:
+            return value
+    return None
+
+
+def should_refresh(delta, expires_at, now):
+    # XFetch: -log(U)は平均1の指数分布なので、期限のdelta * BETA秒ほど前から作り直す確率が上がっていく
+    return now - delta * settings.CACHING["BETA"] * math.log(1.0 - random.random()) >= expires_at
+
+
+def refresh(key, compute, timeout, family):
+    started_at = time.perf_counter()
+    value = compute()
+    delta = time.perf_counter() - started_at
+    # 期限を過ぎてもSTALE_SECONDS秒は残し、作り直している間は古い値を返せるようにする
+    cache.set(key, (value, delta, time.time() + timeout), timeout + settings.CACHING["STALE_SECONDS"])
+    metrics.incr(family, "recomputes")
+    return value
+
+
+def get_or_set(key, compute, timeout, family="default"):
+    """
+    keyの値を返す。なければcompute()で作ってtimeout秒キャッシュする
+    """
+    key = current_key(key)
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        now = time.time()
+        if not should_refresh(delta, expires_at, now):
+            metrics.incr(family, "hits")
+            return value
+        # 期限が近いか過ぎている。作り直すのは1つのリクエストだけで、他は今の値を返す
+        metrics.incr(family, "stale_hits" if now >= expires_at else "hits")
+        token = acquire(key)
+        if token is None:
+            return value
+        try:
+            return refresh(key, compute, timeout, family)
+        finally:
+            release(key, token)
+
+    metrics.incr(family, "misses")
+    token = acquire(key)
+    if token is None:
+        entry = wait_for(lambda: cache.get(key), family)
+        if entry is not None:
+            return entry[0]
+        # 待っても作り終わらなければ、自分で作る(保存は作り直している方に任せる)
+        metrics.incr(family, "recomputes")
+        return compute()
+    try:
+        return refresh(key, compute, timeout, family)
+    finally:
+        release(key, token)
+
+
+def delete(key):
+    bump_version(version_key(key))
+
+
+def bump_version(key):
+    """
+    バージョンを新しい値にする(バージョンがないときは0とみなす)
+
+    incr()はバックエンドによっては読んでから書くので、同時に上げると同じ番号になることがある。
+    番号を数える代わりに、他のどのプロセスとも重ならない値で上書きする
+    """
+    cache.set(key, uuid.uuid4().hex, None)
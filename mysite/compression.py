@@ -0,0 +1,139 @@
+"""
+レスポンスの本文を、Accept-Encodingに応じてbrotli・gzipで圧縮するミドルウェアを定義します
+
+settings.COMPRESSIONのMIN_SIZEバイト未満の本文と、CONTENT_TYPES以外(画像など圧縮済みのもの)はそのまま返す。
+brotliはbrotliパッケージ(pip install brotli)がある場合だけ使う。
+BREACH対策として、DjangoのGZipMiddlewareと同じくgzipのヘッダーに乱数長のファイル名を入れる
+"""
+
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# BREACH対策でgzipのヘッダーに入れる最大のバイト数(django.middleware.gzip.GZipMiddlewareと同じ)
+MAX_RANDOM_BYTES = 100
+
+accept_encoding_re = _lazy_re_compile(r"^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$")
+
+
+def available_encodings():
+    """
+    使える圧縮方式を、優先する順に返す
+    """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def parse_accept_encoding(header):
+    """
+    Accept-Encodingを{方式: q値}にする。形式が正しくない項目は無視する
+    """
+    qualities = {}
+    for item in header.split(","):
+        match = accept_encoding_re.match(item)
+        if match is None:
+            continue
+        coding, quality = match.groups()
+        try:
+            qualities[coding.lower()] = float(quality) if quality is not None else 1.0
+        except ValueError:
+            continue
+    return qualities
+
+
+def negotiate(header, encodings):
+    """
+    encodings(優先する順)のうち、Accept-Encodingで受け付けるq値が最も高いものを返す。なければNone
+    """
+    qualities = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(encoding, content):
+    if encoding == "br":
+        return brotli.compress(content, quality=settings.COMPRESSION["BROTLI_QUALITY"])
+    return compress_string(content, max_random_bytes=MAX_RANDOM_BYTES)
+
+
+def compress_stream(encoding, chunks):
+    if encoding == "gzip":
+        yield from compress_sequence(chunks, max_random_bytes=MAX_RANDOM_BYTES)
+        return
+    compressor = brotli.Compressor(quality=settings.COMPRESSION["BROTLI_QUALITY"])
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        # 少しずつ返すストリーミングなので、chunkごとに圧縮済みの分を送り出す
+        data += compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    settings.MIDDLEWAREの先頭近く(本文を書き換える他のミドルウェアより前)に置く
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        encoding = self.choose_encoding(request, response)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(encoding, response.streaming_content)
+            # 圧縮後の長さは分からない
+            del response["Content-Length"]
+        else:
+            compressed = compress(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        # 圧縮すると本文のバイト列が変わるので、強いETagは弱いETagにする
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+    def choose_encoding(self, request, response):
+        options = settings.COMPRESSION
+        if not options["ENABLED"] or response.has_header("Content-Encoding"):
+            return None
+        content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+        if not content_type.startswith(tuple(options["CONTENT_TYPES"])):
+            return None
+        if not response.streaming and len(response.content) < options["MIN_SIZE"]:
+            return None
+
+        # 圧縮するかどうかはAccept-Encodingで変わるので、圧縮しない場合もキャッシュに伝える
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""), available_encodings())
+
+
+def decompress(encoding, content):
+    """
+    テスト・計測用。compress()で圧縮した本文を元に戻す
+    """
+    if encoding == "br":
+        return brotli.decompress(content)
+    if encoding == "gzip":
+        return gzip.decompress(content)
+    return content
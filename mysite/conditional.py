@@ -0,0 +1,65 @@
+"""
+一覧画面のGETに弱いETagを付け、If-None-Matchが一致すればテンプレートを描画せずに304を返すMixinを定義します
+
+ETagは、画面に表示する値(ツイートのIDといいね数など)だけを読む軽いクエリから作る。
+そのためモデルの組み立てと描画を省けるが、DBは毎回読む(表示が古くならない)
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from notifications.aggregate import unread_count
+
+
+def weak_etag(parts):
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+class ConditionalGetMixin:
+    """
+    etag_parts()で画面の内容を決める値のtupleを返す。Noneを返すとETagを付けない
+
+    LoginRequiredMixinより後ろに置く(未ログインのリクエストでETagを計算しない)
+    """
+
+    def etag_parts(self):
+        raise NotImplementedError
+
+    def get_etag(self):
+        parts = self.etag_parts()
+        if parts is None:
+            return None
+        request = self.request
+        # 全画面に共通する値: 閲覧者、フォームのCSRFトークン(の元の値)、ヘッダーの未読の通知の件数
+        common = (
+            settings.CONDITIONAL_GET_VERSION,
+            request.user.pk,
+            request.user.username,
+            request.META.get("CSRF_COOKIE"),
+            unread_count(request.user),
+        )
+        return weak_etag((common, parts))
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = self.get_etag()
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return self.patch_response(not_modified, etag)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if etag is not None and response.status_code == 200 and not response.has_header("ETag"):
+            self.patch_response(response, etag)
+        return response
+
+    def patch_response(self, response, etag):
+        response["ETag"] = etag
+        # 閲覧者ごとの画面なので共有キャッシュには載せず、ブラウザには毎回ETagで確認させる
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,95 @@
+"""
+Idempotency-Keyヘッダーによる、書き込みリクエストの再送の重複排除を定義します
+
+クライアントは同じ操作の再送に同じIdempotency-Keyを付ける。最初のレスポンス(ステータス・Content-Type・
+Location・本文)をキャッシュにsettings.IDEMPOTENCY_KEY_TTL秒保存し、再送にはビューを実行せずに同じレスポンスを返す。
+キーはユーザーとURLごとに区別する
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+def cache_key(request, key):
+    client = request.user.pk if request.user.is_authenticated else request.META.get("REMOTE_ADDR", "")
+    digest = hashlib.sha256(f"{client}:{request.path}:{key}".encode()).hexdigest()
+    return f"idempotency:{digest}"
+
+
+def fingerprint(response):
+    return (response.status_code, response.get("Content-Type"), response.get("Location"), response.content)
+
+
+def replay(saved):
+    status, content_type, location, content = saved
+    response = HttpResponse(content, status=status, content_type=content_type)
+    if location:
+        response["Location"] = location
+    response[REPLAYED_HEADER] = "true"
+    return response
+
+
+def run_once(request, view_func, *args, **kwargs):
+    """
+    Idempotency-Keyが付いていれば、同じキーで最初に返したレスポンスを返す。付いていなければview_funcをそのまま実行する
+    """
+    key = request.headers.get(HEADER)
+    if not key:
+        return view_func(request, *args, **kwargs)
+    if len(key) > MAX_KEY_LENGTH:
+        return HttpResponse(f"{HEADER}は{MAX_KEY_LENGTH}文字以下にしてください。", status=400)
+
+    result_key = cache_key(request, key)
+    body_hash = hashlib.sha256(request.body).hexdigest()
+    saved = cache.get(result_key)
+    if saved is not None:
+        saved_body_hash, saved_response = saved
+        if saved_body_hash != body_hash:
+            return HttpResponse(f"同じ{HEADER}で異なる内容のリクエストは送れません。", status=422)
+        return replay(saved_response)
+
+    # 同じキーのリクエストが処理中なら、二重に実行しない
+    lock_key = f"{result_key}:lock"
+    if not cache.add(lock_key, True, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+        return HttpResponse(f"同じ{HEADER}のリクエストを処理中です。", status=409)
+    try:
+        response = view_func(request, *args, **kwargs)
+        # 失敗(429や5xxなど)は再送で再実行できるよう保存しない
+        if response.status_code < 400 and not response.streaming:
+            cache.set(result_key, (body_hash, fingerprint(response)), settings.IDEMPOTENCY_KEY_TTL)
+        return response
+    finally:
+        cache.delete(lock_key)
+
+
+def idempotent(view_func):
+    """
+    関数ビューのPOSTにIdempotency-Keyを使えるようにするデコレーター
+    """
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return view_func(request, *args, **kwargs)
+        return run_once(request, view_func, *args, **kwargs)
+
+    return wrapper
+
+
+class IdempotentMixin:
+    """
+    クラスビューのPOSTにIdempotency-Keyを使えるようにする。再送をレート制限に数えないよう、RateLimitMixinより前に書く
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != "POST":
+            return super().dispatch(request, *args, **kwargs)
+        return run_once(request, super().dispatch, *args, **kwargs)
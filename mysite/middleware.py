@@ -0,0 +1,41 @@
+"""
+プロジェクト全体で使うミドルウェアを定義します
+"""
+
+import time
+
+from django.conf import settings
+
+from .routers import use_primary
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+STICKY_COOKIE_NAME = "use_primary_until"
+
+
+class PrimaryStickinessMiddleware:
+    """
+    書き込みリクエストとその直後の一定時間、そのユーザーの読み込みをプライマリに固定する
+
+    レプリカへの反映が遅れても、自分のツイートやいいねがすぐに表示されるようにするため
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        is_write = request.method not in SAFE_METHODS
+        with use_primary(is_write or self.is_sticky(request)):
+            response = self.get_response(request)
+
+        if is_write and settings.DATABASE_REPLICAS:
+            window = settings.REPLICA_STICKINESS_SECONDS
+            response.set_cookie(
+                STICKY_COOKIE_NAME, str(int(time.time() + window)), max_age=window, httponly=True, samesite="Lax"
+            )
+        return response
+
+    def is_sticky(self, request):
+        try:
+            return int(request.COOKIES[STICKY_COOKIE_NAME]) > time.time()
+        except (KeyError, ValueError):
+            return False
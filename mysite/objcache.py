@@ -0,0 +1,173 @@
+"""
+よく読むモデルのインスタンス(ユーザー、ツイートなど)を主キーでキャッシュします
+
+    users = ObjectCache(User)
+    authors = users.get_many(author_ids)  # {主キー: User}
+
+1段目はプロセス内のLRU(settings.OBJECT_CACHE["LOCAL_MAX_BYTES"]バイトまで、LOCAL_TIMEOUT秒)、
+2段目はDjangoのキャッシュ。どちらにもなければまとめて1回DBから読む。
+save()・delete()のシグナルでインスタンスごとのバージョンを上げ、2段目のキーにバージョンを含める
+(変更前に読んだ古いインスタンスを後から保存しても、誰も読まないキーになる)。
+2段目とバージョンは全てのプロセスで共有する(settings.CACHES)ので、他のプロセスでの変更も
+このプロセスの1段目がLOCAL_TIMEOUT秒で切れた後は反映される。update()・raw SQLの変更はシグナルが出ないので、
+そうして変わるフィールドはfieldsに含めない
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+from . import caching
+
+# 作成したObjectCache(CacheStatsViewでメモリの使用量を表示する)
+registry = {}
+
+
+class LocalLRU:
+    """
+    pickleしたバイト列を保持するLRU。合計のバイト数がmax_bytesを超えたら古いものから捨てる
+
+    バイト列で持つので、取り出したインスタンスを書き換えてもキャッシュは変わらない
+    """
+
+    def __init__(self, max_bytes, timeout):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = (data, time.monotonic() + self.timeout)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        data, _ = self._entries.pop(key)
+        self.bytes -= len(data)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "evictions": self.evictions}
+
+
+class ObjectCache:
+    """
+    modelのインスタンスのキャッシュ。fieldsを指定するとそのフィールドだけを読んでキャッシュする(他はdeferred)。
+    fetch(ids)でDBからの読み方(シャードなど)を差し替えられる
+    """
+
+    def __init__(self, model, fields=None, fetch=None):
+        self.model = model
+        self.fields = fields
+        self.fetch = fetch or self.fetch_default
+        self.label = model._meta.label_lower
+        self.family = f"objects:{self.label}"
+        self.local = LocalLRU(settings.OBJECT_CACHE["LOCAL_MAX_BYTES"], settings.OBJECT_CACHE["LOCAL_TIMEOUT"])
+        registry[self.label] = self
+        post_save.connect(self.on_change, sender=model, weak=False)
+        post_delete.connect(self.on_change, sender=model, weak=False)
+
+    def version_key(self, pk):
+        return f"objcache:{self.label}:version:{pk}"
+
+    def object_key(self, pk, version):
+        return f"objcache:{self.label}:{pk}:{version}"
+
+    def fetch_default(self, ids):
+        queryset = self.model._default_manager.filter(pk__in=ids)
+        if self.fields is not None:
+            queryset = queryset.only(*self.fields)
+        return queryset
+
+    def get(self, pk):
+        return self.get_many([pk]).get(pk)
+
+    def get_many(self, ids):
+        """
+        {主キー: インスタンス}を返す。存在しない主キーは含めない
+        """
+        found = {}
+        missing = []
+        for pk in dict.fromkeys(ids):
+            data = self.local.get(pk)
+            if data is None:
+                missing.append(pk)
+            else:
+                found[pk] = pickle.loads(data)
+        caching.metrics.incr(self.family, "local_hits", len(found))
+        if not missing:
+            return found
+
+        versions = cache.get_many([self.version_key(pk) for pk in missing])
+        keys = {pk: self.object_key(pk, versions.get(self.version_key(pk), 0)) for pk in missing}
+        shared = cache.get_many(keys.values())
+        for pk in missing:
+            data = shared.get(keys[pk])
+            if data is not None:
+                self.local.set(pk, data)
+                found[pk] = pickle.loads(data)
+        caching.metrics.incr(self.family, "hits", len(shared))
+
+        missing = [pk for pk in missing if pk not in found]
+        caching.metrics.incr(self.family, "misses", len(missing))
+        if missing:
+            to_store = {}
+            for instance in self.fetch(missing):
+                data = pickle.dumps(instance, pickle.HIGHEST_PROTOCOL)
+                to_store[keys[instance.pk]] = data
+                self.local.set(instance.pk, data)
+                found[instance.pk] = instance
+            cache.set_many(to_store, settings.OBJECT_CACHE["TIMEOUT"])
+            caching.metrics.incr(self.family, "recomputes", len(to_store))
+        return found
+
+    def invalidate(self, pk):
+        caching.bump_version(self.version_key(pk))
+        self.local.delete(pk)
+
+    def on_change(self, sender, instance, **kwargs):
+        self.invalidate(instance.pk)
+
+
+def clear_local():
+    """
+    このプロセスの1段目のキャッシュを全て消す(テスト用)
+    """
+    for object_cache in registry.values():
+        object_cache.local.clear()
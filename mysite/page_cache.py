@@ -0,0 +1,154 @@
+"""
+未ログインの訪問者に同じ内容を返すページ(ウェルカムページなど)を、URLごとにキャッシュします
+
+    @method_decorator(cache_anonymous_page(tags=["user:{username}"]), name="dispatch")
+    class SomeView(View): ...
+
+PageCacheMiddlewareをSessionMiddlewareより前に置き、セッションのcookieがないGETにはキャッシュから返す
+(セッション・認証・ビュー・テンプレートの処理を全て省く)。キャッシュのキーはURLごと。
+LocaleMiddlewareを使わず、どのリクエストもsettings.LANGUAGE_CODEで描画するので、言語はキーに含めない
+(リクエストごとに言語を切り替えるなら、translation.get_language_from_request()の値をキーに加えること)。
+タグのバージョンをキャッシュと一緒に保存しておき、purge(tag)でバージョンを上げると、そのタグのページは全て無効になる。
+キャッシュがないときは1つのリクエストだけが描画し(single-flight、mysite/caching.py)、同じURLの他のリクエストはその結果を待つ
+
+タグのバージョンはDjangoのキャッシュに置くので、purge()が他のプロセス(run_tasksでのユーザーの削除、
+import_followsなど)のキャッシュにも届くのは、settings.CACHESを全てのプロセスで共有しているときだけ。
+プロセスごとのLocMemCacheでは、他のプロセスでのpurge()はTIMEOUT秒まで反映されない
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import caching
+
+FAMILY = "page"
+
+SAFE_METHODS = ("GET", "HEAD")
+# 全てのページが持つタグ。purge()で全ページを無効にする
+ALL = "all"
+
+
+def is_anonymous(request):
+    # セッションを読まずに判定する。cookieがあればログイン中かもしれないのでキャッシュしない
+    return request.method in SAFE_METHODS and settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def page_key(request):
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"page_cache:{digest}"
+
+
+def version_key(tag):
+    return f"page_cache:version:{tag}"
+
+
+def user_tag(username):
+    # ユーザーのツイート・フォローを表示するページのタグ
+    return f"user:{username}"
+
+
+def current_versions(tags):
+    keys = [version_key(tag) for tag in (ALL, *tags)]
+    versions = cache.get_many(keys)
+    return {key: versions.get(key, 0) for key in keys}
+
+
+def purge(*tags):
+    """
+    tagsを持つページのキャッシュを無効にする。tagsを省略すると全てのページ
+
+    ページの内容を変えた処理からcommitの後に呼ぶ(ユーザーのページならaccounts.caches.invalidate_follow_countsなど)
+    """
+    for tag in tags or (ALL,):
+        caching.bump_version(version_key(tag))
+
+
+def get_cached(request):
+    """
+    requestのURLの有効なキャッシュがあればHttpResponseで返す
+    """
+    entry = cache.get(page_key(request))
+    if entry is None:
+        return None
+    tags, versions, status, headers, content = entry
+    # 保存した後にpurge()されていれば使わない
+    if current_versions(tags) != versions:
+        return None
+    response = HttpResponse(content, status=status)
+    for name, value in headers:
+        response[name] = value
+    return response
+
+
+def cache_anonymous_page(timeout=None, tags=()):
+    """
+    未ログインのGETのレスポンスをキャッシュするビューのdecorator。tagsはビューの引数でformatする
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.PAGE_CACHE["ENABLED"] or not is_anonymous(request):
+                return view(request, *args, **kwargs)
+
+            key = page_key(request)
+            token = caching.acquire(key)
+            if token is None:
+                response = caching.wait_for(lambda: get_cached(request), FAMILY)
+                if response is not None:
+                    return response
+                # 待っても描画が終わらなければ、キャッシュには保存せずに自分で描画する
+                return view(request, *args, **kwargs)
+
+            # 描画中にpurge()されたら古い内容とみなせるよう、バージョンは描画の前に読む
+            page_tags = [tag.format(**kwargs) for tag in tags]
+            request.page_cache = (
+                key,
+                token,
+                page_tags,
+                current_versions(page_tags),
+                timeout or settings.PAGE_CACHE["TIMEOUT"],
+            )
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class PageCacheMiddleware:
+    """
+    CompressionMiddlewareより後、SessionMiddlewareより前に置く
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.PAGE_CACHE["ENABLED"] and is_anonymous(request):
+            response = get_cached(request)
+            caching.metrics.incr(FAMILY, "misses" if response is None else "hits")
+            if response is not None:
+                return response
+
+        response = self.get_response(request)
+        entry = getattr(request, "page_cache", None)
+        if entry is not None:
+            key, token, tags, versions, timeout = entry
+            try:
+                self.store(request, response, key, tags, versions, timeout)
+            finally:
+                caching.release(key, token)
+        return response
+
+    def store(self, request, response, key, tags, versions, timeout):
+        # cookieを設定するレスポンス(訪問者ごとの内容)は保存しない
+        if request.method != "GET" or response.status_code != 200 or response.streaming or response.cookies:
+            return
+        headers = [(name, value) for name, value in response.items() if name.lower() != "set-cookie"]
+        cache.set(key, (tags, versions, response.status_code, headers, response.content), timeout)
+        caching.metrics.incr(FAMILY, "recomputes")
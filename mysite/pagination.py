@@ -0,0 +1,125 @@
+"""
+一覧画面で使うキーセットページネーションを定義します
+
+OFFSETやCOUNT(*)を使わず、直前のページの最後の行(cursor)より後ろの行だけを取得します
+"""
+
+import datetime
+
+from django.db.models import Q
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+# 主キーはSQLiteのINTEGER(符号付き64ビット)に収まる値だけを受け付ける
+MAX_ID = 2**63 - 1
+
+
+def encode_cursor(created_at, pk):
+    # datetimeはマイクロ秒の整数にしてURLに載せる
+    delta = created_at - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return f"{microseconds}_{pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        microseconds, pk = (int(part) for part in cursor.split("_"))
+        # datetimeで表せない範囲(1年より前、9999年より後)はOverflowError
+        value = EPOCH + datetime.timedelta(microseconds=microseconds)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    if not -MAX_ID <= pk <= MAX_ID:
+        return None
+    return value, pk
+
+
+class KeysetPaginationMixin:
+    """
+    ListViewのobject_listを(created_at, id)の降順でページ分割するMixin
+
+    page_size + 1件を取得して次のページがあるかを判定するため、COUNT(*)は発行しない
+    """
+
+    page_size = 20
+    cursor_kwarg = "cursor"
+    cursor_field = "created_at"
+
+    def paginate_keyset(self, queryset):
+        field = self.cursor_field
+        cursor = decode_cursor(self.request.GET.get(self.cursor_kwarg))
+        if cursor is not None:
+            value, pk = cursor
+            queryset = queryset.filter(Q(**{f"{field}__lt": value}) | Q(**{field: value, "pk__lt": pk}))
+
+        rows = list(queryset.order_by(f"-{field}", "-pk")[: self.page_size + 1])
+        has_next = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].pk) if has_next else None
+        return rows, next_cursor
+
+    def get_context_data(self, **kwargs):
+        object_list, next_cursor = self.paginate_keyset(self.object_list)
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        # listからはモデル名を取れないので、querysetからcontext名(follow_listなど)を決める
+        context_object_name = self.get_context_object_name(self.object_list)
+        if context_object_name is not None:
+            context[context_object_name] = object_list
+        context["next_cursor"] = next_cursor
+        return context
+
+
+def parse_id(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if -MAX_ID <= value <= MAX_ID else None
+
+
+def paginate_by_id(request, queryset, page_size, fetch=None, hydrate=None):
+    """
+    querysetを主キーの降順でページ分割し、(そのページの行, 次のページのmax_id)を返す
+
+    ?max_id=より古い行、?since_id=より新しい行に絞り込める。主キーが作成順に並ぶテーブル向けで、
+    ORDER BYが主キーのindexだけで済む。fetch(queryset, limit)で取得方法を差し替えられる。
+    hydrateを渡すときは、fetchは主キーのlistを返し、hydrate(そのページの主キー)で表示する行にする。
+    次のページがあるかは組み立てる前の主キーで決めるので、hydrateが行を除いてもページ分割は途切れない
+    """
+    max_id = parse_id(request.GET.get("max_id"))
+    since_id = parse_id(request.GET.get("since_id"))
+    if max_id is not None:
+        queryset = queryset.filter(pk__lt=max_id)
+    if since_id is not None:
+        queryset = queryset.filter(pk__gt=since_id)
+    queryset = queryset.order_by("-pk")
+
+    limit = page_size + 1
+    rows = list(fetch(queryset, limit) if fetch else queryset[:limit])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    if hydrate is not None:
+        return hydrate(rows), rows[-1] if has_next else None
+    return rows, rows[-1].pk if has_next else None
+
+
+class IdPaginationMixin:
+    """
+    ListViewのobject_listを主キーの降順でページ分割するMixin
+    """
+
+    page_size = 20
+    # fetch_page()が主キーのlistを返すときは、1ページ分の主キーを表示する行にするメソッドを定義する
+    hydrate_page = None
+
+    def fetch_page(self, queryset, limit):
+        return queryset[:limit]
+
+    def get_context_data(self, **kwargs):
+        object_list, next_max_id = paginate_by_id(
+            self.request, self.object_list, self.page_size, self.fetch_page, self.hydrate_page
+        )
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context_object_name = self.get_context_object_name(self.object_list)
+        if context_object_name is not None:
+            context[context_object_name] = object_list
+        context["next_max_id"] = next_max_id
+        return context
@@ -0,0 +1,162 @@
+"""
+ユーザーごと(未ログインならIPアドレスごと)と、IPアドレスごとのレート制限を定義します
+
+トークンバケット方式で、エンドポイントごとの上限をsettings.RATELIMIT["RATES"]に"件数/期間"で書く。
+例えば"30/m"なら最大30件まで連続で受け付け、その後は2秒に1件ずつ回復する。
+ログイン中のリクエストは、ユーザーのバケットに加えてIPアドレスのバケット(settings.RATELIMIT["IP_RATES"])からも取り出す。
+バケットの状態はsettings.RATELIMIT["STORE"]に保存する。既定のLocalStoreはプロセス内のメモリなので、
+DBへの問い合わせはなく、複数のプロセスで上限を共有したい場合はCacheStoreを使う
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    "30/m"を(バケットの容量, 毎秒の回復量)にする
+    """
+    count, period = rate.split("/")
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period]
+
+
+def take(state, capacity, refill_rate, now):
+    """
+    バケットからトークンを1つ取り出す。(新しい状態, 待つべき秒数)を返し、取り出せたときの秒数は0
+
+    stateは(残りのトークン, 最後に更新した時刻)か、初めてのキーならNone
+    """
+    tokens, updated_at = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / refill_rate
+
+
+class LocalStore:
+    """
+    プロセス内のメモリにバケットを保存する。保存するキーは最近使ったmax_keys個まで
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate):
+        with self.lock:
+            state, wait = take(self.buckets.get(key), capacity, refill_rate, time.monotonic())
+            self.buckets[key] = state
+            self.buckets.move_to_end(key)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class CacheStore:
+    """
+    Djangoのキャッシュ(settings.CACHES)にバケットを保存し、複数のプロセスで共有する
+
+    読み込みと書き込みの間に他のプロセスが書き込むと、上限を少し超えて受け付けることがある
+    """
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    def consume(self, key, capacity, refill_rate):
+        cache = caches[self.alias]
+        state, wait = take(cache.get(key), capacity, refill_rate, time.time())
+        # 空のバケットが満タンに戻るまでの時間が過ぎれば、状態は不要になる
+        cache.set(key, state, math.ceil(capacity / refill_rate))
+        return wait
+
+
+_store = None
+
+
+def reset():
+    """
+    settings.RATELIMITから保存先を作り直す(テストで設定を変えたときにも使う)
+    """
+    global _store
+    config = settings.RATELIMIT
+    _store = import_string(config["STORE"])(**config.get("STORE_OPTIONS", {}))
+
+
+def buckets(request, scope):
+    """
+    requestが取り出すバケットの(キー, 上限)を順に返す
+
+    ログイン中はユーザーごとのRATESと、IPアドレスごとのIP_RATES(なければRATES)。未ログインならIPアドレスごとのRATES
+    """
+    config = settings.RATELIMIT
+    ip_key = f"ratelimit:{scope}:ip:{request.META.get('REMOTE_ADDR', '')}"
+    if not request.user.is_authenticated:
+        return [(ip_key, config["RATES"][scope])]
+    return [
+        (f"ratelimit:{scope}:user:{request.user.pk}", config["RATES"][scope]),
+        (ip_key, config.get("IP_RATES", {}).get(scope, config["RATES"][scope])),
+    ]
+
+
+def check(request, scope):
+    """
+    requestがscopeの上限を超えていれば429のレスポンスを、超えていなければNoneを返す
+    """
+    if not settings.RATELIMIT["ENABLED"]:
+        return None
+    for key, rate in buckets(request, scope):
+        # 超えたバケットより後のバケットからは取り出さない(ユーザーの上限を超えた分でIPアドレスの上限を減らさない)
+        wait = _store.consume(key, *parse_rate(rate))
+        if wait:
+            break
+    if not wait:
+        return None
+    response = HttpResponse("リクエストが多すぎます。しばらくしてから再度お試しください。", status=429)
+    response["Retry-After"] = str(math.ceil(wait))
+    return response
+
+
+def ratelimit(scope, methods=("POST",)):
+    """
+    関数ビューにscopeのレート制限をかけるデコレーター。methods以外のリクエストは制限しない
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods and (response := check(request, scope)) is not None:
+                return response
+            return view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class RateLimitMixin:
+    """
+    クラスビューにratelimit_scopeのレート制限をかける。LoginRequiredMixinより後ろに書くこと
+    """
+
+    ratelimit_scope = None
+    ratelimit_methods = ("POST",)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in self.ratelimit_methods and (response := check(request, self.ratelimit_scope)) is not None:
+            return response
+        return super().dispatch(request, *args, **kwargs)
+
+
+reset()
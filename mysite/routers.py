@@ -0,0 +1,77 @@
+"""
+読み込みをレプリカへ、書き込みをプライマリ(default)へ振り分けるデータベースルーターを定義します
+
+settings.DATABASE_REPLICASが空のときは全てdefaultを使う
+"""
+
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+
+PRIMARY = "default"
+
+_use_primary = contextvars.ContextVar("use_primary", default=False)
+
+
+@contextmanager
+def use_primary(enabled=True):
+    """
+    このブロック内の読み込みをプライマリに固定する
+    """
+    token = _use_primary.set(enabled)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or _use_primary.get():
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので、どの組み合わせでも同じデータを指している
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカのスキーマはプライマリからコピーされる
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class CacheRouter:
+    """
+    DatabaseCache(settings.CACHES)のテーブルをCACHE_DATABASEに置く
+
+    キャッシュの書き込みをリクエストのトランザクションから切り離し(ロールバックで消えない)、
+    ツイートなどの書き込みとSQLiteのロックを取り合わないようにする
+    """
+
+    app_label = "django_cache"
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return settings.CACHE_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == settings.CACHE_DATABASE:
+            return app_label == self.app_label
+        if app_label == self.app_label:
+            return False
+        return None
@@ -13,6 +13,11 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 from pathlib import Path
 
 AUTH_USER_MODEL = "accounts.User"
+# セッションのユーザーをキャッシュから読む。ModelBackendは、それでログインした既存のセッションのために残す
+AUTHENTICATION_BACKENDS = [
+    "accounts.backends.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,10 +47,17 @@ INSTALLED_APPS = [
     "accounts.apps.AccountsConfig",
     "tweets.apps.TweetsConfig",
     "welcome.apps.WelcomeConfig",
+    "taskqueue.apps.TaskqueueConfig",
+    "notifications.apps.NotificationsConfig",
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # 本文を書き換える他のミドルウェアより前に置き、最後に圧縮する
+    "mysite.compression.CompressionMiddleware",
+    # 未ログインのリクエストにキャッシュから返すので、セッションを読むミドルウェアより前に置く
+    "mysite.page_cache.PageCacheMiddleware",
+    "mysite.middleware.PrimaryStickinessMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -60,13 +72,24 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "notifications.context_processors.unread_notifications",
+            ],
+            # APP_DIRSの代わりにloadersを明示する。テンプレートは名前ごとに1度だけ探して解析し、プロセス内に保持する
+            # (runserverではテンプレートを編集するとキャッシュが消える)
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
             ],
         },
     },
@@ -78,12 +101,206 @@ WSGI_APPLICATION = "mysite.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# 接続ごとに実行するPRAGMA(mysite/sqlite3/base.py)
+# WALにすると読み込みが書き込みを待たなくなり、synchronous=NORMALでcommitごとのfsyncを減らせる
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+}
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "mysite.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # ロックが解放されるまで待つ秒数(busy timeout)
+            "timeout": 20,
+            "pragmas": SQLITE_PRAGMAS,
+            "transaction_mode": "IMMEDIATE",
+        },
+        # リクエストごとに接続し直さず、接続を使い回す
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+    },
+    # ツイート・いいねのシャード。TWEET_SHARDSに並べるまでは接続しない(テストではこの2つでシャーディングを試す)
+    # シャードにはユーザーのテーブルがないため、外部キーの制約は無効にする
+    "tweets_0": {
+        "ENGINE": "mysite.sqlite3",
+        "NAME": BASE_DIR / "tweets_0.sqlite3",
+        "OPTIONS": {"timeout": 20, "pragmas": {**SQLITE_PRAGMAS, "foreign_keys": "OFF"}},
+    },
+    "tweets_1": {
+        "ENGINE": "mysite.sqlite3",
+        "NAME": BASE_DIR / "tweets_1.sqlite3",
+        "OPTIONS": {"timeout": 20, "pragmas": {**SQLITE_PRAGMAS, "foreign_keys": "OFF"}},
+    },
+    # Djangoのキャッシュのテーブル(CACHES)。書き込みの前にロックを取るよう、トランザクションはIMMEDIATEで始める
+    "cache": {
+        "ENGINE": "mysite.sqlite3",
+        "NAME": BASE_DIR / "cache.sqlite3",
+        "OPTIONS": {"timeout": 20, "pragmas": SQLITE_PRAGMAS, "transaction_mode": "IMMEDIATE"},
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+    },
+}
+# CACHESのテーブルを置くDB名(mysite/routers.py)
+CACHE_DATABASE = "cache"
+
+# 読み込み専用のレプリカ(mysite/routers.py)
+# 例: DATABASES["replica1"]を追加し、DATABASE_REPLICAS = ["replica1"]とする
+# ローカルでは python manage.py sync_replicas でdefaultのファイルをレプリカにコピーできる
+DATABASE_REPLICAS = []
+# 書き込んだユーザーの読み込みをプライマリに固定しておく秒数
+REPLICA_STICKINESS_SECONDS = 5
+
+# ツイート・いいねを分散して保存するシャードのDB名(tweets/sharding.py)
+# 例: TWEET_SHARDS = ["tweets_0", "tweets_1"]とする(DATABASESに定義済み)
+# シャードを増やすときも、OPTIONSには"pragmas": {"foreign_keys": "OFF"}を指定する
+# シャードの作成: python manage.py migrate --database=tweets_0
+TWEET_SHARDS = []
+# シャーディングしない場合も、ツイートのIDをsnowflake形式(時刻順の64bit)で払い出すか
+# 既存のツイートは python manage.py rekey_tweets でsnowflake形式のIDに振り直せる
+TWEET_SNOWFLAKE_IDS = False
+# snowflake形式のIDに埋め込むワーカー番号(0〜63)。同じ番号のプロセスが同時に動くとIDが重なる
+# Noneなら、CACHESで他のプロセスと重ならない番号をSNOWFLAKE_WORKER_LEASE_SECONDS秒ずつ借りる(tweets/ids.py)
+SNOWFLAKE_WORKER_ID = None
+SNOWFLAKE_WORKER_LEASE_SECONDS = 60
+
+# 古いツイートを移すアーカイブのSQLiteファイル(tweets/archive.py)。Noneならアーカイブしない
+# 例: TWEET_ARCHIVE_PATH = BASE_DIR / "archive.sqlite3"
+# python manage.py archive_tweets でTWEET_ARCHIVE_AFTER_DAYSより古いツイートを移す
+TWEET_ARCHIVE_PATH = None
+TWEET_ARCHIVE_AFTER_DAYS = 365
+
+# いいねが集中しているツイートの検出(tweets/hotkeys.py)
+# WINDOW_SECONDS秒の区間で毎秒THRESHOLD_PER_SECOND件以上いいねされたツイートは、いいね数をメモリ上で束ね、
+# FOLD_INTERVAL_SECONDS秒ごとにDBへ反映する
+# python manage.py reconcile_like_counts は、最後のいいねからRECONCILE_AFTER_SECONDS秒経ったツイートの
+# いいね数を数え直す(強制終了したプロセスの反映前の増減を直す)。FOLD_INTERVAL_SECONDSより十分に長くする
+HOT_TWEETS = {
+    "CAPACITY": 100,
+    "WINDOW_SECONDS": 10,
+    "THRESHOLD_PER_SECOND": 5,
+    "COUNTER_SHARDS": 16,
+    "FOLD_INTERVAL_SECONDS": 2,
+    "RECONCILE_AFTER_SECONDS": 60,
+}
+
+# トレンド(tweets.trending)。いいねの重みはHALF_LIFE_HOURS時間で半分になり、
+# 減衰していいねMIN_LIKES件分を下回ったツイートは候補から外す。
+# refresh_trendingは別のプロセスで動くので、画面はCACHE_TIMEOUT秒ごとにTrendingTweetを読み直す
+TRENDING = {
+    "HALF_LIFE_HOURS": 6,
+    "SIZE": 50,
+    "CANDIDATES": 1000,
+    "MIN_LIKES": 0.5,
+    "CACHE_TIMEOUT": 60,
+}
+# レート制限(mysite/ratelimit.py)。RATESは"件数/期間(s, m, h, d)"で、ログイン中はユーザーごと、
+# 未ログインならIPアドレスごとに数える。ログイン中はIPアドレスごとのIP_RATESも超えないようにする
+# (1つのIPアドレスから複数のアカウントで上限を回避させない。NATなどでIPアドレスを共有する利用者がいるので多めにする)。
+# 複数のプロセスで共有するにはSTOREを"mysite.ratelimit.CacheStore"にする
+RATELIMIT = {
+    "ENABLED": True,
+    "STORE": "mysite.ratelimit.LocalStore",
+    "RATES": {
+        "tweet_create": "30/m",
+        "like": "120/m",
+        "follow": "60/m",
+    },
+    "IP_RATES": {
+        "tweet_create": "300/m",
+        "like": "1200/m",
+        "follow": "600/m",
+    },
+}
+# Idempotency-Keyヘッダー付きのPOSTのレスポンスを保存する秒数(mysite/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# 同じキーのリクエストを処理中とみなす最長の秒数
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+# ツイートの詳細画面に表示する、最近いいねしたユーザーの人数と、その一覧をキャッシュする秒数(tweets/likers.py)
+LIKERS_SUMMARY_SIZE = 3
+LIKERS_SUMMARY_TIMEOUT = 5 * 60
+
+# レスポンスの圧縮(mysite/compression.py)。MIN_SIZEバイト未満の本文は圧縮しない
+# brotliはbrotliパッケージ(pip install brotli)がインストールされていれば使い、なければgzipだけを使う
+COMPRESSION = {
+    "ENABLED": True,
+    "MIN_SIZE": 500,
+    "BROTLI_QUALITY": 5,
+    "CONTENT_TYPES": ["text/", "application/json", "application/javascript", "application/x-ndjson"],
+}
+# Djangoのキャッシュ。ログインユーザー(accounts/backends.py)・ページ・フォロー数などの無効化は、
+# 変更したプロセス(run_tasksのタスク、manage.pyのコマンドなど)がここに書き込むので、全てのプロセスで共有する。
+# ロック(mysite/caching.py、mysite/idempotency.py)はadd()で取るので、add()が複数のプロセスの間で
+# アトミックなバックエンドにする。DatabaseCacheはキーが主キーなので、同じキーのINSERTは1つしか成功しない
+# (FileBasedCacheのadd()は確認と書き込みが別の操作で、set()のたびにディレクトリを全て読む)。
+# テーブルの作成: python manage.py createcachetable --database=cache
+# 複数のホストで動かすならRedisかMemcachedにする
+CACHES = {
+    "default": {
+        "BACKEND": "mysite.cache_backends.DatabaseCache",
+        "LOCATION": "django_cache",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
     }
 }
+# テストの間はキャッシュをプロセス内に置き換える(mysite/test_runner.py)
+TEST_RUNNER = "mysite.test_runner.TestRunner"
+
+# 未ログインの訪問者向けのページのキャッシュ(mysite/page_cache.py)。TIMEOUT秒で作り直す
+# purge()はCACHESに書き込むので、他のプロセスのページも無効になる(CACHESを共有しているため)
+# キャッシュがないURLは1つのリクエストだけが描画し、他のリクエストはCACHING["WAIT_SECONDS"]秒まで待つ
+PAGE_CACHE = {
+    "ENABLED": True,
+    "TIMEOUT": 10 * 60,
+}
+# 作り直すのに時間のかかる値のキャッシュ(mysite/caching.py)
+# LOCK_TIMEOUT: 1つのリクエストが作り直している間、他のリクエストが作り直さない最長の秒数
+# STALE_SECONDS: 期限が切れた後も、作り直している間に古い値を返す秒数
+# BETA: 大きいほど期限の前に作り直しやすくなる(XFetch)
+CACHING = {
+    "LOCK_TIMEOUT": 10,
+    "WAIT_SECONDS": 2,
+    "STALE_SECONDS": 60,
+    "BETA": 1.0,
+}
+# よく読むユーザー・ツイートのキャッシュ(mysite/objcache.py)。プロセス内にLOCAL_MAX_BYTESバイトまで
+# LOCAL_TIMEOUT秒保持し、その後ろのDjangoのキャッシュにTIMEOUT秒保持する
+# 他のプロセスでの変更は、プロセス内のキャッシュにはLOCAL_TIMEOUT秒遅れて反映される
+OBJECT_CACHE = {
+    "TIMEOUT": 60 * 60,
+    "LOCAL_TIMEOUT": 5,
+    "LOCAL_MAX_BYTES": 8 * 1024 * 1024,
+}
+# プロフィールに表示するフォロー数・フォロワー数をキャッシュする秒数(accounts/caches.py)
+FOLLOW_COUNTS_TIMEOUT = 5 * 60
+# ホーム・プロフィール・フォロー一覧のETag(mysite/conditional.py)に含める値。テンプレートを変えたら上げる
+CONDITIONAL_GET_VERSION = 1
+
+# バックグラウンドのタスク(taskqueue)。python manage.py run_tasks で実行する
+# 失敗したタスクはBACKOFF_SECONDS, 2倍, 4倍...(最大MAX_BACKOFF_SECONDS)の間隔で、MAX_ATTEMPTS回まで実行する
+# 実行中のタスクはLEASE_SECONDSの1/3ごとに期限を延ばし、延ばされずに期限を過ぎたら他のワーカーが取り直す
+TASK_QUEUE = {
+    "BATCH_SIZE": 50,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_SECONDS": 5,
+    "MAX_BACKOFF_SECONDS": 600,
+    "LEASE_SECONDS": 300,
+    "POLL_INTERVAL_SECONDS": 1,
+    # run_tasksが定期的に追加するタスクと、前回の実行が終わってから次を実行するまでの秒数
+    "SCHEDULE": {
+        "notifications.aggregate": 30,
+        "tweets.refresh_trending": 60,
+        "tweets.reconcile_like_counts": 60,
+    },
+}
+
+DATABASE_ROUTERS = [
+    "mysite.routers.CacheRouter",
+    "tweets.sharding.TweetShardRouter",
+    "mysite.routers.PrimaryReplicaRouter",
+]
 
 
 # Password validation
@@ -133,6 +350,8 @@ LOGOUT_REDIRECT_URL = "accounts:login"
 
 # pushする時はFALSEにしないとテストに通らなくなる
 SQL_DEBUG = False
+# テンプレート・{% url %}ごとの描画時間を、ログとServer-Timingヘッダーに出す(mysite/template_profiler.py)
+TEMPLATE_PROFILING = False
 
 if SQL_DEBUG:
 
@@ -144,3 +363,6 @@ if SQL_DEBUG:
     DEBUG_TOOLBAR_CONFIG = {
         "SHOW_TOOLBAR_CALLBACK": show_toolbar,
     }
+
+if TEMPLATE_PROFILING:
+    MIDDLEWARE += ("mysite.template_profiler.TemplateProfilerMiddleware",)
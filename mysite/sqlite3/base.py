@@ -0,0 +1,36 @@
+"""
+接続ごとにPRAGMAを設定するSQLiteバックエンドを定義します
+
+DATABASESのOPTIONSで次の項目を指定できます
+- "pragmas": {名前: 値}。新しい接続を作るたびに実行する(journal_mode, synchronous, mmap_sizeなど)
+- "transaction_mode": "IMMEDIATE"を指定すると、atomic()の開始時に書き込みロックを取る
+"""
+
+from django.db.backends.sqlite3 import base
+
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # sqlite3.connect()には渡せない独自の項目を取り除く
+        self.pragmas = params.pop("pragmas", {})
+        self.transaction_mode = params.pop("transaction_mode", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        apply_pragmas(conn, self.pragmas)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # 既定のBEGIN(DEFERRED)では、読み込みから書き込みに切り替わる時点で他の書き込みと衝突すると
+        # busy timeoutを待たずに"database is locked"になるため、最初から書き込みロックを取る
+        if self.transaction_mode:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
+        else:
+            super()._start_transaction_under_autocommit()
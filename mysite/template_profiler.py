@@ -0,0 +1,123 @@
+"""
+テンプレートの描画時間を、テンプレート(include・extendsを含む)と{% url %}タグごとに集計します
+
+    with profile_templates() as profile:
+        render_to_string("tweets/home.html", context)
+    print(profile.report())
+
+settings.TEMPLATE_PROFILING = Trueにすると、TemplateProfilerMiddlewareがリクエストごとの集計を
+ログとServer-Timingヘッダーに出力する。計測はprofile_templates()の中の、同じスレッドの描画だけ
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.template.base import Template
+from django.template.defaulttags import URLNode
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+_install_lock = threading.Lock()
+_installed = False
+
+
+class TemplateProfile:
+    def __init__(self):
+        # ラベル -> (呼び出し回数, 合計時間, 内側のテンプレート・タグを除いた時間)
+        self.stats = {}
+        self._children = []
+
+    @contextmanager
+    def measure(self, label):
+        self._children.append(0.0)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            calls, total, own = self.stats.get(label, (0, 0.0, 0.0))
+            self.stats[label] = (calls + 1, total + elapsed, own + elapsed - children)
+
+    def rows(self):
+        """
+        (ラベル, 呼び出し回数, 合計時間, 内側を除いた時間)を、内側を除いた時間の長い順に返す
+        """
+        return sorted(((label, *stat) for label, stat in self.stats.items()), key=lambda row: row[3], reverse=True)
+
+    def report(self):
+        lines = [f"{'calls':>7} {'total ms':>10} {'self ms':>10}  template"]
+        for label, calls, total, own in self.rows():
+            lines.append(f"{calls:>7} {total * 1000:>10.2f} {own * 1000:>10.2f}  {label}")
+        return "\n".join(lines)
+
+    def server_timing(self, limit=10):
+        entries = []
+        for index, (label, calls, _, own) in enumerate(self.rows()[:limit]):
+            description = label.replace("\\", "").replace('"', "'")
+            entries.append(f'tpl{index};desc="{description} x{calls}";dur={own * 1000:.2f}')
+        return ", ".join(entries)
+
+
+def template_label(template):
+    return template.origin.template_name or template.name or "<string>"
+
+
+def url_label(node):
+    return f"{{% url {node.view_name.token} %}}"
+
+
+def timed(method, label):
+    @wraps(method)
+    def wrapper(self, context, *args, **kwargs):
+        profile = getattr(_state, "profile", None)
+        if profile is None:
+            return method(self, context, *args, **kwargs)
+        with profile.measure(label(self)):
+            return method(self, context, *args, **kwargs)
+
+    return wrapper
+
+
+def install():
+    """
+    テンプレートの描画とURLNodeに計測用のラッパーを入れる。計測中でなければ元の処理をそのまま呼ぶ
+    """
+    global _installed
+    with _install_lock:
+        if not _installed:
+            Template._render = timed(Template._render, template_label)
+            URLNode.render = timed(URLNode.render, url_label)
+            _installed = True
+
+
+@contextmanager
+def profile_templates():
+    install()
+    profile = TemplateProfile()
+    previous = getattr(_state, "profile", None)
+    _state.profile = profile
+    try:
+        yield profile
+    finally:
+        _state.profile = previous
+
+
+class TemplateProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # TemplateResponseもget_responseの中で描画されるので、ここで囲めば全て計測できる
+        with profile_templates() as profile:
+            response = self.get_response(request)
+        if profile.stats:
+            response["Server-Timing"] = profile.server_timing()
+            logger.info("template profile for %s\n%s", request.path, profile.report())
+        return response
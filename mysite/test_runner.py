@@ -0,0 +1,31 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# シャーディングのテスト(tweets.tests.TestShardedDatabases)でシャードにするDB
+TEST_TWEET_SHARDS = ["tweets_0", "tweets_1"]
+
+
+class TestRunner(DiscoverRunner):
+    """
+    テストの間はキャッシュをプロセス内(LocMemCache)にする
+
+    settings.CACHESのDatabaseCacheは、TransactionTestCaseのflushでは消えずに次のテストに残り、
+    assertNumQueriesで数える問い合わせにも含まれてしまう
+
+    テスト用のDBはシャーディングを有効にしてmigrateし、シャードには本番と同じくtweetsのテーブルだけを作る
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_settings = override_settings(
+            CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        )
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def setup_databases(self, **kwargs):
+        with override_settings(TWEET_SHARDS=TEST_TWEET_SHARDS):
+            return super().setup_databases(**kwargs)
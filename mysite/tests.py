@@ -0,0 +1,629 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import engines
+from django.template.loader import render_to_string
+from django.template.loaders.cached import Loader as CachedLoader
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse, set_script_prefix
+from django.utils import translation
+
+from accounts.caches import users
+from tweets.models import Like, Tweet
+
+from . import caching, compression, idempotency, objcache, page_cache, ratelimit, urlbuilder
+from .middleware import STICKY_COOKIE_NAME, PrimaryStickinessMiddleware
+from .routers import PrimaryReplicaRouter, use_primary
+from .template_profiler import profile_templates
+from .views import CacheStatsView
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_STICKINESS_SECONDS=5)
+class TestPrimaryReplicaRouter(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+        # ミドルウェアの内側で、読み込みがどのDBに振り分けられるかを記録する
+        def get_response(request):
+            self.read_db = self.router.db_for_read(Tweet)
+            return HttpResponse()
+
+        self.middleware = PrimaryStickinessMiddleware(get_response)
+
+    def test_read_goes_to_replica(self):
+
+        self.assertEqual(self.router.db_for_read(Tweet), "replica")
+        self.assertEqual(self.router.db_for_write(Tweet), "default")
+
+    def test_read_goes_to_primary_when_pinned(self):
+
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Tweet), "default")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_read_goes_to_primary_without_replicas(self):
+
+        self.assertEqual(self.router.db_for_read(Tweet), "default")
+
+    def test_write_request_is_sticky(self):
+
+        response = self.middleware(self.factory.post("/"))
+        self.assertEqual(self.read_db, "default")
+
+        # 書き込み直後のGETもプライマリから読む
+        request = self.factory.get("/")
+        request.COOKIES[STICKY_COOKIE_NAME] = response.cookies[STICKY_COOKIE_NAME].value
+        self.middleware(request)
+        self.assertEqual(self.read_db, "default")
+
+    def test_read_request_without_cookie_goes_to_replica(self):
+
+        self.middleware(self.factory.get("/"))
+
+        self.assertEqual(self.read_db, "replica")
+
+
+class TestTokenBucket(SimpleTestCase):
+
+    def test_take_until_empty_then_refill(self):
+        capacity, refill_rate = ratelimit.parse_rate("2/m")  # 30秒に1件回復する
+
+        state, wait = ratelimit.take(None, capacity, refill_rate, now=0)
+        self.assertEqual(wait, 0)
+        state, wait = ratelimit.take(state, capacity, refill_rate, now=0)
+        self.assertEqual(wait, 0)
+        state, wait = ratelimit.take(state, capacity, refill_rate, now=10)
+        self.assertAlmostEqual(wait, 20)
+        state, wait = ratelimit.take(state, capacity, refill_rate, now=30)
+        self.assertEqual(wait, 0)
+
+    def test_local_store_keeps_recent_keys(self):
+        store = ratelimit.LocalStore(max_keys=2)
+        for key in ("a", "b", "c"):
+            store.consume(key, 1, 1)
+
+        self.assertEqual(list(store.buckets), ["b", "c"])
+
+
+class TestRateLimitedViews(TestCase):
+
+    def setUp(self):
+        config = {
+            **settings.RATELIMIT,
+            "RATES": {"tweet_create": "2/h", "like": "2/h", "follow": "2/h"},
+            "IP_RATES": {"tweet_create": "3/h", "like": "3/h", "follow": "3/h"},
+        }
+        # 後に登録したcleanupから実行されるので、設定を戻してから作り直す
+        self.addCleanup(ratelimit.reset)
+        self.enterContext(override_settings(RATELIMIT=config))
+        ratelimit.reset()
+        self.user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+        self.client.force_login(self.user)
+
+    def test_too_many_posts_get_429(self):
+        url = reverse("tweets:create")
+        statuses = [self.client.post(url, {"content": "tweet"}).status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(Tweet.objects.count(), 2)
+        response = self.client.post(url, {"content": "tweet"})
+        self.assertEqual(int(response["Retry-After"]), 1800)  # 1時間に2件なので30分に1件回復する
+
+    def test_get_is_not_limited(self):
+        url = reverse("tweets:create")
+        statuses = {self.client.get(url).status_code for _ in range(3)}
+
+        self.assertEqual(statuses, {200})
+
+    def test_budgets_are_per_user(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        url = reverse("tweets:like", kwargs={"pk": tweet.pk})
+        for _ in range(2):
+            self.client.post(url)
+        self.assertEqual(self.client.post(url).status_code, 429)
+
+        self.client.force_login(get_user_model().objects.create_user(username="other", password="testpassword"))
+
+        self.assertEqual(self.client.post(url).status_code, 200)
+
+    def test_budgets_are_also_per_ip(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        url = reverse("tweets:like", kwargs={"pk": tweet.pk})
+        others = [get_user_model().objects.create_user(username=f"other{i}") for i in range(2)]
+        statuses = []
+        # 同じIPアドレスから、ユーザーの上限を超えないようにアカウントを替えていいねする
+        for user in (self.user, *others):
+            self.client.force_login(user)
+            statuses.append(self.client.post(url).status_code)
+            statuses.append(self.client.post(reverse("tweets:unlike", kwargs={"pk": tweet.pk})).status_code)
+
+        self.assertEqual(statuses, [200, 200, 200, 429, 429, 429])
+
+        # 他のIPアドレスからは受け付ける
+        self.client.force_login(get_user_model().objects.create_user(username="elsewhere"))
+        self.assertEqual(self.client.post(url, REMOTE_ADDR="10.0.0.1").status_code, 200)
+
+
+class TestIdempotencyKey(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+        self.client.force_login(self.user)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_retried_tweet_is_created_once(self):
+        url = reverse("tweets:create")
+        first = self.client.post(url, {"content": "tweet"}, headers={"Idempotency-Key": "abc"})
+        retry = self.client.post(url, {"content": "tweet"}, headers={"Idempotency-Key": "abc"})
+
+        self.assertEqual(Tweet.objects.count(), 1)
+        self.assertEqual((retry.status_code, retry["Location"]), (first.status_code, first["Location"]))
+        self.assertEqual(retry[idempotency.REPLAYED_HEADER], "true")
+
+    def test_retried_like_returns_original_response(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        url = reverse("tweets:like", kwargs={"pk": tweet.pk})
+        first = self.client.post(url, headers={"Idempotency-Key": "abc"})
+
+        # セッションの読み込みだけ(ログインユーザーはキャッシュから読む)で、ツイート・いいねは読み書きしない
+        with self.assertNumQueries(1):
+            retry = self.client.post(url, headers={"Idempotency-Key": "abc"})
+
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_same_key_with_different_body_is_rejected(self):
+        url = reverse("tweets:create")
+        self.client.post(url, {"content": "tweet"}, headers={"Idempotency-Key": "abc"})
+        response = self.client.post(url, {"content": "another tweet"}, headers={"Idempotency-Key": "abc"})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Tweet.objects.count(), 1)
+
+    def test_without_key_every_request_runs(self):
+        url = reverse("tweets:create")
+        self.client.post(url, {"content": "tweet"})
+        self.client.post(url, {"content": "tweet"})
+
+        self.assertEqual(Tweet.objects.count(), 2)
+
+
+class TestTemplateProfiler(SimpleTestCase):
+
+    def test_templates_are_cached(self):
+
+        loader = engines["django"].engine.template_loaders[0]
+
+        self.assertIsInstance(loader, CachedLoader)
+
+    def test_time_is_attributed_per_include_and_url(self):
+        author = get_user_model()(id=1, username="author")
+        tweets = [Tweet(id=i, author=author, content=f"tweet {i}") for i in range(1, 4)]
+
+        with profile_templates() as profile:
+            render_to_string("tweets/home.html", {"user": author, "tweets": tweets, "like_list": []})
+
+        self.assertEqual(profile.stats["tweets/like.html"][0], 3)
+        self.assertEqual(profile.stats["{% url 'tweets:create' %}"][0], 1)
+        calls, total, own = profile.stats["tweets/home.html"]
+        # home.htmlの時間にはbase.html・like.htmlの描画が含まれ、内側を除いた時間には含まれない
+        self.assertLess(own, total)
+        self.assertIn("tweets/like.html", profile.report())
+
+
+class TestUrlBuilder(SimpleTestCase):
+
+    def test_same_as_reverse(self):
+        for name, kwarg in urlbuilder.ROUTES.items():
+            value = 42 if kwarg == "pk" else "user.name-1"
+            with self.subTest(name=name):
+                self.assertEqual(urlbuilder.build(name, value), reverse(name, kwargs={kwarg: value}))
+
+    def test_value_is_quoted(self):
+        self.assertEqual(
+            urlbuilder.build("accounts:user_profile", "ユーザー"), reverse("accounts:user_profile", args=["ユーザー"])
+        )
+
+    def test_script_prefix(self):
+        set_script_prefix("/app/")
+        self.addCleanup(set_script_prefix, "/")
+
+        self.assertEqual(urlbuilder.build("tweets:detail", 7), "/app/tweets/7/")
+        self.assertEqual(urlbuilder.build("tweets:detail", 7), reverse("tweets:detail", args=[7]))
+
+    def test_template_tag_and_properties(self):
+        author = get_user_model()(id=1, username="author")
+        tweet = Tweet(id=3, author=author, content="tweet")
+
+        html = engines["django"].from_string("{% load urlbuilder %}{% fast_url 'accounts:follow' name %}")
+
+        self.assertEqual(html.render({"name": "author"}), reverse("accounts:follow", args=["author"]))
+        self.assertEqual(author.profile_url, reverse("accounts:user_profile", args=["author"]))
+        self.assertEqual(tweet.like_url, reverse("tweets:like", args=[3]))
+
+
+class TestCompression(SimpleTestCase):
+
+    def get(self, response, accept_encoding="gzip, deflate, br"):
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return compression.CompressionMiddleware(lambda request: response)(request)
+
+    def test_negotiate(self):
+        encodings = ("br", "gzip")
+
+        self.assertEqual(compression.negotiate("gzip, br", encodings), "br")
+        self.assertEqual(compression.negotiate("gzip;q=1.0, br;q=0.5", encodings), "gzip")
+        self.assertEqual(compression.negotiate("br;q=0, *", encodings), "gzip")
+        self.assertIsNone(compression.negotiate("identity", encodings))
+        self.assertIsNone(compression.negotiate("gzip;q=0", encodings))
+
+    def test_large_html_is_compressed(self):
+        content = b"<li>tweet</li>" * 1000
+        response = HttpResponse(content)
+        response["ETag"] = '"abc"'
+
+        response = self.get(response, accept_encoding="gzip")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(compression.decompress("gzip", response.content), content)
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertLess(len(response.content), len(content) // 10)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(response["ETag"], 'W/"abc"')
+
+    def test_small_or_binary_responses_are_not_compressed(self):
+        small = self.get(HttpResponse(b"<p>ok</p>"))
+        image = self.get(HttpResponse(b"\x89PNG" * 1000, content_type="image/png"))
+
+        self.assertFalse(small.has_header("Content-Encoding"))
+        self.assertFalse(image.has_header("Content-Encoding"))
+
+    def test_client_without_accept_encoding(self):
+        response = self.get(HttpResponse(b"<li>tweet</li>" * 1000), accept_encoding="")
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+
+class TestConditionalGet(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+        self.other = get_user_model().objects.create_user(username="other", password="testpassword")
+        self.tweet = Tweet.objects.create(content="tweet", author=self.other)
+        self.client.force_login(self.user)
+
+    def revalidate(self, url):
+        # 初回はCSRFのcookieがまだないので、cookieを受け取った後のETagで確認する
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_are_not_rendered(self):
+        urls = [
+            reverse("tweets:home"),
+            reverse("accounts:user_profile", args=["other"]),
+            reverse("accounts:following_list", args=["other"]),
+            reverse("accounts:follower_list", args=["other"]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.revalidate(url)
+
+                self.assertEqual(response.status_code, 304)
+                self.assertTrue(response["ETag"].startswith('W/"'))
+                self.assertIn("private", response["Cache-Control"])
+                self.assertEqual(response.templates, [])
+
+    def test_like_changes_etag(self):
+        url = reverse("tweets:home")
+        etag = self.client.get(url)["ETag"]
+        self.client.post(reverse("tweets:like", args=[self.tweet.pk]))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_follow_changes_etag(self):
+        url = reverse("accounts:user_profile", args=["other"])
+        etag = self.client.get(url)["ETag"]
+        self.client.post(reverse("accounts:follow", args=["other"]))
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_other_viewer_gets_another_etag(self):
+        url = reverse("tweets:home")
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.other)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_like_script_is_rendered_once(self):
+        Tweet.objects.create(content="tweet", author=self.other)
+
+        response = self.client.get(reverse("tweets:home"))
+
+        self.assertEqual(response.content.decode().count("const toggleLike"), 1)
+
+
+class TestPageCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.calls = []
+
+    def profile_view(self, request, username):
+        self.calls.append(username)
+        return HttpResponse(f"<p>{username}</p>")
+
+    def get(self, username="alice"):
+        view = page_cache.cache_anonymous_page(tags=["user:{username}"])(self.profile_view)
+        middleware = page_cache.PageCacheMiddleware(lambda request: view(request, username=username))
+        return middleware(RequestFactory().get(f"/{username}/"))
+
+    def test_welcome_page_is_served_from_cache(self):
+        url = reverse("welcome:welcome")
+        first = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+
+        self.assertTrue(first.templates)
+        self.assertEqual(second.templates, [])
+        self.assertEqual(second.content, first.content)
+
+    def test_key_does_not_depend_on_active_language(self):
+        # 言語は常にsettings.LANGUAGE_CODEなので、前のリクエストが有効にした言語などでキーを変えない
+        request = RequestFactory().get("/alice/", HTTP_ACCEPT_LANGUAGE="en")
+        key = page_cache.page_key(request)
+
+        with translation.override("en"):
+            self.assertEqual(page_cache.page_key(request), key)
+
+    def test_logged_in_users_are_not_served_from_cache(self):
+        url = reverse("welcome:welcome")
+        self.client.get(url)
+        self.client.force_login(get_user_model().objects.create_user(username="testuser", password="testpassword"))
+
+        self.assertTrue(self.client.get(url).templates)
+
+    def test_purge_by_tag(self):
+        self.get()
+        self.get()
+        page_cache.purge(page_cache.user_tag("bob"))
+        self.get()
+        self.assertEqual(self.calls, ["alice"])
+
+        page_cache.purge(page_cache.user_tag("alice"))
+        response = self.get()
+
+        self.assertEqual(self.calls, ["alice", "alice"])
+        self.assertEqual(response.content, b"<p>alice</p>")
+
+    def test_purge_all(self):
+        self.get()
+        page_cache.purge()
+        self.get()
+
+        self.assertEqual(self.calls, ["alice", "alice"])
+
+    @override_settings(CACHING={**settings.CACHING, "WAIT_SECONDS": 0.1})
+    def test_waits_for_the_request_that_is_rendering(self):
+        request = RequestFactory().get("/alice/")
+        # 他のworkerが描画中
+        caching.acquire(page_cache.page_key(request))
+
+        self.get()
+        self.get()
+
+        # 待っても終わらなければ自分で描画するが、保存は描画中のworkerに任せる
+        self.assertEqual(self.calls, ["alice", "alice"])
+        self.assertIsNone(cache.get(page_cache.page_key(request)))
+
+    def test_follow_purges_both_profiles(self):
+        user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+        get_user_model().objects.create_user(username="alice", password="testpassword")
+        self.get()
+        self.client.force_login(user)
+
+        self.client.post(reverse("accounts:follow", args=["alice"]))
+        self.get()
+
+        self.assertEqual(self.calls, ["alice", "alice"])
+
+
+class TestCaching(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.metrics.reset()
+        self.addCleanup(cache.clear)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_cached(self):
+        values = [caching.get_or_set("key", self.compute, 60, family="test") for _ in range(3)]
+
+        self.assertEqual(values, [1, 1, 1])
+        stats = caching.metrics.snapshot()["test"]
+        self.assertEqual((stats["misses"], stats["hits"], stats["recomputes"]), (1, 2, 1))
+        self.assertEqual(stats["hit_ratio"], 0.6667)
+
+    def test_stale_value_while_another_request_recomputes(self):
+        cache.set(caching.current_key("key"), ("old", 0.1, time.time() - 1))
+        caching.acquire(caching.current_key("key"))
+
+        self.assertEqual(caching.get_or_set("key", self.compute, 60, family="test"), "old")
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(caching.metrics.snapshot()["test"]["stale_hits"], 1)
+
+    def test_stale_value_is_recomputed_once(self):
+        cache.set(caching.current_key("key"), ("old", 0.1, time.time() - 1))
+
+        values = [caching.get_or_set("key", self.compute, 60) for _ in range(2)]
+
+        self.assertEqual(values, [1, 1])
+
+    @override_settings(CACHING={**settings.CACHING, "BETA": 1000})
+    def test_recomputed_early_when_close_to_expiry(self):
+        # 作り直しに1秒かかる値が10秒後に切れるので、BETAが大きければほぼ確実に早めに作り直す
+        cache.set(caching.current_key("key"), ("old", 1.0, time.time() + 10))
+
+        self.assertEqual(caching.get_or_set("key", self.compute, 60), 1)
+
+    @override_settings(CACHING={**settings.CACHING, "WAIT_SECONDS": 0.1})
+    def test_miss_waits_for_the_request_that_is_recomputing(self):
+        caching.acquire(caching.current_key("key"))
+
+        self.assertEqual(caching.get_or_set("key", self.compute, 60, family="test"), 1)
+        # 待っても作り終わらなかったので自分で作ったが、保存はしない
+        self.assertIsNone(cache.get(caching.current_key("key")))
+        self.assertEqual(caching.metrics.snapshot()["test"]["waits"], 1)
+
+    def test_refresh_started_before_delete_is_not_stored(self):
+        def compute():
+            # 作り直している間に、他のリクエストが値を無効にした
+            caching.delete("key")
+            return "stale"
+
+        self.assertEqual(caching.get_or_set("key", compute, 60), "stale")
+
+        self.assertEqual(caching.get_or_set("key", self.compute, 60), 1)
+
+    def test_release_keeps_lock_taken_by_another_request(self):
+        token = caching.acquire("key")
+        # ロックの期限が切れ、他のリクエストが取り直した
+        cache.delete(caching.lock_key("key"))
+        self.assertIsNotNone(caching.acquire("key"))
+
+        caching.release("key", token)
+
+        self.assertIsNone(caching.acquire("key"))
+
+    def test_stats_view_is_for_staff(self):
+        caching.get_or_set("key", self.compute, 60, family="test")
+        staff = get_user_model()(username="staff", is_staff=True)
+        request = RequestFactory().get(reverse("cache_stats"))
+        request.user = staff
+
+        response = CacheStatsView.as_view()(request)
+
+        self.assertEqual(json.loads(response.content)["families"]["test"]["misses"], 1)
+
+
+DATABASE_CACHES = {"default": {"BACKEND": "mysite.cache_backends.DatabaseCache", "LOCATION": "django_cache"}}
+
+
+@override_settings(CACHES=DATABASE_CACHES)
+class TestDatabaseCache(TestCase):
+    databases = {"cache"}
+
+    def setUp(self):
+        call_command("createcachetable", database="cache")
+        self.cache = caches["default"]
+
+    def test_add_is_exclusive(self):
+
+        self.assertTrue(self.cache.add("lock", "a", 10))
+        self.assertFalse(self.cache.add("lock", "b", 10))
+        self.assertEqual(self.cache.get("lock"), "a")
+
+    def test_set_many_in_one_transaction(self):
+        self.cache.set("a", "old")
+
+        with self.assertNumQueries(5, using="cache"):
+            # SAVEPOINT, COUNT(*), DELETE, INSERT, RELEASE SAVEPOINT
+            self.assertEqual(self.cache.set_many({"a": 1, "b": [2]}, 60), [])
+
+        self.assertEqual(self.cache.get_many(["a", "b"]), {"a": 1, "b": [2]})
+
+    def test_bump_version_changes_value(self):
+        caching.bump_version("version")
+        first = self.cache.get("version")
+        caching.bump_version("version")
+
+        self.assertIsNotNone(first)
+        self.assertNotEqual(self.cache.get("version"), first)
+
+
+class TestLocalLRU(SimpleTestCase):
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        lru = objcache.LocalLRU(max_bytes=10, timeout=60)
+        lru.set("a", b"1234")
+        lru.set("b", b"1234")
+        lru.get("a")
+        lru.set("c", b"1234")
+
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), b"1234")
+        self.assertEqual(lru.stats(), {"entries": 2, "bytes": 8, "evictions": 1})
+
+    def test_expires(self):
+        lru = objcache.LocalLRU(max_bytes=10, timeout=0)
+        lru.set("a", b"1234")
+
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(lru.stats()["bytes"], 0)
+
+
+class TestObjectCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        objcache.clear_local()
+        self.addCleanup(cache.clear)
+        self.addCleanup(objcache.clear_local)
+        self.alice = get_user_model().objects.create_user(username="alice", password="testpassword")
+        self.bob = get_user_model().objects.create_user(username="bob", password="testpassword")
+
+    def test_page_of_ids_is_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            found = users.get_many([self.bob.pk, self.alice.pk, 999])
+        with self.assertNumQueries(0):
+            again = users.get_many([self.alice.pk, self.bob.pk])
+
+        self.assertEqual(found, {self.alice.pk: self.alice, self.bob.pk: self.bob})
+        self.assertEqual(again[self.bob.pk].username, "bob")
+
+    def test_shared_tier_is_used_after_local_expiry(self):
+        users.get_many([self.alice.pk])
+        users.local.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(users.get(self.alice.pk).username, "alice")
+        self.assertEqual(users.local.stats()["entries"], 1)
+
+    def test_save_invalidates(self):
+        users.get(self.alice.pk)
+        self.alice.first_name = "Alice"
+        self.alice.save()
+
+        self.assertEqual(users.get(self.alice.pk).first_name, "Alice")
+
+    def test_instances_are_copies(self):
+        users.get(self.alice.pk).username = "changed"
+
+        self.assertEqual(users.get(self.alice.pk).username, "alice")
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(reverse("tweets:home")).status_code, 200)
+
+        self.alice.set_password("newpassword")
+        self.alice.save()
+
+        self.assertEqual(self.client.get(reverse("tweets:home")).status_code, 302)
@@ -0,0 +1,70 @@
+"""
+ツイート・ユーザーごとのURL(詳細・削除・いいね・プロフィールなど)を、reverse()を通さずに組み立てます
+
+ROUTESのURLは最初に使ったときに1度だけreverse()し、引数の部分を置き換えるだけの書式にしておく。
+一覧画面ではツイート1件ごとに何度もURLを作るので、URLパターンの照合を毎回しないで済む。
+URLconfを変えたとき(テストのROOT_URLCONFなど)は書式を作り直す
+"""
+
+import threading
+from urllib.parse import quote
+
+from django.core.signals import setting_changed
+from django.urls import get_script_prefix, reverse
+from django.urls.resolvers import RFC3986_SUBDELIMS
+
+# URL名 -> 引数名。引数のconverterはintかstrだけ(reverse()と同じく値をquoteして埋め込む)
+ROUTES = {
+    "tweets:detail": "pk",
+    "tweets:delete": "pk",
+    "tweets:like": "pk",
+    "tweets:unlike": "pk",
+    "tweets:likers": "pk",
+    "accounts:user_profile": "username",
+    "accounts:follow": "username",
+    "accounts:unfollow": "username",
+    "accounts:following_list": "username",
+    "accounts:follower_list": "username",
+}
+
+# int・strのどちらのconverterにも一致し、実際のURLには現れない値
+PLACEHOLDER = "98765432109876543210"
+SAFE = RFC3986_SUBDELIMS + "/~:@"
+
+_formats = None
+_lock = threading.Lock()
+
+
+def compile_routes():
+    """
+    {URL名: (引数より前, 引数より後)}を作る。スクリプトのprefixはリクエストごとに変わり得るので含めない
+    """
+    prefix = get_script_prefix()
+    formats = {}
+    for name, kwarg in ROUTES.items():
+        path = reverse(name, kwargs={kwarg: PLACEHOLDER})[len(prefix) :]
+        before, after = path.split(PLACEHOLDER)
+        formats[name] = (before, after)
+    return formats
+
+
+def build(name, value):
+    """
+    reverse(name, kwargs={ROUTES[name]: value})と同じURLを返す
+    """
+    global _formats
+    if _formats is None:
+        with _lock:
+            if _formats is None:
+                _formats = compile_routes()
+    before, after = _formats[name]
+    return f"{get_script_prefix()}{before}{quote(str(value), safe=SAFE)}{after}"
+
+
+def clear(**kwargs):
+    global _formats
+    if kwargs.get("setting", "ROOT_URLCONF") == "ROOT_URLCONF":
+        _formats = None
+
+
+setting_changed.connect(clear)
@@ -18,10 +18,14 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
+from . import views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("accounts/", include("accounts.urls")),
     path("tweets/", include("tweets.urls")),
+    path("notifications/", include("notifications.urls")),
+    path("cache-stats/", views.CacheStatsView.as_view(), name="cache_stats"),
     path("", include("welcome.urls")),
 ]
 
@@ -0,0 +1,18 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.generic import View
+
+from . import caching, objcache
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class CacheStatsView(View):
+    """
+    このプロセスのキャッシュ(mysite/caching.py)のfamilyごとのヒット率・作り直した回数と、
+    プロセス内に保持しているインスタンスの件数・バイト数(mysite/objcache.py)。管理者用
+    """
+
+    def get(self, request, *args, **kwargs):
+        objects = {label: object_cache.local.stats() for label, object_cache in objcache.registry.items()}
+        return JsonResponse({"families": caching.metrics.snapshot(), "objects": objects})
@@ -0,0 +1,6 @@
+from django.contrib import admin
+
+from .models import Inbox, Notification
+
+admin.site.register(Notification)
+admin.site.register(Inbox)
@@ -0,0 +1,133 @@
+"""
+いいね・フォローを通知にまとめる処理を定義します
+
+いいね・フォローのリクエストでは通知を書き込まない。定期的に実行するaggregate()が、前回の続きからLike・Followを読み、
+(受信者, 種類, ツイート)ごとに未読の通知へ人数を足していく。いいねが何百万件あっても、未読の通知は1ツイートにつき1行
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+
+from accounts.models import Follow
+from tweets import sharding
+from tweets.models import JobCheckpoint, Like
+
+from .models import Inbox, Notification
+
+CHUNK_SIZE = 5000
+
+
+def like_events(rows):
+    for _, tweet_id, actor_id, recipient_id, created_at in rows:
+        # 自分のツイートへのいいねは通知しない
+        if actor_id != recipient_id:
+            yield (recipient_id, Notification.LIKE, tweet_id), actor_id, created_at
+
+
+def follow_events(rows):
+    for _, actor_id, recipient_id, created_at in rows:
+        yield (recipient_id, Notification.FOLLOW, None), actor_id, created_at
+
+
+def apply_events(events):
+    """
+    events((受信者, 種類, ツイートID), 行動したユーザー, 時刻)を未読の通知にまとめる。新しく作った通知の件数を返す
+
+    人数は行動したユーザーの数で、同じユーザーのいいね・取り消し・いいねは1人と数える。
+    まとめて読んだ行の中と、通知の最後のユーザー(last_actor)との重複を除く
+    """
+    groups = {}
+    for key, actor_id, created_at in events:
+        actors, _, _ = groups.get(key, (set(), None, None))
+        actors.add(actor_id)
+        groups[key] = (actors, actor_id, created_at)
+    if not groups:
+        return 0
+
+    # 未読の通知は、このまとまりに含まれる(受信者, 種類, ツイートID)のものだけを読む
+    unread = {}
+    for verb in {verb for _, verb, _ in groups}:
+        keys = [key for key in groups if key[1] == verb]
+        notifications = Notification.objects.filter(
+            recipient_id__in={recipient_id for recipient_id, _, _ in keys}, verb=verb, is_read=False
+        )
+        tweet_ids = {tweet_id for _, _, tweet_id in keys}
+        if None in tweet_ids:
+            notifications = notifications.filter(tweet_id__isnull=True)
+        else:
+            notifications = notifications.filter(tweet_id__in=tweet_ids)
+        for notification in notifications:
+            unread[(notification.recipient_id, notification.verb, notification.tweet_id)] = notification
+    updated, created = [], []
+    for key, (actors, actor_id, created_at) in groups.items():
+        notification = unread.get(key)
+        if notification is None:
+            recipient_id, verb, tweet_id = key
+            notification = Notification(recipient_id=recipient_id, verb=verb, tweet_id=tweet_id)
+            created.append(notification)
+        else:
+            updated.append(notification)
+            actors.discard(notification.last_actor_id)
+        notification.actor_count += len(actors)
+        notification.last_actor_id = actor_id
+        notification.updated_at = created_at
+    Notification.objects.bulk_update(updated, ["actor_count", "last_actor", "updated_at"])
+    Notification.objects.bulk_create(created)
+
+    # 未読の件数は、新しく作った通知の分だけ増える
+    new_counts = Counter(notification.recipient_id for notification in created)
+    Inbox.objects.bulk_create([Inbox(user_id=user_id) for user_id in new_counts], ignore_conflicts=True)
+    users_by_count = {}
+    for user_id, count in new_counts.items():
+        users_by_count.setdefault(count, []).append(user_id)
+    for count, user_ids in users_by_count.items():
+        Inbox.objects.filter(user_id__in=user_ids).update(unread_count=F("unread_count") + count)
+    return len(created)
+
+
+def consume(name, queryset, to_events, db=None):
+    """
+    querysetの前回の続きの行を通知にまとめ、CHUNK_SIZE件ごとにcommitする。処理した行数を返す
+
+    いいねのたびにキューへ追加されるので、2つのワーカーが同時に実行することがある。
+    チェックポイントの行をロックしてから続きを読み、同じ行を二重に数えないようにする
+    (SQLiteはselect_for_updateを無視するが、transaction_modeがIMMEDIATEなのでトランザクションの開始でロックする)
+    """
+    JobCheckpoint.objects.get_or_create(name=name)
+    queryset = queryset.using(db).order_by("pk")
+    total = 0
+    while True:
+        with transaction.atomic():
+            checkpoint = JobCheckpoint.objects.select_for_update().get(name=name)
+            chunk = list(queryset.filter(pk__gt=checkpoint.position)[:CHUNK_SIZE])
+            if not chunk:
+                return total
+            apply_events(to_events(chunk))
+            checkpoint.position = chunk[-1][0]
+            checkpoint.save(update_fields=["position", "updated_at"])
+        total += len(chunk)
+
+
+def aggregate():
+    """
+    前回の続きからいいね・フォローを読み、通知にまとめる。処理したいいね・フォローの件数を返す
+    """
+    total = 0
+    for db in sharding.databases():
+        likes = Like.objects.values_list("pk", "tweet_id", "user_id", "tweet__author_id", "created_at")
+        total += consume(f"notifications:likes:{db or 'default'}", likes, like_events, db)
+    follows = Follow.objects.values_list("pk", "follower_id", "followed_id", "created_at")
+    total += consume("notifications:follows", follows, follow_events)
+    return total
+
+
+def mark_all_read(user):
+    with transaction.atomic():
+        Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        Inbox.objects.filter(user=user).update(unread_count=0)
+
+
+def unread_count(user):
+    return Inbox.objects.filter(user=user).values_list("unread_count", flat=True).first() or 0
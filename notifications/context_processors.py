@@ -0,0 +1,13 @@
+from django.utils.functional import SimpleLazyObject
+
+from .aggregate import unread_count
+
+
+def unread_notifications(request):
+    """
+    未読の通知の件数。テンプレートで使ったときだけ、Inboxを1行読む
+    """
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {"unread_notification_count": SimpleLazyObject(lambda: unread_count(user))}
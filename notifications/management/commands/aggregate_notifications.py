@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.aggregate import aggregate
+
+
+class Command(BaseCommand):
+    help = "前回の続きからいいね・フォローを読み、通知にまとめます(cronなどで定期的に実行する)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, help="指定した秒数ごとに繰り返し実行する")
+
+    def handle(self, *args, **options):
+        while True:
+            total = aggregate()
+            self.stdout.write(f"{total}件のいいね・フォローを通知にまとめました")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
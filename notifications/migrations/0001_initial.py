@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("accounts", "0005_follow_follow_follower_created_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Inbox",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("unread_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Notification",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("verb", models.CharField(choices=[("like", "like"), ("follow", "follow")], max_length=10)),
+                ("tweet_id", models.BigIntegerField(blank=True, null=True)),
+                ("actor_count", models.PositiveIntegerField(default=0)),
+                ("is_read", models.BooleanField(default=False)),
+                ("updated_at", models.DateTimeField()),
+                (
+                    "last_actor",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="notifications",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["recipient", "updated_at"], name="notification_recipient_idx")],
+            },
+        ),
+    ]
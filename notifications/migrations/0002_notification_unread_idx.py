@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("is_read", False)),
+                fields=["recipient", "verb", "tweet_id"],
+                name="notification_unread_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import models
+
+from accounts.models import User
+
+
+class Notification(models.Model):
+    """
+    同じ相手・同じ種類・同じツイートへの通知を1行にまとめたもの(「Aさんと他41人がいいねしました」)
+
+    未読の間はnotifications.aggregate.aggregate()が人数を足していき、既読にした後の通知は新しい行になる
+    """
+
+    LIKE = "like"
+    FOLLOW = "follow"
+    VERB_CHOICES = [(LIKE, "like"), (FOLLOW, "follow")]
+
+    recipient = models.ForeignKey(User, related_name="notifications", on_delete=models.CASCADE)
+    verb = models.CharField(max_length=10, choices=VERB_CHOICES)
+    # いいねされたツイートのID(フォローの通知ではNone)。ツイートはシャードにあるので外部キーにしない
+    tweet_id = models.BigIntegerField(null=True, blank=True)
+    # 最後にいいね・フォローしたユーザーと、まとめた人数
+    last_actor = models.ForeignKey(User, related_name="+", null=True, on_delete=models.SET_NULL)
+    actor_count = models.PositiveIntegerField(default=0)
+    is_read = models.BooleanField(default=False)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        # 受信箱を(updated_at, id)の降順にページ分割するためのindex
+        indexes = [
+            models.Index(fields=["recipient", "updated_at"], name="notification_recipient_idx"),
+            # notifications.aggregate.apply_events()が、まとめる先の未読の通知を探すためのindex
+            models.Index(
+                fields=["recipient", "verb", "tweet_id"],
+                condition=models.Q(is_read=False),
+                name="notification_unread_idx",
+            ),
+        ]
+
+    @property
+    def other_count(self):
+        return self.actor_count - 1
+
+
+class Inbox(models.Model):
+    """
+    ユーザーごとの未読の通知の件数。通知を数え直さずに1行読むだけで表示できるよう、通知の追加・既読のたびに更新する
+    """
+
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE)
+    unread_count = models.PositiveIntegerField(default=0)
@@ -0,0 +1,12 @@
+"""
+notificationsアプリのバックグラウンドタスク(taskqueue)を定義します
+"""
+
+from taskqueue.registry import task
+
+from . import aggregate
+
+
+@task("notifications.aggregate")
+def aggregate_notifications():
+    aggregate.aggregate()
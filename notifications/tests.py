@@ -0,0 +1,112 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import Follow
+from tweets.models import Like, Tweet
+
+from .aggregate import aggregate, unread_count
+from .models import Notification
+
+User = get_user_model()
+
+
+class TestAggregate(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="testpassword")
+        self.tweet = Tweet.objects.create(content="This is a test tweet", author=self.author)
+        self.fans = User.objects.bulk_create([User(username=f"fan{i}") for i in range(42)])
+
+    def test_likes_are_aggregated_into_one_notification(self):
+        Like.objects.bulk_create([Like(tweet=self.tweet, user=fan) for fan in self.fans])
+        Like.objects.create(tweet=self.tweet, user=self.author)  # 自分のいいねは通知しない
+
+        aggregate()
+
+        notification = Notification.objects.get()
+        self.assertEqual((notification.verb, notification.tweet_id), (Notification.LIKE, self.tweet.pk))
+        self.assertEqual((notification.last_actor, notification.actor_count), (self.fans[-1], 42))
+        self.assertEqual(unread_count(self.author), 1)
+
+    def test_aggregate_is_incremental(self):
+        Like.objects.create(tweet=self.tweet, user=self.fans[0])
+        aggregate()
+        Like.objects.create(tweet=self.tweet, user=self.fans[1])
+        Follow.objects.create(follower=self.fans[2], followed=self.author)
+
+        aggregate()
+        aggregate()
+
+        like = Notification.objects.get(verb=Notification.LIKE)
+        self.assertEqual(like.actor_count, 2)
+        self.assertTrue(Notification.objects.filter(verb=Notification.FOLLOW, last_actor=self.fans[2]).exists())
+        self.assertEqual(unread_count(self.author), 2)
+
+    def test_actors_are_counted_once(self):
+        Like.objects.create(tweet=self.tweet, user=self.fans[0])
+        Like.objects.filter(user=self.fans[0]).delete()
+        Like.objects.create(tweet=self.tweet, user=self.fans[0])
+        Like.objects.create(tweet=self.tweet, user=self.fans[1])
+        aggregate()
+        # 通知の最後のユーザーが取り消してもう一度いいねした
+        Like.objects.filter(user=self.fans[1]).delete()
+        Like.objects.create(tweet=self.tweet, user=self.fans[1])
+
+        aggregate()
+
+        self.assertEqual(Notification.objects.get().actor_count, 2)
+
+    def test_only_matching_unread_notifications_are_loaded(self):
+        tweets = Tweet.objects.bulk_create([Tweet(content=f"tweet {i}", author=self.author) for i in range(5)])
+        Like.objects.bulk_create([Like(tweet=tweet, user=self.fans[0]) for tweet in tweets])
+        aggregate()
+        Like.objects.create(tweet=tweets[0], user=self.fans[1])
+
+        with mock.patch.object(Notification, "from_db", wraps=Notification.from_db) as from_db:
+            aggregate()
+
+        self.assertEqual(from_db.call_count, 1)
+        self.assertEqual(Notification.objects.get(tweet_id=tweets[0].pk).actor_count, 2)
+
+    def test_new_notification_after_read(self):
+        Like.objects.create(tweet=self.tweet, user=self.fans[0])
+        aggregate()
+        self.client.force_login(self.author)
+        self.client.post(reverse("notifications:mark_all_read"))
+        self.assertEqual(unread_count(self.author), 0)
+
+        Like.objects.create(tweet=self.tweet, user=self.fans[1])
+        call_command("aggregate_notifications", stdout=StringIO())
+
+        self.assertEqual(Notification.objects.filter(is_read=False).get().actor_count, 1)
+        self.assertEqual(unread_count(self.author), 1)
+
+
+class TestInboxView(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="testpassword")
+        self.client.force_login(self.author)
+        followers = User.objects.bulk_create([User(username=f"follower{i}") for i in range(25)])
+        tweets = Tweet.objects.bulk_create([Tweet(content=f"tweet {i}", author=self.author) for i in range(25)])
+        Like.objects.bulk_create([Like(tweet=tweet, user=user) for tweet, user in zip(tweets, followers)])
+        aggregate()
+
+    def test_success_get_paginated(self):
+
+        response = self.client.get(reverse("notifications:inbox"))
+        first_page = list(response.context["notifications"])
+        response = self.client.get(reverse("notifications:inbox"), {"cursor": response.context["next_cursor"]})
+        second_page = list(response.context["notifications"])
+
+        self.assertEqual(len(first_page), 20)
+        self.assertEqual(
+            {notification.pk for notification in first_page + second_page},
+            set(Notification.objects.values_list("pk", flat=True)),
+        )
+        self.assertContains(response, "通知 (25)")
@@ -0,0 +1,23 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.shortcuts import redirect
+from django.views.generic import ListView, View
+
+from mysite.pagination import KeysetPaginationMixin
+
+from .aggregate import mark_all_read
+from .models import Notification
+
+
+class InboxView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    template_name = "notifications/inbox.html"
+    context_object_name = "notifications"
+    cursor_field = "updated_at"
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user).select_related("last_actor")
+
+
+class MarkAllReadView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        mark_all_read(request.user)
+        return redirect("notifications:inbox")
@@ -0,0 +1,36 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from taskqueue.worker import run_pending, schedule
+
+
+class Command(BaseCommand):
+    help = (
+        'キューに溜まったタスクを、スレッドプールで実行し続けます。settings.TASK_QUEUE["SCHEDULE"]のタスクも追加します'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--poll-interval", type=float, default=settings.TASK_QUEUE["POLL_INTERVAL_SECONDS"])
+        parser.add_argument("--once", action="store_true", help="実行待ちのタスクがなくなったら終了する")
+
+    def handle(self, *args, **options):
+        # --threads 1ならスレッドプールを使わず、このスレッドで順に実行する
+        threads = options["threads"]
+        with ThreadPoolExecutor(max_workers=threads) if threads > 1 else nullcontext() as executor:
+            while True:
+                schedule()
+                processed = run_pending(executor, limit=settings.TASK_QUEUE["BATCH_SIZE"])
+                close_old_connections()
+                if processed:
+                    self.stdout.write(f"{processed}件のタスクを実行しました")
+                    continue
+                if options["once"]:
+                    break
+                # 実行待ちがなければ、少し待ってからキューを確認する
+                time.sleep(options["poll_interval"])
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taskqueue", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="unique_key",
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
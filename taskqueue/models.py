@@ -0,0 +1,32 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """
+    バックグラウンドで実行する処理(run_tasksコマンドが取り出して実行する)
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "pending"), (RUNNING, "running"), (FAILED, "failed")]
+
+    # taskqueue.registry.taskで登録した名前
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # PENDINGなら実行してよい時刻、RUNNINGなら他のワーカーが取り直してよい時刻
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # 同じキーのタスクは、実行待ちのものを1つだけキューに置く(taskqueue.registry.enqueueのunique)。取り出したらNULLにする
+    unique_key = models.CharField(max_length=64, null=True, blank=True, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # 実行待ちのタスクをrun_at順に取り出すためのindex
+        indexes = [models.Index(fields=["status", "run_at"], name="task_status_run_at_idx")]
+
+    def __str__(self):
+        return f"{self.name}{tuple(self.args)} ({self.status})"
@@ -0,0 +1,60 @@
+"""
+バックグラウンドで実行する処理の登録と、キューへの追加を定義します
+
+    # <app>/tasks.py
+    @task("tweets.refresh_trending")
+    def refresh_trending():
+        ...
+
+    enqueue("tweets.refresh_trending")
+
+キューへの追加(Taskの保存)は、呼び出し元のトランザクションがcommitされてから行う。
+書き込みがロールバックされた場合、その後の処理も実行されない。
+いいねのたびに通知をまとめるなど、何度呼んでも1回実行すれば済む処理はunique=Trueで追加する。
+実行待ちの同じタスクがあれば追加しないので、書き込みが多くてもキューは増えない
+"""
+
+import hashlib
+import json
+
+from django.db import transaction
+
+from .models import Task
+
+_tasks = {}
+
+
+def task(name):
+    """
+    関数をnameで登録するデコレーター。引数はJSONにできる値だけにすること
+    """
+
+    def decorator(func):
+        if name in _tasks and _tasks[name] is not func:
+            raise ValueError(f"task {name} is already registered")
+        _tasks[name] = func
+        return func
+
+    return decorator
+
+
+def get_task(name):
+    return _tasks[name]
+
+
+def unique_key(name, args):
+    return hashlib.sha256(json.dumps([name, args]).encode()).hexdigest()
+
+
+def enqueue(name, *args, unique=False):
+    """
+    nameの処理をargsで実行するタスクを、現在のトランザクションのcommit後にキューへ追加する
+
+    uniqueなら、同じname・argsの実行待ちのタスクがあるときは追加しない
+    """
+    if name not in _tasks:
+        raise KeyError(f"task {name} is not registered")
+    args = list(args)
+    task = Task(name=name, args=args, unique_key=unique_key(name, args) if unique else None)
+    # unique_keyが重なったら(実行待ちの同じタスクがある)何もしない
+    transaction.on_commit(lambda: Task.objects.bulk_create([task], ignore_conflicts=True))
@@ -0,0 +1,155 @@
+import datetime
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Task
+from .registry import enqueue, task
+from .worker import claim, run_pending, schedule
+
+calls = []
+
+
+@task("taskqueue.tests.record")
+def record(value):
+    calls.append(value)
+
+
+@task("taskqueue.tests.fail")
+def fail():
+    raise RuntimeError("failed")
+
+
+class TestEnqueue(TestCase):
+
+    def test_task_is_saved_after_commit(self):
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            enqueue("taskqueue.tests.record", 1)
+            # commitされるまではキューに追加されない
+            self.assertFalse(Task.objects.exists())
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(Task.objects.get().args, [1])
+
+    def test_unique_task_is_queued_once(self):
+
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue("taskqueue.tests.record", 1, unique=True)
+            enqueue("taskqueue.tests.record", 1, unique=True)
+            enqueue("taskqueue.tests.record", 2, unique=True)
+        self.assertEqual(sorted(Task.objects.values_list("args", flat=True)), [[1], [2]])
+
+        # 取り出した後は、次の実行のために追加できる
+        claim(10)
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue("taskqueue.tests.record", 1, unique=True)
+        self.assertEqual(Task.objects.filter(status=Task.PENDING).count(), 1)
+
+    def test_unknown_task_is_rejected(self):
+
+        with self.assertRaises(KeyError):
+            enqueue("taskqueue.tests.unknown")
+
+
+class TestWorker(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_success_task_is_deleted(self):
+        Task.objects.create(name="taskqueue.tests.record", args=["a"])
+
+        self.assertEqual(run_pending(), 1)
+
+        self.assertEqual(calls, ["a"])
+        self.assertFalse(Task.objects.exists())
+
+    def test_failed_task_is_retried_later(self):
+        Task.objects.create(name="taskqueue.tests.fail")
+
+        run_pending()
+
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Task.PENDING, 1))
+        self.assertGreater(failed.run_at, timezone.now())
+        self.assertIn("RuntimeError", failed.last_error)
+        self.assertEqual(run_pending(), 0)  # 再実行の時刻まではキューから取り出されない
+
+    def test_task_fails_after_max_attempts(self):
+        Task.objects.create(name="taskqueue.tests.fail", attempts=4)
+
+        run_pending()
+
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    def test_claimed_task_is_not_claimed_twice(self):
+        Task.objects.create(name="taskqueue.tests.record", args=["a"])
+
+        self.assertEqual(len(claim(10)), 1)
+        self.assertEqual(claim(10), [])
+
+    def test_expired_running_task_is_claimed_again(self):
+        # ワーカーが実行中に止まり、期限を過ぎたタスク
+        Task.objects.create(
+            name="taskqueue.tests.record",
+            args=["a"],
+            status=Task.RUNNING,
+            run_at=timezone.now() - datetime.timedelta(seconds=1),
+        )
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, ["a"])
+
+    @override_settings(TASK_QUEUE={**settings.TASK_QUEUE, "SCHEDULE": {"taskqueue.tests.record": 60}})
+    def test_scheduled_task_is_queued_after_previous_run(self):
+        now = timezone.now()
+
+        self.assertEqual(schedule(now), 1)
+        self.assertEqual(schedule(now), 0)
+        self.assertEqual(Task.objects.get().run_at, now + datetime.timedelta(seconds=60))
+
+        # 実行中の間は次を追加しない
+        Task.objects.update(run_at=now)
+        claim(10)
+        self.assertEqual(schedule(now), 0)
+        Task.objects.all().delete()
+        self.assertEqual(schedule(now), 1)
+
+    def test_delete_user_in_background(self):
+        user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("delete_user", "testuser", background=True, stdout=StringIO())
+        self.assertTrue(get_user_model().objects.filter(pk=user.pk).exists())
+        call_command("run_tasks", once=True, threads=1, stdout=StringIO())
+
+        self.assertFalse(get_user_model().objects.filter(pk=user.pk).exists())
+
+
+@task("taskqueue.tests.slow")
+def slow(seconds):
+    time.sleep(seconds)
+    # 実行中に期限を過ぎても、延ばされていれば他のワーカーは取り出せない
+    calls.append(claim(10))
+
+
+class TestHeartbeat(TransactionTestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    @override_settings(TASK_QUEUE={**settings.TASK_QUEUE, "LEASE_SECONDS": 0.3})
+    def test_running_task_lease_is_renewed(self):
+        Task.objects.create(name="taskqueue.tests.slow", args=[0.6])
+
+        self.assertEqual(run_pending(), 1)
+
+        self.assertEqual(calls, [[]])
+        self.assertFalse(Task.objects.exists())
@@ -0,0 +1,155 @@
+"""
+キューからタスクを取り出して実行する処理を定義します
+
+タスクは条件付きのUPDATEで1件ずつ取り出す(同じタスクを2つのワーカーが取り出すことはない)。
+実行中はLEASE_SECONDSの期限を延ばし続けるので、期限より長くかかるタスクも他のワーカーに取り直されない。
+失敗したタスクはsettings.TASK_QUEUEのBACKOFF_SECONDSから指数的に間隔を空けて再実行し、
+MAX_ATTEMPTS回失敗したらFAILEDにして残す。成功したタスクは削除する。
+settings.TASK_QUEUE["SCHEDULE"]のタスクは、schedule()が一定の間隔でキューに追加する
+"""
+
+import datetime
+import logging
+import random
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from .models import Task
+from .registry import get_task, unique_key
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(attempts):
+    """
+    attempts回目の失敗の後、再実行まで待つ秒数。同時に失敗したタスクが一斉に再実行されないよう揺らす
+    """
+    config = settings.TASK_QUEUE
+    delay = min(config["BACKOFF_SECONDS"] * 2 ** (attempts - 1), config["MAX_BACKOFF_SECONDS"])
+    return delay * random.uniform(0.5, 1)
+
+
+def claim(limit):
+    """
+    実行待ちのタスクを最大limit件取り出し、RUNNINGにして返す
+
+    実行中のまま期限(LEASE_SECONDS)を過ぎたタスクは、ワーカーが止まったものとみなして取り直す
+    """
+    now = timezone.now()
+    lease_until = now + datetime.timedelta(seconds=settings.TASK_QUEUE["LEASE_SECONDS"])
+    candidates = Task.objects.filter(status__in=[Task.PENDING, Task.RUNNING], run_at__lte=now).order_by("run_at")
+    claimed = []
+    for task in candidates[:limit]:
+        # 他のワーカーが先に取り出していれば、更新件数は0になる
+        if Task.objects.filter(pk=task.pk, status=task.status, run_at=task.run_at).update(
+            status=Task.RUNNING, run_at=lease_until, attempts=task.attempts + 1, unique_key=None
+        ):
+            task.status, task.run_at, task.attempts = Task.RUNNING, lease_until, task.attempts + 1
+            claimed.append(task)
+    return claimed
+
+
+class Heartbeat:
+    """
+    実行中のtaskの期限(run_at)を、LEASE_SECONDSの1/3ごとにLEASE_SECONDS秒後へ延ばすスレッド
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"heartbeat-{task.pk}", daemon=True)
+
+    def run(self):
+        lease_seconds = settings.TASK_QUEUE["LEASE_SECONDS"]
+        try:
+            while not self.stopped.wait(lease_seconds / 3):
+                lease_until = timezone.now() + datetime.timedelta(seconds=lease_seconds)
+                # 期限が切れて他のワーカーが取り直していれば(attemptsが増える)延ばさない
+                Task.objects.filter(pk=self.task.pk, status=Task.RUNNING, attempts=self.task.attempts).update(
+                    run_at=lease_until
+                )
+        finally:
+            # このスレッドのDB接続を閉じる
+            connections.close_all()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def execute(task):
+    """
+    taskを実行し、結果に応じて削除・再実行の予約・FAILEDのいずれかにする。成功したらTrueを返す
+    """
+    try:
+        with Heartbeat(task):
+            get_task(task.name)(*task.args)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("task %s failed (attempt %d)\n%s", task, task.attempts, error)
+        if task.attempts >= settings.TASK_QUEUE["MAX_ATTEMPTS"]:
+            Task.objects.filter(pk=task.pk).update(status=Task.FAILED, last_error=error)
+        else:
+            run_at = timezone.now() + datetime.timedelta(seconds=backoff(task.attempts))
+            Task.objects.filter(pk=task.pk).update(status=Task.PENDING, run_at=run_at, last_error=error)
+        return False
+    else:
+        Task.objects.filter(pk=task.pk).delete()
+        return True
+
+
+def execute_in_thread(task):
+    try:
+        return execute(task)
+    finally:
+        # スレッドごとのDB接続を、リクエストの終わりと同じように片付ける
+        close_old_connections()
+
+
+def schedule_key(name):
+    return unique_key("taskqueue.schedule", [name])
+
+
+def schedule(now=None):
+    """
+    settings.TASK_QUEUE["SCHEDULE"]({タスク名: 秒数})のタスクを、実行待ち・実行中のものがなければ、
+    その秒数の後に実行するようキューへ追加する。追加した件数を返す
+
+    前回の実行が終わってから次を追加するので、同じタスクが重なって実行されることはない
+    """
+    now = now or timezone.now()
+    intervals = settings.TASK_QUEUE["SCHEDULE"]
+    queued = set(
+        Task.objects.filter(name__in=intervals, status__in=[Task.PENDING, Task.RUNNING]).values_list("name", flat=True)
+    )
+    tasks = [
+        Task(name=name, unique_key=schedule_key(name), run_at=now + datetime.timedelta(seconds=seconds))
+        for name, seconds in intervals.items()
+        if name not in queued
+    ]
+    # 同時に動いている他のワーカーが先に追加していれば、unique_keyが重なって無視される
+    Task.objects.bulk_create(tasks, ignore_conflicts=True)
+    return len(tasks)
+
+
+def run_pending(executor=None, limit=None):
+    """
+    実行待ちのタスクをlimit件(省略時はBATCH_SIZE件)まで取り出して実行し、実行した件数を返す
+
+    executor(concurrent.futures.Executor)を渡すと並列に実行する
+    """
+    tasks = claim(limit or settings.TASK_QUEUE["BATCH_SIZE"])
+    if executor is None:
+        for task in tasks:
+            execute(task)
+    else:
+        list(executor.map(execute_in_thread, tasks))
+    return len(tasks)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TweetsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "tweets"
+
+    def ready(self):
+        # save()・delete()でキャッシュを消すシグナルを、キャッシュを使わないプロセスでも登録する
+        from . import caches  # noqa: F401
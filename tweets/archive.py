@@ -0,0 +1,137 @@
+"""
+古いツイートといいねを別のSQLiteファイル(アーカイブ)へ移す処理を定義します
+
+よく読まれる新しいツイートだけを通常のDBに残し、indexとキャッシュを小さく保つ。
+アーカイブしたツイートにはいいねできず、詳細画面とプロフィールのページ送りからだけ参照する。
+投稿者は削除でき、ユーザーの削除(accounts/deletion.py)・データのエクスポート(accounts/data_export.py)も
+アーカイブを含める
+"""
+
+import datetime
+import sqlite3
+from contextlib import closing
+
+from django.conf import settings
+
+from accounts.caches import users
+
+from .models import Tweet
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tweet (
+    id INTEGER PRIMARY KEY, author_id INTEGER NOT NULL, content TEXT NOT NULL, created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tweet_author_id ON tweet (author_id, id);
+CREATE TABLE IF NOT EXISTS "like" (
+    tweet_id INTEGER NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (tweet_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS like_user_id ON "like" (user_id, tweet_id);
+"""
+
+SELECT_TWEET = """
+SELECT id, author_id, content, created_at, (SELECT COUNT(*) FROM "like" WHERE tweet_id = tweet.id) FROM tweet
+"""
+
+
+def get_store():
+    """
+    settings.TWEET_ARCHIVE_PATHが未設定ならNone(アーカイブを使わない)
+    """
+    if not settings.TWEET_ARCHIVE_PATH:
+        return None
+    return ArchiveStore(settings.TWEET_ARCHIVE_PATH)
+
+
+def archived_tweet(row):
+    """
+    アーカイブの行をテンプレートで表示できるTweetにする。いいね数はlike_countに入れる
+    """
+    tweet_id, author_id, content, created_at, like_count = row
+    tweet = Tweet(id=tweet_id, author_id=author_id, content=content)
+    tweet.created_at = datetime.datetime.fromisoformat(created_at)
+    tweet.like_count = like_count
+    tweet.is_archived = True
+    # DBから読み込んだインスタンスとして扱い、誤ってsave()してもINSERTしない
+    tweet._state.adding = False
+    return tweet
+
+
+def attach_authors(tweets):
+    """
+    アーカイブのツイートにauthorを設定する。行ごとに読まず、accounts.caches.usersからまとめて読む
+    """
+    authors = users.get_many({tweet.author_id for tweet in tweets})
+    for tweet in tweets:
+        if tweet.author_id in authors:
+            tweet.author = authors[tweet.author_id]
+    return tweets
+
+
+class ArchiveStore:
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def add(self, tweets, likes):
+        """
+        tweets: (id, author_id, content, created_at)のlist, likes: (tweet_id, user_id)のiterable
+
+        同じツイートを2回アーカイブしても(途中で失敗して再実行しても)重複しない
+        """
+        with closing(self.connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tweet VALUES (?, ?, ?, ?)",
+                ((pk, author_id, content, created_at.isoformat()) for pk, author_id, content, created_at in tweets),
+            )
+            conn.executemany('INSERT OR IGNORE INTO "like" VALUES (?, ?)', likes)
+
+    def get_tweet(self, tweet_id):
+        with closing(self.connect()) as conn:
+            row = conn.execute(SELECT_TWEET + "WHERE id = ?", (tweet_id,)).fetchone()
+        return attach_authors([archived_tweet(row)])[0] if row else None
+
+    def tweets_by_author(self, author_id, max_id=None, limit=20):
+        """
+        投稿者のツイートをIDの降順で、max_idより古いものからlimit件返す
+        """
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                SELECT_TWEET + "WHERE author_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (author_id, max_id if max_id is not None else 2**63 - 1, limit),
+            ).fetchall()
+        return attach_authors([archived_tweet(row) for row in rows])
+
+    def iter_user_records(self, user_id):
+        """
+        ユーザーのアーカイブのツイート((ID, 内容, 作成日時)の"tweet")といいね(ツイートIDの"like")を返す
+        """
+        with closing(self.connect()) as conn:
+            tweets = conn.execute(
+                "SELECT id, content, created_at FROM tweet WHERE author_id = ? ORDER BY id", (user_id,)
+            )
+            for tweet_id, content, created_at in tweets:
+                yield "tweet", (tweet_id, content, datetime.datetime.fromisoformat(created_at))
+            likes = conn.execute('SELECT tweet_id FROM "like" WHERE user_id = ? ORDER BY tweet_id', (user_id,))
+            for (tweet_id,) in likes:
+                yield "like", tweet_id
+
+    def delete_tweet(self, tweet_id):
+        with closing(self.connect()) as conn, conn:
+            conn.execute('DELETE FROM "like" WHERE tweet_id = ?', (tweet_id,))
+            conn.execute("DELETE FROM tweet WHERE id = ?", (tweet_id,))
+
+    def delete_user(self, user_id):
+        """
+        ユーザーのツイート(とそのいいね)と、ユーザーのいいねを削除し、削除した行数を返す
+        """
+        with closing(self.connect()) as conn, conn:
+            deleted = conn.execute(
+                'DELETE FROM "like" WHERE tweet_id IN (SELECT id FROM tweet WHERE author_id = ?)', (user_id,)
+            ).rowcount
+            deleted += conn.execute('DELETE FROM "like" WHERE user_id = ?', (user_id,)).rowcount
+            deleted += conn.execute("DELETE FROM tweet WHERE author_id = ?", (user_id,)).rowcount
+        return deleted
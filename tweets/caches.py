@@ -0,0 +1,21 @@
+"""
+ツイートのキャッシュ(mysite/objcache.py)を定義します
+
+いいね数はupdate()で変わりシグナルが出ないので、キャッシュするのは変わらないフィールドだけ
+"""
+
+from mysite.objcache import ObjectCache
+
+from . import sharding
+from .models import Tweet
+
+FIELDS = ("author", "content", "created_at")
+
+
+def fetch_tweets(ids):
+    # 主キーからシャードが決まるので、シャードごとに1回だけ読む
+    for db, tweet_ids in sharding.group_by_shard(ids).items():
+        yield from sharding.on_shard(Tweet.objects.filter(pk__in=tweet_ids).only(*FIELDS), db)
+
+
+tweets = ObjectCache(Tweet, fields=FIELDS, fetch=fetch_tweets)
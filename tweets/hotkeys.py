@@ -0,0 +1,251 @@
+"""
+いいねが集中しているツイート(ホットなツイート)を検出し、いいね数の更新をメモリ上で束ねる処理を定義します
+
+通常のツイートはいいねのたびにTweet.like_countを更新するが、ホットなツイートの更新は
+シャード分割したメモリ上のカウンタに溜め、バックグラウンドのスレッドが一定間隔でまとめてDBへ反映する(fold)。
+foldはリクエストのトランザクションの外で動くので、リクエストのロールバックで他のツイートの増減が消えることはない。
+カウンタはプロセスごとに持つので、反映されるまでの間、表示されるいいね数は少し遅れる。
+プロセスが強制終了されると反映前の増減は失われるので、reconcile()が落ち着いたツイートのいいね数を数え直す
+"""
+
+import atexit
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from itertools import takewhile
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import sharding
+from .models import JobCheckpoint, Like, Tweet, like_count_expression
+from .toggles import add_like_count
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK_SIZE = 5000
+
+
+class SpaceSaving:
+    """
+    出現回数の多い上位capacity個のキーを、固定のメモリで近似的に数える(Space-Saving)
+
+    追跡していないキーが来たら最も少ないキーと入れ替え、その回数を引き継ぐ(過大評価になり得る)
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+
+    def offer(self, key):
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+        else:
+            evicted = min(self.counts, key=self.counts.get)
+            self.counts[key] = self.counts.pop(evicted) + 1
+        return self.counts[key]
+
+    def top(self, n=None):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class HotTweetDetector:
+    """
+    window_seconds秒ごとの区間でいいねを数え、毎秒threshold件以上のツイートをホットとみなす
+
+    直前の区間でホットだったツイートは、今の区間でもしきい値を超えるまで待たずにホットとして扱う
+    """
+
+    def __init__(self, capacity, window_seconds, threshold_per_second):
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.threshold = threshold_per_second * window_seconds
+        self.lock = threading.Lock()
+        self.window_started_at = time.monotonic()
+        self.current = SpaceSaving(capacity)
+        self.previous_rates = {}
+
+    def roll(self, now):
+        if now - self.window_started_at < self.window_seconds:
+            return
+        self.previous_rates = {
+            key: count / self.window_seconds for key, count in self.current.top() if count >= self.threshold
+        }
+        self.current = SpaceSaving(self.capacity)
+        self.window_started_at = now
+
+    def record(self, key):
+        """
+        いいねを1件記録し、keyがホットかどうかを返す
+        """
+        with self.lock:
+            self.roll(time.monotonic())
+            count = self.current.offer(key)
+            return count >= self.threshold or key in self.previous_rates
+
+    def hot_tweets(self):
+        """
+        [(ツイートID, 毎秒のいいね数)]をいいね数の多い順に返す
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.roll(now)
+            elapsed = max(now - self.window_started_at, 1)
+            rates = dict(self.previous_rates)
+            for key, count in self.current.top():
+                if count >= self.threshold or key in rates:
+                    rates[key] = max(rates.get(key, 0), count / elapsed)
+        return sorted(rates.items(), key=lambda item: item[1], reverse=True)
+
+
+class ShardedCounter:
+    """
+    キーごとの増減を、ロックを分けた複数の辞書に溜める。同じツイートへの同時のいいねが1つのロックを奪い合わない
+    """
+
+    def __init__(self, shards):
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.counts = [defaultdict(int) for _ in range(shards)]
+
+    def index(self, key):
+        return hash(key) % len(self.locks)
+
+    def add(self, key, delta):
+        index = self.index(key)
+        with self.locks[index]:
+            self.counts[index][key] += delta
+
+    def pending(self, key):
+        index = self.index(key)
+        with self.locks[index]:
+            return self.counts[index].get(key, 0)
+
+    def drain(self):
+        """
+        溜まっている増減を全て取り出し、カウンタを空にする
+        """
+        totals = defaultdict(int)
+        for index, lock in enumerate(self.locks):
+            with lock:
+                counts, self.counts[index] = self.counts[index], defaultdict(int)
+            for key, delta in counts.items():
+                totals[key] += delta
+        return totals
+
+
+detector = None
+counters = None
+# ホットなツイートの、最後に読み書きしたときのDBのいいね数。表示するいいね数はこれに未反映の増減を足したもの
+known_counts = {}
+_fold_lock = threading.Lock()
+_folder = None
+_folder_lock = threading.Lock()
+
+
+def reset():
+    """
+    settings.HOT_TWEETSからdetectorとカウンタを作り直す(テストで設定を変えたときにも使う)
+    """
+    global detector, counters, known_counts
+    config = settings.HOT_TWEETS
+    detector = HotTweetDetector(config["CAPACITY"], config["WINDOW_SECONDS"], config["THRESHOLD_PER_SECOND"])
+    counters = ShardedCounter(config["COUNTER_SHARDS"])
+    known_counts = {}
+
+
+def fold():
+    """
+    メモリ上のカウンタに溜まったいいね数の増減をDBへ反映する
+    """
+    global known_counts
+    with _fold_lock:
+        folded = {}
+        for tweet_id, delta in counters.drain().items():
+            like_count = add_like_count(tweet_id, delta) if delta else known_counts.get(tweet_id)
+            if like_count is not None:
+                folded[tweet_id] = like_count
+        # ホットでなくなったツイートの値は捨てる
+        known_counts = folded
+
+
+def fold_forever():
+    while True:
+        time.sleep(settings.HOT_TWEETS["FOLD_INTERVAL_SECONDS"])
+        try:
+            fold()
+        except Exception:
+            # 反映できなかった増減は失われるが、reconcile()が数え直す
+            logger.exception("failed to fold hot tweet like counts")
+        finally:
+            # スレッドのDB接続を、リクエストの終わりと同じように片付ける
+            close_old_connections()
+
+
+def start_folding():
+    """
+    FOLD_INTERVAL_SECONDSごとにfold()するスレッドを、プロセスに1つだけ起動する
+    """
+    global _folder
+    with _folder_lock:
+        if _folder is None:
+            _folder = threading.Thread(target=fold_forever, name="hotkeys-fold", daemon=True)
+            _folder.start()
+
+
+def record_like(tweet_id, delta):
+    """
+    ツイートのいいね数をdelta(+1か-1)だけ変え、表示するいいね数を返す
+    """
+    if detector.record(tweet_id):
+        counters.add(tweet_id, delta)
+        if tweet_id not in known_counts:
+            tweets = Tweet.objects.using(sharding.db_for_tweet(tweet_id)).filter(pk=tweet_id)
+            known_counts[tweet_id] = tweets.values_list("like_count", flat=True).first() or 0
+        start_folding()
+        return known_counts[tweet_id] + counters.pending(tweet_id)
+
+    return (add_like_count(tweet_id, delta) or 0) + counters.pending(tweet_id)
+
+
+def checkpoint_name(db):
+    return f"hotkeys:reconcile:{db or 'default'}"
+
+
+def reconcile(now=None):
+    """
+    前回の続きからいいねを読み、そのツイートのいいね数をLikeの件数から数え直す。数え直したツイートの件数を返す
+
+    数え直した後に反映前の増減を足すと二重に数えるので、どのプロセスのカウンタにも増減が残っていないツイート
+    (最後のいいねからHOT_TWEETS["RECONCILE_AFTER_SECONDS"]秒以上経ったもの)だけを数え直す。
+    その後にいいねされたツイートは、次の実行でそのいいねを読んだときにもう一度対象になる
+    """
+    now = now or timezone.now()
+    settled_before = now - datetime.timedelta(seconds=settings.HOT_TWEETS["RECONCILE_AFTER_SECONDS"])
+    reconciled = 0
+    for db in sharding.databases():
+        checkpoint, _ = JobCheckpoint.objects.get_or_create(name=checkpoint_name(db))
+        likes = Like.objects.using(db).order_by("pk").values_list("pk", "tweet_id", "created_at")
+        while chunk := list(likes.filter(pk__gt=checkpoint.position)[:RECONCILE_CHUNK_SIZE]):
+            # 落ち着いていないいいねから先は、次の実行で読む
+            settled = list(takewhile(lambda like: like[2] < settled_before, chunk))
+            if not settled:
+                break
+            chunk = settled
+            tweet_ids = {tweet_id for _, tweet_id, _ in chunk}
+            active = Like.objects.using(db).filter(tweet_id__in=tweet_ids, created_at__gte=settled_before)
+            tweet_ids -= set(active.values_list("tweet_id", flat=True).distinct())
+            Tweet.objects.using(db).filter(pk__in=tweet_ids).update(like_count=like_count_expression())
+            reconciled += len(tweet_ids)
+            checkpoint.position = chunk[-1][0]
+            checkpoint.save(update_fields=["position", "updated_at"])
+    return reconciled
+
+
+reset()
+# プロセスの終了時に、まだ反映していない増減を書き込む
+atexit.register(fold)
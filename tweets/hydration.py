@@ -0,0 +1,136 @@
+"""
+ツイートのIDのlistを、一覧の表示に使うTweetViewのlistにまとめて変換します
+
+    tweets = hydrate(tweet_ids, request.user)
+
+IDの数に関わらず、読み込むのは次のものだけ(シャーディング時はシャードごと)
+- ツイートの本文・投稿者・作成日時: tweets.caches.tweets(キャッシュになければ1クエリ)
+- いいね数: 1クエリ(いいねのたびに変わるので、キャッシュしない)
+- 投稿者: accounts.caches.users(キャッシュになければ1クエリ)
+- 閲覧者がいいねしたか: 1クエリ
+
+順序はIDのlistの通りで、削除された(またはアーカイブされた)IDは除く
+"""
+
+from accounts.caches import users
+from mysite import urlbuilder
+
+from . import sharding
+from .caches import tweets
+from .models import Like, Tweet
+
+
+class AuthorView:
+    __slots__ = ("id", "username")
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __str__(self):
+        return self.username
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def profile_url(self):
+        return urlbuilder.build("accounts:user_profile", self.username)
+
+
+class TweetView:
+    """
+    テンプレートでTweetの代わりに使える、表示に必要な値だけを持つオブジェクト
+    """
+
+    __slots__ = ("id", "author", "content", "created_at", "like_count", "is_liked")
+    is_archived = False
+
+    def __init__(self, id, author, content, created_at, like_count, is_liked):
+        self.id = id
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+        self.like_count = like_count
+        self.is_liked = is_liked
+
+    def __repr__(self):
+        return f"<TweetView {self.id}>"
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def author_id(self):
+        return self.author.id
+
+    @property
+    def detail_url(self):
+        return urlbuilder.build("tweets:detail", self.id)
+
+    @property
+    def delete_url(self):
+        return urlbuilder.build("tweets:delete", self.id)
+
+    @property
+    def like_url(self):
+        return urlbuilder.build("tweets:like", self.id)
+
+    @property
+    def unlike_url(self):
+        return urlbuilder.build("tweets:unlike", self.id)
+
+
+def like_counts(tweet_ids):
+    counts = {}
+    for db, ids in sharding.group_by_shard(tweet_ids).items():
+        counts.update(Tweet.objects.using(db).filter(pk__in=ids).values_list("pk", "like_count"))
+    return counts
+
+
+def liked_tweet_ids(viewer, tweet_ids):
+    # いいねはツイートと同じシャードにある
+    if viewer is None or not viewer.is_authenticated:
+        return set()
+    liked = set()
+    for db, ids in sharding.group_by_shard(tweet_ids).items():
+        liked.update(
+            Like.objects.using(db).filter(user_id=viewer.pk, tweet_id__in=ids).values_list("tweet_id", flat=True)
+        )
+    return liked
+
+
+def hydrate(tweet_ids, viewer=None):
+    """
+    tweet_idsのツイートをTweetViewのlistにする。viewerを渡すと、viewerがいいねしたかをis_likedに入れる
+    """
+    tweet_ids = list(dict.fromkeys(tweet_ids))
+    if not tweet_ids:
+        return []
+    found = tweets.get_many(tweet_ids)
+    ids = [tweet_id for tweet_id in tweet_ids if tweet_id in found]
+    # キャッシュにあっても削除されている可能性があるので、いいね数が読めた(DBにある)ツイートだけを返す
+    counts = like_counts(ids)
+    ids = [tweet_id for tweet_id in ids if tweet_id in counts]
+    authors = users.get_many({found[tweet_id].author_id for tweet_id in ids})
+    liked = liked_tweet_ids(viewer, ids)
+
+    result = []
+    for tweet_id in ids:
+        tweet = found[tweet_id]
+        author = authors.get(tweet.author_id)
+        if author is None:
+            continue
+        result.append(
+            TweetView(
+                tweet_id,
+                AuthorView(author.pk, author.username),
+                tweet.content,
+                tweet.created_at,
+                counts[tweet_id],
+                tweet_id in liked,
+            )
+        )
+    return result
@@ -0,0 +1,146 @@
+"""
+時刻順に並ぶ64bitのID(snowflake形式)を生成します
+
+| 41bit: 基準時刻からのミリ秒 | 4bit: シャード番号 | 6bit: ワーカー番号 | 12bit: 同一ミリ秒内の連番 |
+
+IDの大小が作成時刻の前後と一致し、IDからツイートを保存しているシャードが分かる
+"""
+
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+# 2024-01-01 00:00:00 UTC
+EPOCH_MS = 1704067200000
+
+SHARD_BITS = 4
+WORKER_BITS = 6
+SEQUENCE_BITS = 12
+
+MAX_SHARDS = 1 << SHARD_BITS
+MAX_WORKERS = 1 << WORKER_BITS
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+WORKER_SHIFT = SEQUENCE_BITS
+SHARD_SHIFT = SEQUENCE_BITS + WORKER_BITS
+TIMESTAMP_SHIFT = SEQUENCE_BITS + WORKER_BITS + SHARD_BITS
+
+
+def make_id(timestamp_ms, shard=0, worker=0, sequence=0):
+    return (timestamp_ms - EPOCH_MS) << TIMESTAMP_SHIFT | shard << SHARD_SHIFT | worker << WORKER_SHIFT | sequence
+
+
+# 基準時刻から1日後のID(約3.6 * 10^14)。自動採番のIDがこれに達することはないので、これより小さいIDは
+# snowflake形式以前のものとみなす
+LEGACY_ID_LIMIT_MS = EPOCH_MS + 24 * 60 * 60 * 1000
+LEGACY_ID_LIMIT = make_id(LEGACY_ID_LIMIT_MS)
+
+
+def shard_of(snowflake_id):
+    return (snowflake_id >> SHARD_SHIFT) & (MAX_SHARDS - 1)
+
+
+def timestamp_ms_of(snowflake_id):
+    return (snowflake_id >> TIMESTAMP_SHIFT) + EPOCH_MS
+
+
+def id_for_datetime(value):
+    """
+    valueの時点で作成されたIDの下限。「ある時刻以降のツイート」をID(主キー)の範囲で絞り込める
+    """
+    return make_id(int(value.timestamp() * 1000))
+
+
+class WorkerLease:
+    """
+    他のプロセスと重ならないワーカー番号を、Djangoのキャッシュ(全てのプロセスで共有)のadd()で借りる
+
+    借りた番号はseconds秒で切れるので、半分を過ぎてからIDを払い出すときに延長する。
+    延長する前に切れていたら(長くIDを払い出さなかったなど)、他のプロセスが借りているかもしれないので借り直す
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.token = uuid.uuid4().hex
+        self.worker = None
+        self.expires_at = 0
+
+    @staticmethod
+    def key(worker):
+        return f"snowflake:worker:{worker}"
+
+    def current(self):
+        now = time.monotonic()
+        if self.worker is not None and now < self.expires_at - self.seconds / 2:
+            return self.worker
+        if self.worker is not None and now < self.expires_at and cache.get(self.key(self.worker)) == self.token:
+            cache.set(self.key(self.worker), self.token, self.seconds)
+        else:
+            self.worker = self.acquire()
+        self.expires_at = now + self.seconds
+        return self.worker
+
+    def acquire(self):
+        for worker in range(MAX_WORKERS):
+            if cache.add(self.key(worker), self.token, self.seconds):
+                return worker
+        raise RuntimeError(f"空いているワーカー番号がありません(同時に動かせるのは{MAX_WORKERS}プロセスまで)")
+
+
+class SnowflakeGenerator:
+    """
+    workerで固定のワーカー番号を使う。leaseを渡すと、IDを払い出すたびにlease.current()の番号を使う
+    """
+
+    def __init__(self, worker=0, lease=None):
+        if not 0 <= worker < MAX_WORKERS:
+            raise ValueError(f"worker must be in [0, {MAX_WORKERS})")
+        self.worker = worker
+        self.lease = lease
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_id(self, shard=0):
+        with self.lock:
+            worker = self.worker if self.lease is None else self.lease.current()
+            now_ms = time.time_ns() // 1_000_000
+            # 時計が戻った場合も、直前のIDより小さくならないようにする
+            now_ms = max(now_ms, self.last_ms)
+            if now_ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # 同じミリ秒内の連番を使い切ったので、次のミリ秒まで待つ
+                    while now_ms <= self.last_ms:
+                        now_ms = time.time_ns() // 1_000_000
+            else:
+                self.sequence = 0
+            self.last_ms = now_ms
+            return make_id(now_ms, shard, worker, self.sequence)
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def next_id(shard=0):
+    """
+    プロセスで共有するgeneratorからIDを払い出す
+
+    ワーカー番号はsettings.SNOWFLAKE_WORKER_IDで指定する。未指定の場合はWorkerLeaseで他のプロセスと
+    重ならない番号を借りるので、同時に動かすプロセス数はMAX_WORKERSまで
+    """
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                worker = settings.SNOWFLAKE_WORKER_ID
+                if worker is None:
+                    # 終了したプロセスの番号は、期限が切れると他のプロセスが借りられる
+                    _generator = SnowflakeGenerator(lease=WorkerLease(settings.SNOWFLAKE_WORKER_LEASE_SECONDS))
+                else:
+                    _generator = SnowflakeGenerator(worker)
+    return _generator.next_id(shard)
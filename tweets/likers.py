@@ -0,0 +1,40 @@
+"""
+ツイートに最近いいねしたユーザー(詳細画面の「Aさん、Bさんがいいねしました」)を求める処理を定義します
+
+先頭のsettings.LIKERS_SUMMARY_SIZE人のユーザー名だけをツイートごとにキャッシュし(mysite/caching.py)、
+いいね・いいね取り消しのたびに消す。詳細画面の表示でLikeを読むのは、キャッシュがないときだけ
+"""
+
+from django.conf import settings
+
+from accounts.caches import users
+from mysite import caching
+
+from . import sharding
+from .models import Like
+
+
+def cache_key(tweet_id):
+    return f"tweets:likers:{tweet_id}"
+
+
+def recent_likers(tweet_id):
+    """
+    tweet_idのツイートに最近いいねしたユーザー名のlistを新しい順に返す
+    """
+
+    def compute():
+        user_ids = list(
+            Like.objects.using(sharding.db_for_tweet(tweet_id))
+            .filter(tweet_id=tweet_id)
+            .order_by("-created_at", "-pk")
+            .values_list("user_id", flat=True)[: settings.LIKERS_SUMMARY_SIZE]
+        )
+        found = users.get_many(user_ids)
+        return [found[user_id].username for user_id in user_ids if user_id in found]
+
+    return caching.get_or_set(cache_key(tweet_id), compute, settings.LIKERS_SUMMARY_TIMEOUT, family="likers")
+
+
+def invalidate(tweet_id):
+    caching.delete(cache_key(tweet_id))
@@ -0,0 +1,41 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.deletion import delete_in_batches
+from tweets import sharding
+from tweets.archive import get_store
+from tweets.models import Like, Tweet
+
+
+class Command(BaseCommand):
+    help = "一定期間より古いツイートといいねをアーカイブ(settings.TWEET_ARCHIVE_PATH)へ移します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.TWEET_ARCHIVE_AFTER_DAYS)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        store = get_store()
+        if store is None:
+            raise CommandError("settings.TWEET_ARCHIVE_PATHが設定されていません。")
+
+        cutoff = timezone.now() - datetime.timedelta(days=options["days"])
+        batch_size = options["batch_size"]
+        total = 0
+        for db in sharding.databases():
+            # IDは作成順に並ぶので、古いツイートは主キーのindexの先頭にまとまっている
+            old_tweets = Tweet.objects.using(db).filter(created_at__lt=cutoff).order_by("pk")
+            while batch := list(old_tweets.values_list("pk", "author_id", "content", "created_at")[:batch_size]):
+                tweet_ids = [row[0] for row in batch]
+                likes = Like.objects.using(db).filter(tweet_id__in=tweet_ids)
+                store.add(batch, likes.values_list("tweet_id", "user_id").iterator(chunk_size=batch_size))
+
+                # アーカイブへの書き込みがcommitされてから、元のDBから削除する
+                for _ in delete_in_batches(likes, batch_size):
+                    pass
+                Tweet.objects.using(db).filter(pk__in=tweet_ids).delete()
+                total += len(batch)
+                self.stdout.write(f"{total}件のツイートをアーカイブしました")
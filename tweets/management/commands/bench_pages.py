@@ -0,0 +1,84 @@
+"""
+ホーム・プロフィール・フォロー一覧の、転送するバイト数とレスポンス時間(p50・p99)を計測します
+
+圧縮なし・gzip・brotli(brotliパッケージがある場合)と、ETagでの再検証(304)を比べる。
+一時ファイルのSQLiteにマイグレーションを適用し、そこにユーザー・ツイート・フォローを作って計測します
+"""
+
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from accounts.models import Follow, User
+from mysite import compression
+from tweets.models import Like, Tweet
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "ホーム・プロフィール・フォロー一覧の転送量とレスポンス時間を、圧縮・ETagの有無で比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--tweets", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            DEBUG=False, TWEET_SHARDS=[], DATABASE_REPLICAS=[], ALLOWED_HOSTS=["testserver"]
+        ):
+            connection.close()
+            connection.settings_dict["NAME"] = os.path.join(directory, "bench.sqlite3")
+            call_command("migrate", verbosity=0)
+            users = User.objects.bulk_create([User(username=f"bench{i}") for i in range(options["users"])])
+            tweets = Tweet.objects.bulk_create(
+                [Tweet(content=f"tweet {i} " * 10, author=random.choice(users)) for i in range(options["tweets"])]
+            )
+            Like.objects.bulk_create(
+                [Like(user=users[0], tweet=tweet) for tweet in random.sample(tweets, len(tweets) // 3)]
+            )
+            Follow.objects.bulk_create([Follow(follower=users[0], followed=user) for user in users[1:]])
+            Follow.objects.bulk_create([Follow(follower=user, followed=users[0]) for user in users[1:]])
+
+            client = Client()
+            client.force_login(users[0])
+            pages = {
+                "home": reverse("tweets:home"),
+                "profile": reverse("accounts:user_profile", args=[users[0].username]),
+                "following": reverse("accounts:following_list", args=[users[0].username]),
+            }
+            for name, url in pages.items():
+                self.bench_page(client, name, url, options["requests"])
+            connection.close()
+
+    def bench_page(self, client, name, url, count):
+        # CSRFのcookieを受け取ってからETagを取得する
+        client.get(url)
+        etag = client.get(url)["ETag"]
+        variants = [("identity", {"HTTP_ACCEPT_ENCODING": "identity"})]
+        variants += [(encoding, {"HTTP_ACCEPT_ENCODING": encoding}) for encoding in compression.available_encodings()]
+        variants.append(("304", {"HTTP_ACCEPT_ENCODING": "gzip, br", "HTTP_IF_NONE_MATCH": etag}))
+        for label, headers in variants:
+            sizes, times = [], []
+            for _ in range(count):
+                started_at = time.perf_counter()
+                response = client.get(url, **headers)
+                times.append(time.perf_counter() - started_at)
+                sizes.append(len(response.content))
+            self.stdout.write(
+                f"{name} {label}: {statistics.mean(sizes):.0f} bytes, "
+                f"p50 {percentile(times, 0.5) * 1000:.2f} ms, p99 {percentile(times, 0.99) * 1000:.2f} ms"
+            )
@@ -0,0 +1,154 @@
+"""
+SQLiteの設定ごとに、タイムライン表示・いいね・フォローが混ざった並行アクセスのスループットを計測します
+
+一時ファイルにtweets/accountsと同じ形のテーブルを作り、複数スレッドから直接SQLを発行します
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mysite.sqlite3.base import apply_pragmas
+
+SCHEMA = """
+CREATE TABLE accounts_user (id INTEGER PRIMARY KEY, username TEXT NOT NULL UNIQUE);
+CREATE TABLE tweets_tweet (
+    id INTEGER PRIMARY KEY, content TEXT NOT NULL, author_id INTEGER NOT NULL, created_at TEXT NOT NULL
+);
+CREATE INDEX tweets_tweet_author_id ON tweets_tweet (author_id);
+CREATE TABLE tweets_like (
+    id INTEGER PRIMARY KEY, tweet_id INTEGER NOT NULL, user_id INTEGER NOT NULL, UNIQUE (tweet_id, user_id)
+);
+CREATE INDEX tweets_like_user_id ON tweets_like (user_id);
+CREATE TABLE accounts_follow (
+    id INTEGER PRIMARY KEY, follower_id INTEGER NOT NULL, followed_id INTEGER NOT NULL, created_at TEXT NOT NULL,
+    UNIQUE (follower_id, followed_id)
+);
+"""
+
+TIMELINE_SQL = """
+SELECT t.id, t.content, u.username, (SELECT COUNT(*) FROM tweets_like l WHERE l.tweet_id = t.id)
+FROM tweets_tweet t JOIN accounts_user u ON u.id = t.author_id ORDER BY t.id DESC LIMIT 20
+"""
+
+# (名前, 接続を使い回すか, busy timeout, PRAGMA, BEGINの種類)
+PROFILES = {
+    "default": (False, 5, {}, "BEGIN"),
+    "tuned": (True, 20, settings.SQLITE_PRAGMAS, "BEGIN IMMEDIATE"),
+}
+
+
+def create_database(path, users, tweets):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO accounts_user VALUES (?, ?)", ((i, f"user{i}") for i in range(1, users + 1)))
+    conn.executemany(
+        "INSERT INTO tweets_tweet VALUES (?, ?, ?, datetime('now'))",
+        ((i, f"tweet {i}", random.randint(1, users)) for i in range(1, tweets + 1)),
+    )
+    conn.commit()
+    conn.close()
+
+
+class Worker(threading.Thread):
+    def __init__(self, path, profile, users, tweets, deadline):
+        super().__init__()
+        self.path = path
+        self.reuse_connection, self.timeout, self.pragmas, self.begin = profile
+        self.users = users
+        self.tweets = tweets
+        self.deadline = deadline
+        self.latencies = []
+        self.errors = 0
+        self.conn = None
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            apply_pragmas(self.conn, self.pragmas)
+        return self.conn
+
+    def release(self):
+        if not self.reuse_connection:
+            self.conn.close()
+            self.conn = None
+
+    def like(self, conn):
+        tweet_id, user_id = random.randint(1, self.tweets), random.randint(1, self.users)
+        conn.execute(self.begin)
+        conn.execute("INSERT OR IGNORE INTO tweets_like (tweet_id, user_id) VALUES (?, ?)", (tweet_id, user_id))
+        conn.execute("SELECT COUNT(*) FROM tweets_like WHERE tweet_id = ?", (tweet_id,)).fetchone()
+        conn.execute("COMMIT")
+
+    def follow(self, conn):
+        follower_id = random.randint(1, self.users)
+        username = f"user{random.randint(1, self.users)}"
+        conn.execute(self.begin)
+        (followed_id,) = conn.execute("SELECT id FROM accounts_user WHERE username = ?", (username,)).fetchone()
+        conn.execute(
+            "INSERT OR IGNORE INTO accounts_follow (follower_id, followed_id, created_at) VALUES (?, ?, datetime())",
+            (follower_id, followed_id),
+        )
+        conn.execute("COMMIT")
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            started_at = time.perf_counter()
+            conn = self.connect()
+            try:
+                choice = random.random()
+                if choice < 0.7:
+                    conn.execute(TIMELINE_SQL).fetchall()
+                elif choice < 0.9:
+                    self.like(conn)
+                else:
+                    self.follow(conn)
+            except sqlite3.OperationalError:
+                # "database is locked"
+                self.errors += 1
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            else:
+                self.latencies.append(time.perf_counter() - started_at)
+            self.release()
+        if self.conn is not None:
+            self.conn.close()
+
+
+class Command(BaseCommand):
+    help = "既定のSQLite設定とチューニング後の設定で、並行アクセス時のスループットを比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--tweets", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        for name, profile in PROFILES.items():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "bench.sqlite3")
+                create_database(path, options["users"], options["tweets"])
+                deadline = time.monotonic() + options["seconds"]
+                workers = [
+                    Worker(path, profile, options["users"], options["tweets"], deadline)
+                    for _ in range(options["threads"])
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+
+            latencies = sorted(latency for worker in workers for latency in worker.latencies)
+            errors = sum(worker.errors for worker in workers)
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+            self.stdout.write(
+                f"{name}: {len(latencies) / options['seconds']:.0f} ops/s, "
+                f"locked errors {errors}, p99 {p99:.1f} ms"
+            )
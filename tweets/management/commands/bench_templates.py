@@ -0,0 +1,61 @@
+"""
+100件のツイートを表示するホーム画面(tweets/home.html)の描画時間を、テンプレートのloaderの設定ごとに計測します
+
+DBは使わず、保存していないTweet・Userを描画する。最後にテンプレート・{% url %}ごとの内訳を表示する
+"""
+
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine, engines
+from django.utils import timezone
+
+from accounts.models import User
+from mysite.template_profiler import profile_templates
+from tweets.models import Tweet
+
+TEMPLATE_NAME = "tweets/home.html"
+
+
+def sample_context(count):
+    viewer = User(id=1, username="viewer")
+    authors = [User(id=i, username=f"user{i}") for i in range(1, 11)]
+    now = timezone.now()
+    tweets = []
+    for i in range(count, 0, -1):
+        tweet = Tweet(id=i, author=authors[i % len(authors)], content=f"tweet {i} " * 10, like_count=i)
+        tweet.created_at = now - datetime.timedelta(minutes=i)
+        tweets.append(tweet)
+    return {"user": viewer, "tweets": tweets, "like_list": [tweet.pk for tweet in tweets[::3]], "next_max_id": 1}
+
+
+class Command(BaseCommand):
+    help = "100件のツイートのホーム画面の描画時間を、キャッシュなし・ありのloaderで比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tweets", type=int, default=100)
+        parser.add_argument("--iterations", type=int, default=50)
+
+    def handle(self, *args, **options):
+        context = sample_context(options["tweets"])
+        configured = engines["django"].engine
+        loaders = configured.loaders[0][1]
+        common = {"dirs": configured.dirs, "libraries": configured.libraries, "builtins": configured.builtins}
+        variants = [
+            ("uncached, debug", Engine(debug=True, loaders=loaders, **common)),
+            ("uncached", Engine(debug=False, loaders=loaders, **common)),
+            ("cached", Engine(debug=False, loaders=[("django.template.loaders.cached.Loader", loaders)], **common)),
+        ]
+        for name, engine in variants:
+            engine.get_template(TEMPLATE_NAME).render(Context(context))
+            started_at = time.perf_counter()
+            for _ in range(options["iterations"]):
+                # 毎回テンプレートを探すところから計測する(リクエストごとのrender()と同じ)
+                engine.get_template(TEMPLATE_NAME).render(Context(context))
+            elapsed = (time.perf_counter() - started_at) / options["iterations"]
+            self.stdout.write(f"{name}: {elapsed * 1000:.2f} ms/render")
+
+        with profile_templates() as profile:
+            engine.get_template(TEMPLATE_NAME).render(Context(context))
+        self.stdout.write(profile.report())
@@ -0,0 +1,113 @@
+"""
+いいね・フォローの切り替え1回あたりのSQL文の数と、毎秒の切り替え回数を、以前の実装と比べて計測します
+
+一時ファイルのSQLiteにマイグレーションを適用し、そこにユーザーとツイートを作って計測します
+"""
+
+import os
+import random
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.shortcuts import get_object_or_404
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from accounts.models import Follow, User
+from accounts.toggles import delete_follow, insert_follow
+from tweets import hotkeys, toggles
+from tweets.models import Like, Tweet
+
+
+def legacy_like(user, tweet_id):
+    # 以前のLikeView/UnlikeView: ツイートを読み込んでからget_or_create(またはget)し、いいね数を更新する
+    tweet = get_object_or_404(Tweet, pk=tweet_id)
+    like, created = Like.objects.get_or_create(tweet=tweet, user=user)
+    if not created:
+        like.delete()
+    Tweet.objects.filter(pk=tweet_id).update(like_count=tweet.like_count + (1 if created else -1))
+
+
+def legacy_follow(user, username):
+    # 以前のFollowView/UnFollowView: dispatchとform_valid(またはget_object)で相手を2回読み込む
+    User.objects.get(username=username)
+    followed = User.objects.get(username=username)
+    follow = Follow.objects.filter(follower=user, followed=followed).first()
+    if follow is None:
+        Follow.objects.create(follower=user, followed=followed)
+    else:
+        follow.delete()
+
+
+def toggle_like(user, tweet_id):
+    if toggles.insert_like(tweet_id, user.pk, timezone.now()):
+        hotkeys.record_like(tweet_id, 1)
+    elif toggles.delete_like(tweet_id, user.pk):
+        hotkeys.record_like(tweet_id, -1)
+
+
+def toggle_follow(user, username):
+    if not insert_follow(user.pk, username, timezone.now()):
+        delete_follow(user.pk, username)
+
+
+IMPLEMENTATIONS = {
+    "like": (legacy_like, toggle_like),
+    "follow": (legacy_follow, toggle_follow),
+}
+
+
+class Command(BaseCommand):
+    help = "いいね・フォローの切り替えのSQL文の数とスループットを、以前の実装と比べて計測します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--toggles", type=int, default=5000)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--tweets", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # シャーディング・レプリカ・ホットなツイートの検出は使わず、1つのDBへの文の数だけを比べる
+        # DEBUG=Trueだと全ての文が記録されて遅くなるので、記録は文の数を数えるときだけにする
+        hot_tweets = {
+            "CAPACITY": 1,
+            "WINDOW_SECONDS": 1,
+            "THRESHOLD_PER_SECOND": 10**9,
+            "COUNTER_SHARDS": 1,
+            "FOLD_INTERVAL_SECONDS": 1,
+        }
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            DEBUG=False, TWEET_SHARDS=[], DATABASE_REPLICAS=[], HOT_TWEETS=hot_tweets
+        ):
+            hotkeys.reset()
+            connection.close()
+            connection.settings_dict["NAME"] = os.path.join(directory, "bench.sqlite3")
+            call_command("migrate", verbosity=0)
+            users = User.objects.bulk_create([User(username=f"bench{i}") for i in range(options["users"])])
+            tweets = Tweet.objects.bulk_create(
+                [Tweet(content=f"tweet {i}", author=random.choice(users)) for i in range(options["tweets"])]
+            )
+            targets = {
+                "like": [tweet.pk for tweet in tweets],
+                "follow": [user.username for user in users],
+            }
+            for name, implementations in IMPLEMENTATIONS.items():
+                for label, toggle in zip(("before", "after"), implementations):
+                    self.bench(f"{name} {label}", toggle, users, targets[name], options["toggles"])
+            connection.close()
+        hotkeys.reset()
+
+    def bench(self, label, toggle, users, targets, count):
+        pairs = [(random.choice(users), random.choice(targets)) for _ in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            for user, target in pairs[:100]:
+                toggle(user, target)
+
+        started_at = time.perf_counter()
+        for user, target in pairs:
+            toggle(user, target)
+        elapsed = time.perf_counter() - started_at
+
+        self.stdout.write(f"{label}: {len(queries) / 100:.2f} statements/toggle, {count / elapsed:.0f} toggles/s")
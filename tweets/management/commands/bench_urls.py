@@ -0,0 +1,46 @@
+"""
+100件のツイートの一覧で使うURL(ユーザーのプロフィール・詳細・削除・いいね)を作る時間を、
+reverse()とmysite/urlbuilder.pyで比較します。DBは使いません
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from mysite import urlbuilder
+
+
+def with_reverse(rows):
+    for pk, username in rows:
+        reverse("accounts:user_profile", args=[username])
+        reverse("tweets:detail", kwargs={"pk": pk})
+        reverse("tweets:delete", kwargs={"pk": pk})
+        reverse("tweets:like", args=[pk])
+
+
+def with_urlbuilder(rows):
+    build = urlbuilder.build
+    for pk, username in rows:
+        build("accounts:user_profile", username)
+        build("tweets:detail", pk)
+        build("tweets:delete", pk)
+        build("tweets:like", pk)
+
+
+class Command(BaseCommand):
+    help = "100件のツイートの一覧で使うURLを作る時間を、reverse()とurlbuilderで比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tweets", type=int, default=100)
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        rows = [(pk, f"user{pk % 10}") for pk in range(1, options["tweets"] + 1)]
+        for name, func in [("reverse", with_reverse), ("urlbuilder", with_urlbuilder)]:
+            func(rows)
+            started_at = time.perf_counter()
+            for _ in range(options["iterations"]):
+                func(rows)
+            elapsed = (time.perf_counter() - started_at) / options["iterations"]
+            self.stdout.write(f"{name}: {elapsed * 1000:.3f} ms/page ({len(rows) * 4} urls)")
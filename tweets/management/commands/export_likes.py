@@ -0,0 +1,24 @@
+from accounts.bulk_io import BaseExportCommand, chunked
+from accounts.models import User
+from tweets import sharding
+from tweets.models import Like
+
+
+class Command(BaseExportCommand):
+    help = "いいねを(tweet, user)のツイートIDとユーザー名でNDJSON/CSVに書き出します"
+
+    fieldnames = ("tweet", "user")
+
+    def get_rows(self, chunk_size):
+        # いいねは各ツイートのシャードにあり、シャードにはユーザーのテーブルがないので、
+        # ユーザー名は結合せずにchunkごとに1クエリでdefaultから読む
+        likes = Like.objects.order_by("pk").values_list("tweet_id", "user_id")
+        for db in sharding.databases():
+            for chunk in chunked(likes.using(db).iterator(chunk_size=chunk_size), chunk_size):
+                usernames = dict(
+                    User.objects.filter(pk__in={user_id for _, user_id in chunk}).values_list("id", "username")
+                )
+                # シャードには外部キーの制約がないので、削除中のユーザーのいいねは飛ばす
+                for tweet_id, user_id in chunk:
+                    if user_id in usernames:
+                        yield tweet_id, usernames[user_id]
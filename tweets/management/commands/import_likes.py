@@ -0,0 +1,39 @@
+from django.db import transaction
+
+from accounts.bulk_io import BaseImportCommand, resolve_usernames
+from tweets import ids, sharding
+from tweets.models import Like, Tweet, like_count_expression
+
+
+class Command(BaseImportCommand):
+    help = "export_likesで書き出したいいねを取り込みます。既存のいいねと存在しないツイート・ユーザーは無視します"
+
+    fieldnames = ("tweet", "user")
+
+    def clean_row(self, row):
+        return {**row, "tweet": int(row["tweet"])}
+
+    def import_chunk(self, rows):
+        user_ids = resolve_usernames(row["user"] for row in rows)
+        imported = 0
+        # いいねはツイートと同じシャードに保存する
+        for db, shard_tweet_ids in sharding.group_by_shard({row["tweet"] for row in rows}).items():
+            # 存在しないツイートへのいいねは外部キー制約に違反するので、chunk単位でまとめて確認しておく
+            tweet_ids = set(Tweet.objects.using(db).filter(pk__in=shard_tweet_ids).values_list("pk", flat=True))
+            likes = [
+                Like(tweet_id=row["tweet"], user_id=user_ids[row["user"]])
+                for row in rows
+                if row["tweet"] in tweet_ids and row["user"] in user_ids
+            ]
+            if sharding.is_enabled():
+                # Like.save()と同じく、シャード間で重複しないIDを払い出す
+                for like in likes:
+                    like.pk = ids.next_id(shard=ids.shard_of(like.tweet_id))
+            with transaction.atomic(using=db):
+                Like.objects.using(db).bulk_create(likes, ignore_conflicts=True)
+                # 既存のいいねと重複した行は無視されるので、いいね数は件数から数え直す
+                Tweet.objects.using(db).filter(pk__in={like.tweet_id for like in likes}).update(
+                    like_count=like_count_expression()
+                )
+            imported += len(likes)
+        return imported
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets import hotkeys
+
+
+class Command(BaseCommand):
+    help = "前回の続きからいいねを読み、いいねが落ち着いたツイートのいいね数を数え直します(cronなどで定期的に実行する)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, help="指定した秒数ごとに繰り返し実行する")
+
+    def handle(self, *args, **options):
+        while True:
+            count = hotkeys.reconcile()
+            self.stdout.write(f"数え直したツイート: {count}件")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets import trending
+
+
+class Command(BaseCommand):
+    help = "前回の続きからいいねを読み、トレンドのツイートを計算し直します(cronなどで定期的に実行する)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, help="指定した秒数ごとに繰り返し実行する")
+
+    def handle(self, *args, **options):
+        while True:
+            tweet_ids = trending.refresh()
+            self.stdout.write(f"トレンド: {len(tweet_ids)}件")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
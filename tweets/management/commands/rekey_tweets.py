@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from tweets import ids, sharding
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "自動採番されたツイートのIDを、作成日時に対応するsnowflake形式のIDに振り直します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if sharding.is_enabled():
+            raise CommandError("シャーディング時のツイートは最初からsnowflake形式のIDを持っています。")
+
+        # ツイートを参照している外部キー(いいねなど)も同じIDに付け替える
+        relations = [(relation.related_model, relation.field.attname) for relation in Tweet._meta.related_objects]
+        last_ms, sequence, total = 0, 0, 0
+        legacy = Tweet.objects.filter(pk__lt=ids.LEGACY_ID_LIMIT).order_by("created_at", "pk")
+        while batch := list(legacy.values_list("pk", "created_at")[: options["batch_size"]]):
+            with transaction.atomic():
+                for old_id, created_at in batch:
+                    # 作成日時の順序を保ったまま、同じミリ秒のツイートには連番を振る
+                    created_ms = max(int(created_at.timestamp() * 1000), ids.LEGACY_ID_LIMIT_MS, last_ms)
+                    sequence = sequence + 1 if created_ms == last_ms else 0
+                    if sequence > ids.MAX_SEQUENCE:
+                        created_ms, sequence = created_ms + 1, 0
+                    last_ms = created_ms
+                    new_id = ids.make_id(created_ms, sequence=sequence)
+
+                    Tweet.objects.filter(pk=old_id).update(id=new_id)
+                    for model, attname in relations:
+                        model.objects.filter(**{attname: old_id}).update(**{attname: new_id})
+            total += len(batch)
+            self.stdout.write(f"{total}件のIDを振り直しました")
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:08
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_like_count(apps, schema_editor):
+    Like = apps.get_model("tweets", "Like")
+    Tweet = apps.get_model("tweets", "Tweet")
+    like_count = Like.objects.filter(tweet=OuterRef("pk")).values("tweet").annotate(count=Count("pk")).values("count")
+    Tweet.objects.using(schema_editor.connection.alias).update(like_count=Coalesce(Subquery(like_count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0002_like_like_unique_like"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tweet",
+            name="like_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_like_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:12
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.utils.timezone
+
+
+def backfill_like_created_at(apps, schema_editor):
+    # 既存のいいねの作成時刻は分からないので、あり得る最も古い時刻(ツイートの作成時刻)にする。
+    # 移行した時刻のままだと、全てのいいねが新しいものとしてトレンドに数えられる
+    db = schema_editor.connection.alias
+    Like = apps.get_model("tweets", "Like")
+    Tweet = apps.get_model("tweets", "Tweet")
+    tweets = Tweet.objects.using(db).filter(pk=OuterRef("tweet_id")).values("created_at")
+    Like.objects.using(db).update(created_at=Subquery(tweets))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0003_tweet_like_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobCheckpoint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("position", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="like",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_like_created_at, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name="TrendingTweet",
+            fields=[
+                ("tweet_id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("score", models.FloatField()),
+            ],
+            options={
+                "indexes": [models.Index(fields=["-score"], name="trending_score_idx")],
+            },
+        ),
+    ]
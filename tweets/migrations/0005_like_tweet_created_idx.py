@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0004_trending"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="like",
+            index=models.Index(fields=["tweet", "-created_at"], name="like_tweet_created_idx"),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0005_like_tweet_created_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemovedLike",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("like_id", models.BigIntegerField()),
+                ("tweet_id", models.BigIntegerField()),
+                ("created_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -1,18 +1,116 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from accounts.models import User
+from mysite import urlbuilder
+
+from . import ids, sharding
 
 
 class Tweet(models.Model):
     content = models.TextField(max_length=280)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # いいね数(Likeの件数)。表示のたびにCOUNT(*)しないよう、いいね・いいね取り消しのたびに更新する
+    like_count = models.IntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        # シャーディング時はシャード間で重複しないIDを先に払い出し、保存先のシャードを決める
+        if self.pk is None and (sharding.is_enabled() or settings.TWEET_SNOWFLAKE_IDS):
+            self.pk = sharding.next_tweet_id(self.author_id)
+            kwargs["force_insert"] = True
+        if sharding.is_enabled():
+            # objects.create()はルーターで決めたDB(ヒントがないのでdefault)を渡してくるので、シャードで上書きする
+            kwargs["using"] = sharding.db_for_tweet(self.pk)
+        super().save(*args, **kwargs)
+
+    # 一覧画面で1件ごとに使うURL。{% url %}より速い(mysite/urlbuilder.py)
+    @property
+    def detail_url(self):
+        return urlbuilder.build("tweets:detail", self.pk)
+
+    @property
+    def delete_url(self):
+        return urlbuilder.build("tweets:delete", self.pk)
+
+    @property
+    def like_url(self):
+        return urlbuilder.build("tweets:like", self.pk)
+
+    @property
+    def unlike_url(self):
+        return urlbuilder.build("tweets:unlike", self.pk)
+
+    @property
+    def likers_url(self):
+        return urlbuilder.build("tweets:likers", self.pk)
 
 
 class Like(models.Model):
     # likeとtweet, userのモデル間関係は'one-to-many'
     tweet = models.ForeignKey(Tweet, related_name="liked_tweet", on_delete=models.CASCADE)
     user = models.ForeignKey(User, related_name="liking_user", on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["tweet", "user"], name="unique_like")]
+        # ツイートにいいねしたユーザーを新しい順にページ分割するためのindex
+        indexes = [models.Index(fields=["tweet", "-created_at"], name="like_tweet_created_idx")]
+
+    def save(self, *args, **kwargs):
+        # いいねはツイートと同じシャードに保存する
+        if self.pk is None and sharding.is_enabled():
+            self.pk = ids.next_id(shard=ids.shard_of(self.tweet_id))
+            kwargs["force_insert"] = True
+        if sharding.is_enabled():
+            kwargs["using"] = sharding.db_for_tweet(self.tweet_id)
+        super().save(*args, **kwargs)
+
+
+class RemovedLike(models.Model):
+    """
+    取り消された(削除された)いいね。tweets.trending.refresh()が、数えたいいねの重みをスコアから差し引くのに使う
+
+    いいねと同じシャードに、いいねの削除と同じトランザクションで保存する。ツイートは削除されていることがあるので、
+    外部キーではなくIDだけを持つ
+    """
+
+    like_id = models.BigIntegerField()
+    tweet_id = models.BigIntegerField()
+    # 削除したいいねの作成時刻
+    created_at = models.DateTimeField()
+
+
+class TrendingTweet(models.Model):
+    """
+    トレンドの候補のツイートと、時間減衰させたいいね数のスコア(対数)。tweets.trending.refresh()が更新する
+
+    シャーディング時もツイートの場所に関わらずdefaultに置くので、外部キーではなくIDだけを持つ
+    """
+
+    tweet_id = models.BigIntegerField(primary_key=True)
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=["-score"], name="trending_score_idx")]
+
+
+class JobCheckpoint(models.Model):
+    """
+    定期実行する処理が、どこまで処理したか(処理済みの最大のIDなど)を記録する
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+def like_count_expression():
+    """
+    Tweet.like_countをLikeの件数から数え直すための式。update(like_count=like_count_expression())のように使う
+    """
+    likes = Like.objects.filter(tweet=OuterRef("pk")).values("tweet").annotate(count=Count("pk")).values("count")
+    return Coalesce(Subquery(likes), 0)
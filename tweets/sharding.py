@@ -0,0 +1,136 @@
+"""
+ツイートといいねを投稿者ごとに複数のデータベース(シャード)へ分散させる処理を定義します
+
+settings.TWEET_SHARDSにシャードのDB名を並べると有効になる(空なら全てdefaultのまま)
+- ツイートは投稿者のIDで決まるシャードに保存し、シャード番号をツイートのIDに埋め込む
+- いいねはツイートと同じシャードに保存する(外部キーで結合できるように)
+- ユーザー・フォローはdefaultに置いたまま
+"""
+
+import heapq
+from itertools import chain, islice
+
+from django.conf import settings
+
+from . import ids
+
+
+def is_enabled():
+    return bool(settings.TWEET_SHARDS)
+
+
+def databases():
+    """
+    ツイートを保存しているDB名の一覧。シャーディングが無効なら通常のルーティングに任せるためNoneだけを返す
+    """
+    return list(settings.TWEET_SHARDS) or [None]
+
+
+def shard_index_for_user(user_id):
+    if not is_enabled():
+        return 0
+    return user_id % len(settings.TWEET_SHARDS)
+
+
+def db_for_user(user_id):
+    if not is_enabled():
+        return None
+    return settings.TWEET_SHARDS[shard_index_for_user(user_id)]
+
+
+def db_for_tweet(tweet_id):
+    if not is_enabled():
+        return None
+    return settings.TWEET_SHARDS[ids.shard_of(int(tweet_id))]
+
+
+def group_by_shard(tweet_ids):
+    """
+    {DB名: そのシャードのツイートのIDのlist}。シャーディングが無効ならDB名はNone
+    """
+    groups = {}
+    for tweet_id in tweet_ids:
+        groups.setdefault(db_for_tweet(tweet_id), []).append(tweet_id)
+    return groups
+
+
+def next_tweet_id(author_id):
+    return ids.next_id(shard=shard_index_for_user(author_id))
+
+
+def on_shard(queryset, db):
+    """
+    querysetをdbで評価するようにする
+
+    シャードにはユーザーのテーブルがないため、select_relatedはprefetch_relatedに置き換える
+    """
+    if db is None:
+        return queryset
+    related = queryset.query.select_related
+    if isinstance(related, dict):
+        queryset = queryset.select_related(None).prefetch_related(*related)
+    return queryset.using(db)
+
+
+def scatter(queryset):
+    """
+    querysetを全てのシャードで評価し、結果をつなげて返す
+    """
+    if not is_enabled():
+        return queryset
+    return list(chain.from_iterable(on_shard(queryset, db) for db in settings.TWEET_SHARDS))
+
+
+def scatter_gather(queryset, key, limit=None):
+    """
+    並び替え済みのquerysetを全てのシャードで評価し、keyの降順でマージして返す
+
+    各シャードから取得するのはlimit件までなので、全体の件数に関わらず1シャードあたりの読み込み量は一定
+    """
+    if not is_enabled():
+        return queryset if limit is None else queryset[:limit]
+    results = [
+        on_shard(queryset, db) if limit is None else on_shard(queryset, db)[:limit] for db in settings.TWEET_SHARDS
+    ]
+    return list(islice(heapq.merge(*results, key=key, reverse=True), limit))
+
+
+class TweetShardRouter:
+    """
+    tweetsアプリのモデルの読み書きをシャードへ振り分ける
+
+    どのシャードか分からない読み込み(Noneを返す)は、呼び出し側でusing()やscatter_gather()を使うこと
+    """
+
+    app_label = "tweets"
+
+    def db_for_instance(self, model, instance):
+        if instance is None:
+            return None
+        # シャードから読み込んだインスタンスの関連は、同じシャードにある
+        if instance._state.db in settings.TWEET_SHARDS:
+            return instance._state.db
+        if instance._meta.model_name == "tweet" and instance.pk is not None:
+            return db_for_tweet(instance.pk)
+        if instance._meta.model_name == "like" and instance.tweet_id is not None:
+            return db_for_tweet(instance.tweet_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not is_enabled() or model._meta.app_label != self.app_label:
+            return None
+        return self.db_for_instance(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # ツイート(シャード)から投稿者(default)への参照を許可する
+        if is_enabled() and self.app_label in (obj1._meta.app_label, obj2._meta.app_label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.TWEET_SHARDS:
+            return app_label == self.app_label
+        return None
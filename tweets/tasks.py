@@ -0,0 +1,23 @@
+"""
+tweetsアプリのバックグラウンドタスク(taskqueue)を定義します
+"""
+
+from mysite import page_cache
+from taskqueue.registry import task
+
+from . import hotkeys, trending
+
+
+@task("tweets.refresh_trending")
+def refresh_trending():
+    trending.refresh()
+
+
+@task("tweets.reconcile_like_counts")
+def reconcile_like_counts():
+    hotkeys.reconcile()
+
+
+@task("tweets.purge_user_pages")
+def purge_user_pages(username):
+    page_cache.purge(page_cache.user_tag(username))
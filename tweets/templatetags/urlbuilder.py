@@ -0,0 +1,13 @@
+from django import template
+
+from mysite import urlbuilder
+
+register = template.Library()
+
+
+@register.simple_tag
+def fast_url(name, value):
+    """
+    {% fast_url "accounts:follow" user.username %}。{% url %}と同じURLを、URLパターンの照合なしで返す
+    """
+    return urlbuilder.build(name, value)
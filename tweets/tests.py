@@ -1,9 +1,33 @@
+import datetime
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from accounts.data_export import iter_user_records
+from accounts.deletion import delete_user
+from mysite import objcache
+from mysite.test_runner import TEST_TWEET_SHARDS
+from notifications.models import Notification
+from taskqueue.models import Task
+from taskqueue.worker import run_pending
 
-from .models import Like, Tweet
+from . import archive, hotkeys, hydration, ids, likers, sharding, toggles, trending
+from .ids import SnowflakeGenerator, WorkerLease
+from .models import JobCheckpoint, Like, RemovedLike, TrendingTweet, Tweet
+from .sharding import TweetShardRouter
 
 User = get_user_model()
 
@@ -22,8 +46,58 @@ class TestHomeView(TestCase):
         response = self.client.get(self.url)
 
         self.assertEqual(response.status_code, 200)
-        # contextに含まれているツイート = DBに保存されているツイートか
-        self.assertEqual(list(response.context["tweets"]), list(Tweet.objects.all()))
+        # contextに含まれているツイート = DBに保存されているツイートか(TweetViewなのでIDで比べる)
+        self.assertEqual(
+            [tweet.pk for tweet in response.context["tweets"]], [tweet.pk for tweet in Tweet.objects.all()]
+        )
+
+    def test_success_get_paginated_by_id(self):
+
+        Tweet.objects.bulk_create([Tweet(content=f"tweet {i}", author=self.user) for i in range(24)])
+        newest_first = list(Tweet.objects.order_by("-pk").values_list("pk", flat=True))
+
+        response = self.client.get(self.url)
+        first_page = response.context["tweets"]
+        response = self.client.get(self.url, {"max_id": response.context["next_max_id"]})
+        second_page = response.context["tweets"]
+
+        self.assertEqual([tweet.pk for tweet in first_page + second_page], newest_first)
+        self.assertIsNone(response.context["next_max_id"])
+
+    def test_success_get_paginated_when_tweet_is_dropped(self):
+
+        Tweet.objects.bulk_create([Tweet(content=f"tweet {i}", author=self.user) for i in range(24)])
+        newest_first = list(Tweet.objects.order_by("-pk").values_list("pk", flat=True))
+        dropped = newest_first[0]
+        like_counts = hydration.like_counts
+        # IDを読んだ後に削除されたツイートは、TweetViewにするときに除かれる
+        with mock.patch.object(
+            hydration, "like_counts", lambda tweet_ids: like_counts([pk for pk in tweet_ids if pk != dropped])
+        ):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.context["tweets"]), 19)
+        # 次のページの判定は除く前のIDで行うので、ページ分割は途切れない
+        self.assertEqual(response.context["next_max_id"], newest_first[19])
+
+    def test_success_get_with_invalid_max_id(self):
+
+        # 主キーの範囲外のmax_id・since_idは無視する
+        for params in [{"max_id": "99999999999999999999"}, {"since_id": "-99999999999999999999"}]:
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context["tweets"]), 1)
+
+    def test_success_get_with_since_id(self):
+
+        oldest = Tweet.objects.get()
+        newer = Tweet.objects.create(content="This is a newer tweet.", author=self.user)
+
+        response = self.client.get(self.url, {"since_id": oldest.pk})
+
+        self.assertEqual([tweet.pk for tweet in response.context["tweets"]], [newer.pk])
 
 
 class TestTweetCreateView(TestCase):
@@ -55,6 +129,13 @@ class TestTweetCreateView(TestCase):
         # 追加されたデータのcontent = 送信されたcontentか？
         self.assertEqual(Tweet.objects.last().content, valid_form_data["content"])
 
+    def test_success_post_purges_profile_pages_in_background(self):
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {"content": "This is a test tweet"})
+
+        self.assertEqual(list(Task.objects.values_list("name", "args")), [("tweets.purge_user_pages", ["testuser"])])
+
     def test_failure_post_with_empty_content(self):
 
         empty_form_data = {"content": ""}
@@ -158,6 +239,37 @@ class TestLikeView(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.filter(tweet=self.tweet, user=self.user))
+        self.assertEqual(response.json()["like_count"], 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+    def test_success_post_aggregates_notifications_in_background(self):
+        fan = User.objects.create_user(username="fan", password="testpassword")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.client.force_login(fan)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+
+        # 実行待ちのタスクがあれば追加しない
+        self.assertEqual(list(Task.objects.values_list("name", flat=True)), ["notifications.aggregate"])
+        run_pending()
+        self.assertEqual(Notification.objects.get(recipient=self.user).last_actor, fan)
+
+    def test_success_post_with_two_statements(self):
+        # セッション・ログインユーザーの読み込みの後は、いいねのINSERTといいね数のUPDATEだけ
+        # (TestCaseの中ではトランザクションがSAVEPOINTとRELEASEになり、2クエリとして数えられる)
+        with self.assertNumQueries(6):
+            self.client.post(self.url)
+
+    def test_failure_post_rolls_back_like_when_count_update_fails(self):
+        # いいね数の更新に失敗したら、いいねも保存しない
+        with mock.patch.object(hotkeys, "record_like", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.url)
+
+        self.assertFalse(Like.objects.filter(tweet=self.tweet, user=self.user))
 
     def test_failure_post_with_not_exist_tweet(self):
         url = reverse("tweets:like", kwargs={"pk": 999})  # 999 = 存在しないpk
@@ -180,7 +292,8 @@ class TestUnLikeView(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="testuser", password="testpassword")
         self.client.login(username="testuser", password="testpassword")
-        self.tweet = Tweet.objects.create(content="This is a test tweet", author=self.user)
+        # いいね済みの状態なので、like_countも1にしておく
+        self.tweet = Tweet.objects.create(content="This is a test tweet", author=self.user, like_count=1)
         self.url = reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
         Like.objects.create(tweet=self.tweet, user=self.user)
 
@@ -189,6 +302,8 @@ class TestUnLikeView(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertFalse(Like.objects.all().exists())  # DBから削除完了
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         url = reverse("tweets:delete", kwargs={"pk": 999})  # 999 = 存在しないpk
@@ -203,3 +318,656 @@ class TestUnLikeView(TestCase):
         response = self.client.post(self.url)
 
         self.assertEqual(response.status_code, 200)
+
+
+class TestLikeImportExportCommands(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(content="This is a test tweet", author=self.user)
+        Like.objects.create(tweet=self.tweet, user=self.user)
+
+    def test_success_round_trip(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "likes.ndjson")
+            call_command("export_likes", output=path, stderr=StringIO())
+            Like.objects.all().delete()
+            call_command("import_likes", input=path, stdout=StringIO())
+            # 2回目の取り込みはunique_likeにより無視される
+            call_command("import_likes", input=path, stdout=StringIO())
+
+        self.assertEqual(Like.objects.filter(tweet=self.tweet, user=self.user).count(), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+    def test_success_import_skips_not_exist_tweet(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "likes.csv")
+            with open(path, "w") as stream:
+                stream.write("tweet,user\n999,testuser\n")  # 999 = 存在しないpk
+            call_command("import_likes", input=path, format="csv", stdout=StringIO())
+
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_failure_import_with_invalid_tweet_id(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "likes.csv")
+            with open(path, "w") as stream:
+                stream.write("tweet,user\nabc,testuser\n")
+            with self.assertRaisesMessage(CommandError, "1行目の形式が不正です"):
+                call_command("import_likes", input=path, format="csv", stdout=StringIO())
+
+
+class TestSnowflakeIds(SimpleTestCase):
+
+    def test_ids_are_unique_and_increasing(self):
+
+        generator = SnowflakeGenerator(worker=1)
+        generated = [generator.next_id(shard=3) for _ in range(10000)]
+
+        self.assertEqual(generated, sorted(set(generated)))
+        self.assertTrue(all(ids.shard_of(snowflake_id) == 3 for snowflake_id in generated))
+
+    def test_ids_are_unique_across_threads(self):
+
+        generator = SnowflakeGenerator(worker=1)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            generated = list(executor.map(lambda _: generator.next_id(), range(10000)))
+
+        self.assertEqual(len(set(generated)), len(generated))
+
+    def test_leased_workers_do_not_overlap(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        first, second = WorkerLease(seconds=60), WorkerLease(seconds=60)
+
+        self.assertEqual((first.current(), second.current()), (0, 1))
+        # 期限が切れた番号は他のプロセスが借りられる
+        cache.delete(WorkerLease.key(0))
+        self.assertEqual(WorkerLease(seconds=60).current(), 0)
+
+    def test_expired_lease_is_not_reused(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        lease = WorkerLease(seconds=60)
+        generator = SnowflakeGenerator(lease=lease)
+        generator.next_id()
+        # 延長する前に切れ、その間に他のプロセスが同じ番号を借りた
+        cache.set(WorkerLease.key(0), "other", 60)
+        lease.expires_at = 0
+
+        self.assertEqual(generator.next_id() >> ids.WORKER_SHIFT & (ids.MAX_WORKERS - 1), 1)
+
+
+@override_settings(TWEET_SHARDS=["tweets_0", "tweets_1"])
+class TestTweetShardRouter(SimpleTestCase):
+
+    def setUp(self):
+        self.router = TweetShardRouter()
+
+    def test_tweet_is_routed_by_author(self):
+
+        # 投稿者のIDでシャードが決まり、ツイートのIDからも同じシャードが分かる
+        tweet = Tweet(pk=sharding.next_tweet_id(author_id=3), author_id=3)
+        like = Like(tweet_id=tweet.pk, user_id=8)
+
+        self.assertEqual(self.router.db_for_write(Tweet, instance=tweet), "tweets_1")
+        self.assertEqual(self.router.db_for_write(Like, instance=like), "tweets_1")
+        self.assertEqual(sharding.db_for_tweet(tweet.pk), sharding.db_for_user(3))
+
+    def test_users_are_not_routed(self):
+
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertFalse(self.router.allow_migrate("tweets_0", "accounts"))
+        self.assertTrue(self.router.allow_migrate("tweets_0", "tweets"))
+
+    def test_scatter_gather_merges_newest_first(self):
+
+        shard_results = {"tweets_0": [5, 3, 1], "tweets_1": [6, 4, 2]}
+        with mock.patch.object(sharding, "on_shard", lambda queryset, db: shard_results[db]):
+            merged = sharding.scatter_gather(None, key=lambda value: value, limit=4)
+
+        self.assertEqual(merged, [6, 5, 4, 3])
+
+
+@override_settings(TWEET_SHARDS=TEST_TWEET_SHARDS)
+class TestShardedDatabases(TransactionTestCase):
+    """
+    2つのSQLiteのDB(settings.DATABASESのtweets_0, tweets_1)をシャードにして、ツイート・いいねを読み書きする
+    """
+
+    # TestCaseは終了時に外部キーを検査し、シャードのツイートの投稿者(defaultにある)を違反とみなすので使わない
+    databases = {"default", "tweets_0", "tweets_1"}
+
+    def setUp(self):
+        for db in settings.TWEET_SHARDS:
+            # テスト用のDBを作るmigrateで、外部キーの制約が有効に戻っている
+            with connections[db].cursor() as cursor:
+                cursor.execute("PRAGMA foreign_keys = OFF")
+        cache.clear()
+        objcache.clear_local()
+        self.addCleanup(cache.clear)
+        # 主キーが連続するので、2人の投稿は別々のシャードに入る
+        self.alice = User.objects.create_user(username="alice", password="testpassword")
+        self.bob = User.objects.create_user(username="bob", password="testpassword")
+        self.alice_db = sharding.db_for_user(self.alice.pk)
+        self.bob_db = sharding.db_for_user(self.bob.pk)
+
+    def like(self, user, tweet):
+        self.client.force_login(user)
+        return self.client.post(reverse("tweets:like", kwargs={"pk": tweet.pk})).json()
+
+    def test_tweets_and_likes_are_stored_on_author_shard(self):
+        alice_tweet = Tweet.objects.create(content="alice", author=self.alice)
+        bob_tweet = Tweet.objects.create(content="bob", author=self.bob)
+
+        self.assertEqual(self.like(self.bob, alice_tweet)["like_count"], 1)
+
+        self.assertNotEqual(self.alice_db, self.bob_db)
+        # いいねはいいねしたユーザーではなく、ツイートと同じシャードに入る
+        self.assertEqual(list(Tweet.objects.using(self.alice_db).values_list("pk", flat=True)), [alice_tweet.pk])
+        self.assertEqual(list(Tweet.objects.using(self.bob_db).values_list("pk", flat=True)), [bob_tweet.pk])
+        self.assertEqual(
+            list(Like.objects.using(self.alice_db).values_list("tweet_id", "user_id")), [(alice_tweet.pk, self.bob.pk)]
+        )
+        self.assertFalse(Like.objects.using(self.bob_db).exists())
+        self.assertFalse(Tweet.objects.using("default").exists())
+
+        # 詳細画面はツイートのIDからシャードを決めて読む
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": alice_tweet.pk}))
+        self.assertEqual(response.context["tweet"].like_count, 1)
+        self.assertEqual(response.context["like_list"], [alice_tweet.pk])
+
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": alice_tweet.pk}))
+        self.assertFalse(Like.objects.using(self.alice_db).exists())
+        self.assertEqual(Tweet.objects.using(self.alice_db).get(pk=alice_tweet.pk).like_count, 0)
+
+    def test_home_merges_all_shards_newest_first(self):
+        tweets = [Tweet.objects.create(content=f"tweet {i}", author=(self.alice, self.bob)[i % 2]) for i in range(5)]
+        self.like(self.alice, tweets[1])
+
+        response = self.client.get(reverse("tweets:home"))
+
+        self.assertEqual(
+            [tweet.pk for tweet in response.context["tweets"]], sorted((tweet.pk for tweet in tweets), reverse=True)
+        )
+        self.assertEqual(response.context["like_list"], [tweets[1].pk])
+        self.assertEqual(
+            {sharding.db_for_tweet(tweet.pk) for tweet in tweets},
+            {self.alice_db, self.bob_db},
+        )
+        # ETagもシャードだけから作る(シャードにはユーザーのテーブルがない)
+        response = self.client.get(reverse("tweets:home"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_export_and_import_likes_on_every_shard(self):
+        alice_tweet = Tweet.objects.create(content="alice", author=self.alice)
+        bob_tweet = Tweet.objects.create(content="bob", author=self.bob)
+        self.like(self.bob, alice_tweet)
+        self.like(self.alice, bob_tweet)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "likes.ndjson")
+            call_command("export_likes", output=path, stderr=StringIO())
+            with open(path) as stream:
+                exported = sorted(json.loads(line)["tweet"] for line in stream)
+            for db in settings.TWEET_SHARDS:
+                Like.objects.using(db).all().delete()
+            stdout = StringIO()
+            call_command("import_likes", input=path, stdout=stdout)
+
+        self.assertEqual(exported, sorted([alice_tweet.pk, bob_tweet.pk]))
+        self.assertIn("skipped (存在しないユーザー・ツイートなど): 0件", stdout.getvalue())
+        for db, tweet, user in ((self.alice_db, alice_tweet, self.bob), (self.bob_db, bob_tweet, self.alice)):
+            like = Like.objects.using(db).get()
+            self.assertEqual((like.tweet_id, like.user_id), (tweet.pk, user.pk))
+            # Like.save()と同じく、snowflake形式のIDを払い出す
+            self.assertEqual(ids.shard_of(like.pk), ids.shard_of(tweet.pk))
+            self.assertEqual(Tweet.objects.using(db).get(pk=tweet.pk).like_count, 1)
+
+    def test_duplicate_like_id_is_not_taken_for_already_liked(self):
+        tweet = Tweet.objects.create(content="alice", author=self.alice)
+        other = Tweet.objects.create(content="alice 2", author=self.alice)
+        self.like(self.bob, tweet)
+        existing = Like.objects.using(self.alice_db).get()
+
+        # 同じワーカー番号のプロセスが同じIDを払い出した
+        with mock.patch.object(ids, "next_id", return_value=existing.pk):
+            with self.assertRaises(IntegrityError):
+                toggles.insert_like(other.pk, self.alice.pk, timezone.now())
+
+    def test_shards_have_only_tweet_tables(self):
+        tables = connections[self.alice_db].introspection.table_names()
+
+        self.assertIn("tweets_tweet", tables)
+        self.assertNotIn("accounts_user", tables)
+
+    def test_delete_user_on_every_shard(self):
+        alice_tweet = Tweet.objects.create(content="alice", author=self.alice)
+        bob_tweet = Tweet.objects.create(content="bob", author=self.bob)
+        self.like(self.alice, bob_tweet)
+        self.like(self.bob, alice_tweet)
+
+        delete_user(self.alice, batch_size=1)
+
+        self.assertFalse(Tweet.objects.using(self.alice_db).exists())
+        self.assertFalse(Like.objects.using(self.alice_db).exists())
+        # bobのシャードからもaliceのいいねを消し、いいね数を減らす
+        self.assertFalse(Like.objects.using(self.bob_db).exists())
+        self.assertEqual(Tweet.objects.using(self.bob_db).get(pk=bob_tweet.pk).like_count, 0)
+
+
+class TestSnowflakeTweetIds(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+
+    @override_settings(TWEET_SNOWFLAKE_IDS=True)
+    def test_new_tweet_gets_snowflake_id(self):
+
+        legacy = Tweet.objects.bulk_create([Tweet(content="legacy", author=self.user)])[0]
+        tweet = Tweet.objects.create(content="This is a test tweet", author=self.user)
+
+        self.assertGreaterEqual(tweet.pk, ids.LEGACY_ID_LIMIT)
+        self.assertEqual(list(Tweet.objects.order_by("pk")), [legacy, tweet])
+
+    def test_rekey_tweets_command(self):
+
+        tweets = Tweet.objects.bulk_create([Tweet(content=f"tweet {i}", author=self.user) for i in range(3)])
+        Like.objects.create(tweet=tweets[1], user=self.user)
+
+        call_command("rekey_tweets", batch_size=2, stdout=StringIO())
+
+        rekeyed = list(Tweet.objects.order_by("pk"))
+        self.assertTrue(all(tweet.pk >= ids.LEGACY_ID_LIMIT for tweet in rekeyed))
+        # 並び順は作成順のまま、いいねも新しいIDを参照している
+        self.assertEqual([tweet.content for tweet in rekeyed], ["tweet 0", "tweet 1", "tweet 2"])
+        self.assertEqual(Like.objects.get().tweet, rekeyed[1])
+
+
+class TestArchiveTweets(TestCase):
+
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(TWEET_ARCHIVE_PATH=os.path.join(directory, "archive.sqlite3")))
+
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.old_tweet = Tweet.objects.create(content="This is an old tweet", author=self.user)
+        Tweet.objects.filter(pk=self.old_tweet.pk).update(created_at=timezone.now() - datetime.timedelta(days=400))
+        Like.objects.create(tweet=self.old_tweet, user=self.user)
+        self.new_tweet = Tweet.objects.create(content="This is a new tweet", author=self.user)
+
+        call_command("archive_tweets", days=365, stdout=StringIO())
+
+    def test_old_tweets_are_moved(self):
+
+        self.assertEqual(list(Tweet.objects.all()), [self.new_tweet])
+        self.assertFalse(Like.objects.exists())
+
+    def test_success_get_archived_detail(self):
+
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.old_tweet.pk}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweet"].content, "This is an old tweet")
+        self.assertEqual(response.context["tweet"].like_count, 1)
+
+    def test_success_get_profile_continues_into_archive(self):
+
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": self.user.username}))
+
+        self.assertEqual(
+            [tweet.pk for tweet in response.context["specific_user_tweets"]], [self.new_tweet.pk, self.old_tweet.pk]
+        )
+
+    def test_archived_tweets_load_authors_at_once(self):
+        other_tweet = Tweet.objects.create(content="This is another old tweet", author=self.user)
+        Tweet.objects.filter(pk=other_tweet.pk).update(created_at=timezone.now() - datetime.timedelta(days=400))
+        call_command("archive_tweets", days=365, stdout=StringIO())
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            tweets = archive.get_store().tweets_by_author(self.user.pk, None, 10)
+
+        self.assertEqual([tweet.author for tweet in tweets], [self.user, self.user])
+
+    def test_success_delete_archived_tweet(self):
+
+        response = self.client.post(reverse("tweets:delete", kwargs={"pk": self.old_tweet.pk}))
+
+        self.assertRedirects(response, reverse(settings.LOGIN_REDIRECT_URL))
+        self.assertIsNone(archive.get_store().get_tweet(self.old_tweet.pk))
+
+    def test_failure_delete_archived_tweet_of_other_user(self):
+        User.objects.create_user(username="otheruser", password="testpassword")
+        self.client.login(username="otheruser", password="testpassword")
+
+        response = self.client.post(reverse("tweets:delete", kwargs={"pk": self.old_tweet.pk}))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertIsNotNone(archive.get_store().get_tweet(self.old_tweet.pk))
+
+    def test_export_includes_archived_records(self):
+
+        records = list(iter_user_records(self.user))
+
+        self.assertIn(
+            {"type": "tweet", "id": self.old_tweet.pk, "content": "This is an old tweet", "created_at": mock.ANY},
+            records,
+        )
+        self.assertIn({"type": "like", "tweet_id": self.old_tweet.pk}, records)
+
+    def test_delete_user_purges_archive(self):
+        fan = User.objects.create_user(username="fan")
+        store = archive.get_store()
+        store.add([], [(self.old_tweet.pk, fan.pk)])
+
+        delete_user(self.user)
+
+        self.assertIsNone(store.get_tweet(self.old_tweet.pk))
+        self.assertEqual(list(store.iter_user_records(fan.pk)), [])
+
+
+class TestHotTweets(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(content="This is a hot tweet", author=self.user)
+        self.fans = User.objects.bulk_create([User(username=f"fan{i}") for i in range(5)])
+        # 1区間に2件以上のいいねでホットとみなし、自動では反映しない
+        config = {**settings.HOT_TWEETS, "THRESHOLD_PER_SECOND": 2, "WINDOW_SECONDS": 1, "FOLD_INTERVAL_SECONDS": 3600}
+        # 後に登録したcleanupから実行されるので、設定を戻してから作り直す
+        self.addCleanup(hotkeys.reset)
+        self.enterContext(override_settings(HOT_TWEETS=config))
+        hotkeys.reset()
+
+    def like(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk})).json()
+
+    def test_hot_tweet_likes_are_folded_later(self):
+        like_counts = [self.like(fan)["like_count"] for fan in self.fans]
+
+        self.assertEqual(like_counts, [1, 2, 3, 4, 5])
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)  # 2件目以降はメモリ上のカウンタに溜まっている
+
+        hotkeys.fold()
+
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 5)
+
+    def test_hot_tweet_likes_are_not_folded_in_the_request(self):
+        config = {**settings.HOT_TWEETS, "THRESHOLD_PER_SECOND": 2, "WINDOW_SECONDS": 1, "FOLD_INTERVAL_SECONDS": 0}
+
+        with override_settings(HOT_TWEETS=config), mock.patch.object(hotkeys, "start_folding") as start_folding:
+            for fan in self.fans:
+                self.like(fan)
+
+        # 反映はリクエストのトランザクションの外で、スレッドが行う
+        start_folding.assert_called()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+    def test_reconcile_restores_lost_deltas(self):
+        for fan in self.fans:
+            self.like(fan)
+        # 反映する前にプロセスが強制終了された
+        hotkeys.reset()
+
+        # 最後のいいねから時間が経っていなければ、他のプロセスに増減が残っているかもしれないので数え直さない
+        self.assertEqual(hotkeys.reconcile(), 0)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+        self.assertEqual(hotkeys.reconcile(now=timezone.now() + datetime.timedelta(minutes=2)), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 5)
+
+    def test_hot_tweets_view_is_staff_only(self):
+        self.like(self.fans[0])
+        self.like(self.fans[1])
+        url = reverse("tweets:hot")
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        staff = User.objects.create_user(username="staff", password="testpassword", is_staff=True)
+        self.client.force_login(staff)
+        hot_tweets = self.client.get(url).json()["hot_tweets"]
+
+        self.assertEqual([(row["tweet_id"], row["pending"]) for row in hot_tweets], [(self.tweet.pk, 1)])
+
+    def test_delete_user_decrements_like_count(self):
+        self.like(self.fans[0])
+        hotkeys.fold()
+
+        delete_user(self.fans[0], batch_size=1)
+
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+
+class TestTrending(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.fans = User.objects.bulk_create([User(username=f"fan{i}") for i in range(3)])
+        self.now = timezone.now()
+        self.addCleanup(cache.delete, trending.CACHE_KEY)
+
+    def like(self, tweet, users, hours_ago):
+        Like.objects.bulk_create(
+            [Like(tweet=tweet, user=user, created_at=self.now - datetime.timedelta(hours=hours_ago)) for user in users]
+        )
+
+    def test_recent_likes_outweigh_old_likes(self):
+        old = Tweet.objects.create(content="old", author=self.user)
+        recent = Tweet.objects.create(content="recent", author=self.user)
+        # 半減期(6時間)の3倍前の3件は、今の0.375件分
+        self.like(old, self.fans, hours_ago=18)
+        self.like(recent, self.fans[:1], hours_ago=0)
+
+        self.assertEqual(trending.refresh(now=self.now), [recent.pk])  # oldはMIN_LIKESを下回る
+
+        score = TrendingTweet.objects.get(tweet_id=recent.pk).score
+        self.assertAlmostEqual(trending.decayed_likes(score, self.now), 1)
+
+    def test_refresh_is_incremental(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        self.like(tweet, self.fans[:1], hours_ago=0)
+        trending.refresh(now=self.now)
+        self.like(tweet, self.fans[1:], hours_ago=0)
+
+        trending.refresh(now=self.now)
+        # 前回までに数えたいいねは、もう一度実行しても数え直さない
+        trending.refresh(now=self.now)
+
+        score = TrendingTweet.objects.get(tweet_id=tweet.pk).score
+        self.assertAlmostEqual(trending.decayed_likes(score, self.now), 3)
+        checkpoint = JobCheckpoint.objects.get(name=trending.checkpoint_name(None))
+        self.assertEqual(checkpoint.position, Like.objects.latest("pk").pk)
+
+    def unlike(self, tweet, users):
+        for user in users:
+            with transaction.atomic():
+                toggles.delete_like(tweet.pk, user.pk)
+
+    def test_refresh_subtracts_unlikes(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        unliked = Tweet.objects.create(content="unliked", author=self.user)
+        self.like(tweet, self.fans, hours_ago=0)
+        self.like(unliked, self.fans[:1], hours_ago=0)
+        trending.refresh(now=self.now)
+
+        # いいねの取り消しは続きからは読めないが、記録した取り消しの重みを差し引く。いいねは読み直さない
+        self.unlike(tweet, self.fans[1:])
+        self.unlike(unliked, self.fans[:1])
+
+        with CaptureQueriesContext(connections["default"]) as queries:
+            self.assertEqual(trending.refresh(now=self.now), [tweet.pk])
+
+        like_table = f'FROM "{Like._meta.db_table}"'
+        self.assertFalse([query for query in queries if like_table in query["sql"] and " IN (" in query["sql"]])
+        score = TrendingTweet.objects.get(tweet_id=tweet.pk).score
+        self.assertAlmostEqual(trending.decayed_likes(score, self.now), 1)
+        self.assertFalse(RemovedLike.objects.exists())
+
+    def test_refresh_ignores_unlikes_not_counted(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        self.like(tweet, self.fans[:1], hours_ago=0)
+        trending.refresh(now=self.now)
+        # 数える前に取り消されたいいねは、スコアから差し引かない
+        self.like(tweet, self.fans[1:], hours_ago=0)
+        self.unlike(tweet, self.fans[1:])
+
+        self.assertEqual(trending.refresh(now=self.now), [tweet.pk])
+        score = TrendingTweet.objects.get(tweet_id=tweet.pk).score
+        self.assertAlmostEqual(trending.decayed_likes(score, self.now), 1)
+
+    def test_refresh_subtracts_likes_of_deleted_users(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        self.like(tweet, self.fans, hours_ago=0)
+        trending.refresh(now=self.now)
+
+        delete_user(self.fans[0])
+
+        trending.refresh(now=self.now)
+        score = TrendingTweet.objects.get(tweet_id=tweet.pk).score
+        self.assertAlmostEqual(trending.decayed_likes(score, self.now), 2)
+
+    def test_refresh_drops_deleted_tweets(self):
+        tweet = Tweet.objects.create(content="tweet", author=self.user)
+        self.like(tweet, self.fans, hours_ago=0)
+        trending.refresh(now=self.now)
+
+        tweet.delete()
+
+        self.assertEqual(trending.refresh(now=self.now), [])
+
+    def test_cached_ids_expire(self):
+        # refresh_trendingは別のプロセスで動くので、画面のプロセスのキャッシュは期限付きにする
+        with mock.patch.object(trending, "cache") as cache_mock:
+            cache_mock.get.return_value = None
+            trending.trending_tweet_ids()
+
+        cache_mock.set.assert_called_once_with(trending.CACHE_KEY, [], settings.TRENDING["CACHE_TIMEOUT"])
+
+    def test_trending_view(self):
+        first = Tweet.objects.create(content="first", author=self.user)
+        second = Tweet.objects.create(content="second", author=self.user)
+        self.like(first, self.fans[:1], hours_ago=0)
+        self.like(second, self.fans, hours_ago=0)
+        call_command("refresh_trending", stdout=StringIO())
+        first.delete()
+
+        response = self.client.get(reverse("tweets:trending"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tweet.pk for tweet in response.context["tweets"]], [second.pk])
+
+
+class TestLikers(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(content="This is a test tweet", author=self.user)
+        now = timezone.now()
+        self.fans = User.objects.bulk_create([User(username=f"fan{i}") for i in range(25)])
+        Like.objects.bulk_create(
+            [
+                Like(tweet=self.tweet, user=fan, created_at=now - datetime.timedelta(minutes=i))
+                for i, fan in enumerate(self.fans)
+            ]
+        )
+        cache.clear()
+        objcache.clear_local()
+        self.addCleanup(cache.clear)
+
+    def test_recent_likers_are_cached(self):
+
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+
+        self.assertEqual(response.context["recent_likers"], ["fan0", "fan1", "fan2"])
+        with self.assertNumQueries(0):
+            likers.recent_likers(self.tweet.pk)
+
+    def test_recent_likers_are_invalidated_on_like(self):
+        likers.recent_likers(self.tweet.pk)
+
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+
+        self.assertEqual(likers.recent_likers(self.tweet.pk), ["testuser", "fan0", "fan1"])
+
+    def test_likers_view_is_paginated_by_recency(self):
+        url = reverse("tweets:likers", kwargs={"pk": self.tweet.pk})
+
+        response = self.client.get(url)
+        first_page = [like.user.username for like in response.context["likes"]]
+        response = self.client.get(url, {"cursor": response.context["next_cursor"]})
+        second_page = [like.user.username for like in response.context["likes"]]
+
+        self.assertEqual(first_page + second_page, [fan.username for fan in self.fans])
+        self.assertIsNone(response.context["next_cursor"])
+
+    def test_likers_view_of_not_exist_tweet(self):
+
+        response = self.client.get(reverse("tweets:likers", kwargs={"pk": 999}))  # 999 = 存在しないpk
+
+        self.assertEqual(response.status_code, 404)
+
+
+class TestHydration(TestCase):
+
+    def setUp(self):
+        # bulk_create()はシグナルを出さないので、前のテストの同じ主キーのユーザーがプロセス内に残らないようにする
+        cache.clear()
+        objcache.clear_local()
+        self.addCleanup(cache.clear)
+        self.addCleanup(objcache.clear_local)
+        self.viewer = User.objects.create_user(username="viewer", password="testpassword")
+        self.authors = User.objects.bulk_create([User(username=f"author{i}") for i in range(5)])
+        self.tweets = [Tweet.objects.create(content=f"tweet {i}", author=self.authors[i % 5]) for i in range(20)]
+        Like.objects.create(tweet=self.tweets[3], user=self.viewer)
+
+    def test_order_and_deleted_ids(self):
+        ids = [self.tweets[5].pk, 999, self.tweets[1].pk, self.tweets[5].pk]
+        self.tweets[1].delete()
+
+        views = hydration.hydrate(ids, self.viewer)
+
+        self.assertEqual([view.pk for view in views], [self.tweets[5].pk])
+        self.assertEqual(views[0].author.username, "author0")
+        self.assertEqual(views[0].content, "tweet 5")
+
+    def test_like_count_and_viewer_state(self):
+        hydration.hydrate([tweet.pk for tweet in self.tweets], self.viewer)
+        Tweet.objects.filter(pk=self.tweets[3].pk).update(like_count=7)
+
+        view = hydration.hydrate([self.tweets[3].pk], self.viewer)[0]
+
+        self.assertEqual(view.like_count, 7)
+        self.assertTrue(view.is_liked)
+        self.assertEqual(view.like_url, reverse("tweets:like", args=[self.tweets[3].pk]))
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        # ツイート・投稿者・いいね数・閲覧者のいいね
+        with self.assertNumQueries(4):
+            hydration.hydrate([tweet.pk for tweet in self.tweets], self.viewer)
+        # ツイート・投稿者はキャッシュから読む
+        with self.assertNumQueries(2):
+            hydration.hydrate([tweet.pk for tweet in self.tweets], self.viewer)
+        with self.assertNumQueries(2):
+            hydration.hydrate([self.tweets[0].pk], self.viewer)
+
+    def test_views_are_compact(self):
+        view = hydration.hydrate([self.tweets[0].pk])[0]
+
+        self.assertFalse(hasattr(view, "__dict__"))
+        self.assertFalse(view.is_liked)
@@ -0,0 +1,94 @@
+"""
+いいね・いいね取り消しを、対象のツイートを先に読み込まずに行う処理を定義します
+
+INSERT ... ON CONFLICT (tweet_id, user_id) DO NOTHING RETURNINGとDELETE ... RETURNINGで、保存・削除できたかを1文で判定する。
+何も変わらなかったときだけ、ツイートが存在するかをもう1文で確認する
+"""
+
+from django.db import IntegrityError, connections, router
+
+from . import ids, sharding
+from .models import Like, RemovedLike, Tweet
+
+
+def db_for(model, tweet_id):
+    return sharding.db_for_tweet(tweet_id) or router.db_for_write(model)
+
+
+def tweet_exists(tweet_id, db):
+    return Tweet.objects.using(db).filter(pk=tweet_id).exists()
+
+
+def insert_like(tweet_id, user_id, created_at):
+    """
+    いいねを保存し、保存したらTrue、既にいいね済みならFalseを返す。ツイートが存在しなければTweet.DoesNotExist
+    """
+    db = db_for(Like, tweet_id)
+    connection = connections[db]
+    columns = ["tweet_id", "user_id", "created_at"]
+    values = [tweet_id, user_id, connection.ops.adapt_datetimefield_value(created_at)]
+    if sharding.is_enabled():
+        # Like.save()と同じく、シャード間で重複しないIDを払い出す
+        columns.insert(0, "id")
+        values.insert(0, ids.next_id(shard=ids.shard_of(tweet_id)))
+    quote = connection.ops.quote_name
+    sql = (
+        f"INSERT INTO {quote(Like._meta.db_table)} ({', '.join(map(quote, columns))}) "
+        f"SELECT {', '.join(['%s'] * len(values))} "
+        f"WHERE EXISTS (SELECT 1 FROM {quote(Tweet._meta.db_table)} WHERE id = %s) "
+        # 無視するのはいいね済み(unique_like)だけ。IDの重複などは例外にする
+        "ON CONFLICT (tweet_id, user_id) DO NOTHING RETURNING id"
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*values, tweet_id])
+            inserted = cursor.fetchone() is not None
+    except IntegrityError as exc:
+        # EXISTSの確認の後にツイートが削除された場合は、外部キー制約の違反になる
+        if tweet_exists(tweet_id, db):
+            raise
+        raise Tweet.DoesNotExist from exc
+    if not inserted and not tweet_exists(tweet_id, db):
+        raise Tweet.DoesNotExist
+    return inserted
+
+
+def delete_like(tweet_id, user_id):
+    """
+    いいねを削除し、削除したらTrue、いいねしていなければFalseを返す。ツイートが存在しなければTweet.DoesNotExist
+    """
+    db = db_for(Like, tweet_id)
+    connection = connections[db]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(Like._meta.db_table)} WHERE tweet_id = %s AND user_id = %s RETURNING id, created_at",
+            [tweet_id, user_id],
+        )
+        row = cursor.fetchone()
+        deleted = row is not None
+        if deleted:
+            # トレンドのスコアから差し引けるよう、同じトランザクションで記録する(呼び出し側でatomicにすること)
+            like_id, created_at = row
+            cursor.execute(
+                f"INSERT INTO {quote(RemovedLike._meta.db_table)} (like_id, tweet_id, created_at) VALUES (%s, %s, %s)",
+                [like_id, tweet_id, created_at],
+            )
+    if not deleted and not tweet_exists(tweet_id, db):
+        raise Tweet.DoesNotExist
+    return deleted
+
+
+def add_like_count(tweet_id, delta):
+    """
+    Tweet.like_countにdeltaを足し、足した後の値を返す。ツイートが存在しなければNone
+    """
+    connection = connections[db_for(Tweet, tweet_id)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {connection.ops.quote_name(Tweet._meta.db_table)} "
+            "SET like_count = like_count + %s WHERE id = %s RETURNING like_count",
+            [delta, tweet_id],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,180 @@
+"""
+いいねを時間減衰させて数え、トレンドのツイートを求める処理を定義します
+
+いいね1件の重みはexp(λ(t - 基準時刻))とし(λはsettings.TRENDING["HALF_LIFE_HOURS"]から決める)、
+ツイートごとの重みの合計の対数をスコアとして持つ。全てのツイートが同じ割合で減衰するので、
+スコアの大小は時間が経っても変わらず、新しいいいねが来たツイートだけを更新すればよい。
+
+refresh()は前回の続きからいいねを読み、上位settings.TRENDING["CANDIDATES"]件だけを候補として残す。
+取り消されたいいねは続きからは読めないので、削除と同時にRemovedLikeへ記録し、その重みをスコアから差し引く。
+結果はTrendingTweetとキャッシュに書き込み、トレンドの画面はキャッシュ(なければ表)を1回読むだけで済む。
+refresh()は別のプロセスで動くことがあるので、キャッシュはsettings.TRENDING["CACHE_TIMEOUT"]秒で切れる
+"""
+
+import heapq
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import ids, sharding
+from .models import JobCheckpoint, Like, RemovedLike, TrendingTweet, Tweet
+
+CACHE_KEY = "tweets:trending"
+CHUNK_SIZE = 5000
+
+
+def decay_rate():
+    return math.log(2) / (settings.TRENDING["HALF_LIFE_HOURS"] * 60 * 60)
+
+
+def log_weight(value):
+    """
+    時刻valueのいいね1件の重みの対数
+    """
+    return decay_rate() * (value.timestamp() - ids.EPOCH_MS / 1000)
+
+
+def logaddexp(a, b):
+    """
+    log(exp(a) + exp(b))。expの値が大きくなってもあふれないように計算する
+    """
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def logsubexp(a, b):
+    """
+    log(exp(a) - exp(b))。差が0以下(計算誤差を含む)なら-inf
+    """
+    if b >= a:
+        return -math.inf
+    return a + math.log1p(-math.exp(b - a))
+
+
+def decayed_likes(score, now):
+    """
+    スコアを、時刻nowの時点で何件分のいいねに相当するかに直す
+    """
+    return math.exp(score - log_weight(now))
+
+
+def checkpoint_name(db):
+    return f"trending:{db or 'default'}"
+
+
+def removed_checkpoint_name(db):
+    return f"trending:removed:{db or 'default'}"
+
+
+def new_likes(db, position):
+    """
+    dbのいいねのうち、IDがpositionより大きいものをIDの昇順に(ID, ツイートID, 作成時刻)で返す
+
+    IDは保存順に増えるので、前回処理した最大のIDから続きを読める
+    """
+    likes = Like.objects.using(db).order_by("pk").values_list("pk", "tweet_id", "created_at")
+    while chunk := list(likes.filter(pk__gt=position)[:CHUNK_SIZE]):
+        yield from chunk
+        position = chunk[-1][0]
+
+
+def removed_likes(db, position):
+    """
+    dbの取り消されたいいねのうち、IDがpositionより大きいものを(ID, いいねのID, ツイートID, 作成時刻)で返す
+    """
+    removed = RemovedLike.objects.using(db).order_by("pk").values_list("pk", "like_id", "tweet_id", "created_at")
+    while chunk := list(removed.filter(pk__gt=position)[:CHUNK_SIZE]):
+        yield from chunk
+        position = chunk[-1][0]
+
+
+def record_removed(likes):
+    """
+    いいねのquerysetを削除する前に、同じトランザクションの中で呼び、取り消されたいいねとして記録する
+    """
+    RemovedLike.objects.using(likes.db).bulk_create(
+        RemovedLike(like_id=pk, tweet_id=tweet_id, created_at=created_at)
+        for pk, tweet_id, created_at in likes.values_list("pk", "tweet_id", "created_at")
+    )
+
+
+def existing(tweet_ids):
+    """
+    tweet_idsのうち、削除されていないツイートのIDのset
+    """
+    found = set()
+    for db, ids_on_shard in sharding.group_by_shard(tweet_ids).items():
+        found.update(Tweet.objects.using(db).filter(pk__in=ids_on_shard).values_list("pk", flat=True))
+    return found
+
+
+def refresh(now=None):
+    """
+    前回の続きからいいねをスコアに加え、候補を絞り込んで保存する。トレンドのツイートのIDを返す
+    """
+    now = now or timezone.now()
+    config = settings.TRENDING
+    scores = dict(TrendingTweet.objects.values_list("tweet_id", "score"))
+    previous = set(scores)
+    checkpoints = []
+    removed_positions = {}
+    for db in sharding.databases():
+        checkpoint, _ = JobCheckpoint.objects.get_or_create(name=checkpoint_name(db))
+        counted = checkpoint.position
+        read = set()
+        for pk, tweet_id, created_at in new_likes(db, checkpoint.position):
+            weight = log_weight(min(created_at, now))
+            scores[tweet_id] = weight if tweet_id not in scores else logaddexp(scores[tweet_id], weight)
+            checkpoint.position = pk
+            read.add(pk)
+
+        # 取り消しは、いいねを読んだ後に読む。前回までの候補に数えたいいねか今回読んだいいねだけを差し引き、
+        # 読む前に取り消されたいいね(数えていない)は無視する。今回読めなかった取り消しは、次回は数えた側になる
+        removed, _ = JobCheckpoint.objects.get_or_create(name=removed_checkpoint_name(db))
+        for pk, like_id, tweet_id, created_at in removed_likes(db, removed.position):
+            if like_id in read or (tweet_id in previous and like_id <= counted):
+                scores[tweet_id] = logsubexp(scores[tweet_id], log_weight(min(created_at, now)))
+            removed.position = pk
+        checkpoints += [checkpoint, removed]
+        removed_positions[db] = removed.position
+
+    # 減衰していいねMIN_LIKES件分を下回った候補は捨て、残りも上位CANDIDATES件に限る。
+    # 削除されたツイート(いいねはまとめて消える)は、残った候補のうちから除く
+    threshold = log_weight(now) + math.log(config["MIN_LIKES"])
+    candidates = heapq.nlargest(
+        config["CANDIDATES"],
+        ((score, tweet_id) for tweet_id, score in scores.items() if score >= threshold),
+    )
+    found = existing([tweet_id for _, tweet_id in candidates])
+    candidates = [(score, tweet_id) for score, tweet_id in candidates if tweet_id in found]
+
+    with transaction.atomic():
+        TrendingTweet.objects.all().delete()
+        TrendingTweet.objects.bulk_create(
+            TrendingTweet(tweet_id=tweet_id, score=score) for score, tweet_id in candidates
+        )
+        for checkpoint in checkpoints:
+            checkpoint.save(update_fields=["position", "updated_at"])
+    # 差し引いた取り消しは、チェックポイントを保存した後に消す
+    for db, position in removed_positions.items():
+        RemovedLike.objects.using(db).filter(pk__lte=position).delete()
+
+    tweet_ids = [tweet_id for _, tweet_id in candidates[: config["SIZE"]]]
+    cache.set(CACHE_KEY, tweet_ids, settings.TRENDING["CACHE_TIMEOUT"])
+    return tweet_ids
+
+
+def trending_tweet_ids():
+    """
+    トレンドのツイートのIDをスコアの高い順に返す
+    """
+    tweet_ids = cache.get(CACHE_KEY)
+    if tweet_ids is None:
+        tweet_ids = list(
+            TrendingTweet.objects.order_by("-score").values_list("tweet_id", flat=True)[: settings.TRENDING["SIZE"]]
+        )
+        cache.set(CACHE_KEY, tweet_ids, settings.TRENDING["CACHE_TIMEOUT"])
+    return tweet_ids
@@ -6,9 +6,12 @@ app_name = "tweets"
 
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
+    path("trending/", views.TrendingView.as_view(), name="trending"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("<int:pk>/likers/", views.LikersView.as_view(), name="likers"),
+    path("hot/", views.HotTweetsView.as_view(), name="hot"),
 ]
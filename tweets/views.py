@@ -1,54 +1,157 @@
+from operator import attrgetter
+
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseForbidden, JsonResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import Http404, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.generic import CreateView, DeleteView, DetailView, ListView, View
 
+from accounts.caches import users
+from mysite.conditional import ConditionalGetMixin
+from mysite.idempotency import IdempotentMixin
+from mysite.pagination import IdPaginationMixin, KeysetPaginationMixin, paginate_by_id
+from mysite.ratelimit import RateLimitMixin
+from taskqueue.registry import enqueue
+
+from . import archive, hotkeys, hydration, likers, sharding, toggles, trending
 from .models import Like, Tweet
 
 
-class HomeView(LoginRequiredMixin, ListView):  # LoginRequiredMixinでログインしたユーザーのみhomeにアクセス可能
+class HomeView(
+    LoginRequiredMixin, ConditionalGetMixin, IdPaginationMixin, ListView
+):  # LoginRequiredMixinでログインしたユーザーのみhomeにアクセス可能
     model = Tweet
     template_name = "tweets/home.html"
     context_object_name = "tweets"
-    ordering = ["-created_at"]
-    queryset = Tweet.objects.select_related("author").prefetch_related("liked_tweet")
+    # ツイートのIDは作成順に増えるので、created_atではなく主キーのindexで並び替える
+    queryset = Tweet.objects.all()
+
+    def fetch_page(self, queryset, limit):
+        # 並び替えとページ分割はIDだけで行い、1ページ分をまとめてTweetViewにする(tweets/hydration.py)
+        # シャーディング時は全シャードの新しい順の結果をマージする
+        return sharding.scatter_gather(queryset.values_list("pk", flat=True), key=None, limit=limit)
+
+    def hydrate_page(self, tweet_ids):
+        return hydration.hydrate(tweet_ids, self.request.user)
+
+    def etag_parts(self):
+        # ツイートは編集できないので、表示が変わるのはいいね数・投稿者のユーザー名・閲覧者のいいねだけ
+        # シャードにはユーザーのテーブルがないので、ユーザー名は結合せずにaccounts.caches.usersから読む
+        queryset = self.get_queryset().values_list("pk", "like_count", "author_id", named=True)
+        rows, next_max_id = paginate_by_id(
+            self.request,
+            queryset,
+            self.page_size,
+            lambda queryset, limit: sharding.scatter_gather(queryset, key=attrgetter("pk"), limit=limit),
+        )
+        liked = sharding.scatter(
+            Like.objects.filter(user=self.request.user, tweet_id__in=[row.pk for row in rows]).values_list(
+                "tweet_id", flat=True
+            )
+        )
+        authors = users.get_many({row.author_id for row in rows})
+        usernames = {pk: author.username for pk, author in authors.items()}
+        rows = tuple((row.pk, row.like_count, usernames.get(row.author_id)) for row in rows)
+        return rows, next_max_id, sorted(liked)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["like_list"] = Like.objects.filter(user=self.request.user).values_list("tweet__pk", flat=True)
+        context["like_list"] = [tweet.id for tweet in context["tweets"] if tweet.is_liked]
         return context
 
 
-class TweetCreateView(LoginRequiredMixin, CreateView):
+class TrendingView(LoginRequiredMixin, ListView):
+    """
+    いいねを時間減衰させて数えたスコアの高いツイートの一覧。スコアはrefresh_trendingで事前に計算しておく
+    """
+
+    template_name = "tweets/trending.html"
+    context_object_name = "tweets"
+
+    def get_queryset(self):
+        # 計算した後に削除されたツイートは除かれる
+        return hydration.hydrate(trending.trending_tweet_ids(), self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["like_list"] = [tweet.id for tweet in context["tweets"] if tweet.is_liked]
+        return context
+
+
+class TweetCreateView(LoginRequiredMixin, IdempotentMixin, RateLimitMixin, CreateView):
     model = Tweet
     fields = ["content"]
     template_name = "tweets/create.html"
+    ratelimit_scope = "tweet_create"
 
     success_url = reverse_lazy(settings.LOGIN_REDIRECT_URL)
 
     def form_valid(self, form):
         # authorを現在ログインしているユーザーに設定
         form.instance.author = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        # 未ログインの訪問者向けのプロフィールのキャッシュは、commitの後にワーカーが消す
+        enqueue("tweets.purge_user_pages", self.request.user.username, unique=True)
+        return response
+
+
+class ArchivedTweetMixin:
+    """
+    ツイートのシャードになければ、アーカイブ(tweets/archive.py)から読み込む
+    """
 
+    def get_queryset(self):
+        return sharding.on_shard(super().get_queryset(), sharding.db_for_tweet(self.kwargs["pk"]))
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # 古いツイートはアーカイブへ移されている可能性がある
+            store = archive.get_store()
+            tweet = store.get_tweet(self.kwargs["pk"]) if store else None
+            if tweet is None:
+                raise
+            return tweet
+
+
+class TweetDetailView(LoginRequiredMixin, ArchivedTweetMixin, DetailView):
     model = Tweet
     template_name = "tweets/detail.html"
     context_object_name = "tweet"
-    queryset = Tweet.objects.select_related("author").prefetch_related("liked_tweet")
+    queryset = Tweet.objects.select_related("author")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["like_list"] = Like.objects.filter(user=self.request.user).values_list("tweet__pk", flat=True)
+        context["like_list"] = sharding.scatter(
+            Like.objects.filter(user=self.request.user).values_list("tweet_id", flat=True)
+        )
+        context["recent_likers"] = likers.recent_likers(self.object.pk)
         return context
 
 
-class TweetDeleteView(LoginRequiredMixin, DeleteView):
+class LikersView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    """
+    ツイートにいいねしたユーザーの一覧(新しい順)
+    """
+
+    template_name = "tweets/likers.html"
+    context_object_name = "likes"
+
+    def get_queryset(self):
+        tweet_id = self.kwargs["pk"]
+        db = sharding.db_for_tweet(tweet_id)
+        if not Tweet.objects.using(db).filter(pk=tweet_id).exists():
+            raise Http404("存在しないツイートです。")
+        return sharding.on_shard(Like.objects.filter(tweet_id=tweet_id).select_related("user"), db)
+
+
+class TweetDeleteView(LoginRequiredMixin, ArchivedTweetMixin, DeleteView):
     model = Tweet
     template_name = "tweets/delete.html"
     success_url = reverse_lazy(settings.LOGIN_REDIRECT_URL)
@@ -56,49 +159,84 @@ class TweetDeleteView(LoginRequiredMixin, DeleteView):
     def dispatch(self, request, *args, **kwargs):
 
         tweet = self.get_object()
-        if tweet.author != request.user:
+        # 投稿者を読み込まずに比較する(アーカイブのツイートはauthorを持たないことがある)
+        if tweet.author_id != request.user.pk:
             return HttpResponseForbidden("あなたにこのユーザーのツイートを削除する権限はありません。")
         return super().dispatch(request, *args, **kwargs)
 
+    def form_valid(self, form):
+        if getattr(self.object, "is_archived", False):
+            archive.get_store().delete_tweet(self.object.pk)
+            response = HttpResponseRedirect(self.get_success_url())
+        else:
+            response = super().form_valid(form)
+        enqueue("tweets.purge_user_pages", self.request.user.username, unique=True)
+        return response
+
 
 @method_decorator(login_required, name="dispatch")
-class LikeView(View):
+class LikeView(IdempotentMixin, RateLimitMixin, View):
+    ratelimit_scope = "like"
 
     def post(self, request, *args, **kwargs):
         tweet_id = kwargs["pk"]
-        tweet = get_object_or_404(Tweet, pk=tweet_id)
-
-        like, created = Like.objects.get_or_create(tweet=tweet, user=self.request.user)
+        # ツイートを読み込まず、INSERTの結果でいいね済みか・ツイートが存在するかを判定する
+        try:
+            # いいねとlike_countの片方だけが保存されないよう、同じトランザクションで更新する
+            with transaction.atomic(using=toggles.db_for(Like, tweet_id)):
+                created = toggles.insert_like(tweet_id, request.user.pk, timezone.now())
+                like_count = hotkeys.record_like(tweet_id, 1) if created else None
+        except Tweet.DoesNotExist as exc:
+            raise Http404("存在しないツイートにいいねすることはできません。") from exc
         if not created:
             return JsonResponse({"error": "Already Liked"}, status=200)
+        likers.invalidate(tweet_id)
+        # いいねの通知は、commitの後にワーカーがまとめる(実行待ちがあれば追加しない)
+        enqueue("notifications.aggregate", unique=True)
 
         server_data = {
             "is_liked": True,
             "tweet_id": tweet_id,
             "unlike_url": reverse("tweets:unlike", kwargs={"pk": tweet_id}),
-            "like_count": tweet.liked_tweet.count(),
+            "like_count": like_count,
         }
         return JsonResponse(server_data)
 
 
 @method_decorator(login_required, name="dispatch")
-class UnlikeView(View):
+class UnlikeView(IdempotentMixin, RateLimitMixin, View):
+    ratelimit_scope = "like"
 
     def post(self, request, *args, **kwargs):
         tweet_id = kwargs["pk"]
-        tweet = get_object_or_404(Tweet, pk=tweet_id)
-        user = self.request.user
-
         try:
-            like = Like.objects.get(tweet=tweet, user=user)
-            like.delete()
-
-            server_data = {
-                "is_liked": False,
-                "tweet_id": tweet_id,
-                "like_url": reverse("tweets:like", kwargs={"pk": tweet_id}),
-                "like_count": tweet.liked_tweet.count(),
-            }
-            return JsonResponse(server_data)
-        except Like.DoesNotExist:
+            with transaction.atomic(using=toggles.db_for(Like, tweet_id)):
+                deleted = toggles.delete_like(tweet_id, request.user.pk)
+                like_count = hotkeys.record_like(tweet_id, -1) if deleted else None
+        except Tweet.DoesNotExist as exc:
+            raise Http404("存在しないツイートのいいねは取り消せません。") from exc
+        if not deleted:
             return JsonResponse({"error": "You cannot unlike this tweet"}, status=200)
+        likers.invalidate(tweet_id)
+
+        server_data = {
+            "is_liked": False,
+            "tweet_id": tweet_id,
+            "like_url": reverse("tweets:like", kwargs={"pk": tweet_id}),
+            "like_count": like_count,
+        }
+        return JsonResponse(server_data)
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class HotTweetsView(View):
+    """
+    このプロセスで検出しているホットなツイートと、DBへ未反映のいいね数を一覧するビュー(管理者用)
+    """
+
+    def get(self, request, *args, **kwargs):
+        hot_tweets = [
+            {"tweet_id": tweet_id, "likes_per_second": round(rate, 2), "pending": hotkeys.counters.pending(tweet_id)}
+            for tweet_id, rate in hotkeys.detector.hot_tweets()
+        ]
+        return JsonResponse({"hot_tweets": hot_tweets})
@@ -1,5 +1,10 @@
+from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView
 
+from mysite.page_cache import cache_anonymous_page
 
+
+# 未ログインの訪問者には全員同じページを返すので、キャッシュから返す
+@method_decorator(cache_anonymous_page(), name="dispatch")
 class WelcomeView(TemplateView):
     template_name = "welcome/welcome.html"